@@ -0,0 +1,464 @@
+"""
+Approximate nearest-neighbour index (IVF) untuk gallery embeddings yang besar
+"""
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+from .config import (
+    ANN_ENABLED,
+    ANN_INDEX_PATH,
+    ANN_MIN_GALLERY_SIZE,
+    ANN_NLIST,
+    ANN_NPROBE,
+    ANN_RETRAIN_FACTOR,
+    ANN_TARGET_RECALL,
+    CENTROID_MIN_USERS,
+    CENTROID_TARGET_RECALL,
+    CENTROID_TOP_K,
+)
+
+
+class RowLists:
+    """
+    Kumpulan list nomor baris gallery (satu list per centroid / user) dengan
+    insert dan swap-remove O(1), mengikuti swap-remove di EmbeddingGallery
+    """
+
+    def __init__(self, count: int = 0, capacity: int = 64):
+        self.lists: List[List[int]] = [[] for _ in range(count)]
+        self._assign = np.empty(max(capacity, 64), dtype=np.int32)
+        self._pos = np.empty(max(capacity, 64), dtype=np.int64)
+
+    def ensure_lists(self, count: int):
+        """
+        Pastikan ada minimal `count` list
+        """
+        while len(self.lists) < count:
+            self.lists.append([])
+
+    def list_of(self, row: int) -> int:
+        return int(self._assign[row])
+
+    def insert(self, row: int, list_id: int):
+        """
+        Masukkan baris ke list `list_id`
+        """
+        if row >= self._assign.shape[0]:
+            capacity = max(row + 1, 2 * self._assign.shape[0])
+            self._assign = np.resize(self._assign, capacity)
+            self._pos = np.resize(self._pos, capacity)
+        self._assign[row] = list_id
+        self._pos[row] = len(self.lists[list_id])
+        self.lists[list_id].append(row)
+
+    def remove(self, row: int, last_row: int):
+        """
+        Cerminkan swap-remove di gallery: `row` dihapus lalu `last_row`
+        dipindah ke posisi `row`
+        """
+        bucket = self.lists[self._assign[row]]
+        pos = int(self._pos[row])
+        tail = bucket.pop()
+        if tail != row:
+            bucket[pos] = tail
+            self._pos[tail] = pos
+        if last_row != row:
+            bucket = self.lists[self._assign[last_row]]
+            bucket[int(self._pos[last_row])] = row
+            self._assign[row] = self._assign[last_row]
+            self._pos[row] = self._pos[last_row]
+
+    def rows(self, list_ids) -> np.ndarray:
+        """
+        Gabungan nomor baris dari beberapa list
+        """
+        rows = [row for list_id in list_ids for row in self.lists[list_id]]
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+
+class IVFIndex:
+    """
+    Inverted file index: embedding dikelompokkan ke `nlist` centroid (spherical
+    k-means), pencarian hanya memindai list dari `nprobe` centroid terdekat.
+    Index menyimpan nomor baris gallery dan di-update incremental mengikuti
+    append/remove di EmbeddingGallery.
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 16):
+        """
+        Args:
+            centroids: Matrix centroid ter-normalisasi (nlist x dim)
+            nprobe: Jumlah list yang dipindai per query
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self.trained_size = 0
+        self.row_lists = RowLists(self.nlist)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: int, nprobe: int = 16, iterations: int = 10,
+              sample_size: int = 50000, seed: int = 0) -> "IVFIndex":
+        """
+        Latih centroid dengan spherical k-means pada sampel gallery
+
+        Args:
+            matrix: Matrix gallery ter-normalisasi (n x dim)
+            nlist: Jumlah centroid
+            nprobe: Jumlah list yang dipindai per query
+            iterations: Iterasi k-means
+            sample_size: Jumlah baris maksimum untuk training
+            seed: Seed random
+
+        Returns:
+            IVFIndex yang sudah berisi seluruh baris matrix
+        """
+        rng = np.random.default_rng(seed)
+        n = matrix.shape[0]
+        nlist = max(1, min(nlist, n))
+        sample = matrix[rng.choice(n, size=min(n, sample_size), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # Centroid kosong diisi ulang dengan sampel acak
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+
+        index = cls(centroids, nprobe=nprobe)
+        index.rebuild(matrix)
+        index.trained_size = n
+        return index
+
+    def rebuild(self, matrix: np.ndarray):
+        """
+        Isi ulang semua list dari matrix gallery (satu GEMM n x nlist)
+        """
+        n = matrix.shape[0]
+        self.row_lists = RowLists(self.nlist, n)
+        if n == 0:
+            return
+        assign = self._nearest_lists(matrix, 1)[:, 0]
+        for row, list_id in enumerate(assign.tolist()):
+            self.row_lists.insert(row, list_id)
+
+    def _nearest_lists(self, vectors: np.ndarray, count: int) -> np.ndarray:
+        scores = vectors @ self.centroids.T
+        count = min(count, self.nlist)
+        if count == self.nlist:
+            return np.argsort(-scores, axis=1)
+        return np.argpartition(-scores, count - 1, axis=1)[:, :count]
+
+    def add(self, row: int, vector: np.ndarray):
+        """
+        Tambahkan baris gallery ke list centroid terdekat
+        """
+        self.row_lists.insert(row, int(np.argmax(self.centroids @ vector)))
+
+    def remove(self, row: int, last_row: int):
+        """
+        Cerminkan swap-remove di gallery
+        """
+        self.row_lists.remove(row, last_row)
+
+    def candidate_rows(self, queries: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Gabungan baris kandidat dari `nprobe` list terdekat setiap query
+
+        Args:
+            queries: Matrix query ter-normalisasi (faces x dim)
+            nprobe: Override nprobe
+
+        Returns:
+            Array nomor baris gallery (unik)
+        """
+        probes = self._nearest_lists(queries, nprobe or self.nprobe)
+        return self.row_lists.rows(np.unique(probes).tolist())
+
+    def save(self, path: Path, version: int = 0):
+        """
+        Simpan centroid index (assignment dihitung ulang saat load)
+        """
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, trained_size=self.trained_size, version=version)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, matrix: np.ndarray, nprobe: int = 16) -> Optional["IVFIndex"]:
+        """
+        Load centroid dari file dan isi list dari matrix gallery saat ini
+
+        Returns:
+            IVFIndex atau None jika file tidak ada / dimensi tidak cocok
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        data = np.load(path)
+        centroids = data["centroids"]
+        if centroids.shape[1] != matrix.shape[1]:
+            return None
+        index = cls(centroids, nprobe=nprobe)
+        index.trained_size = int(data["trained_size"])
+        index.rebuild(matrix)
+        return index
+
+
+class UserCentroidIndex:
+    """
+    Coarse index centroid per user: rata-rata embedding setiap user dipakai
+    untuk memilih top-K user kandidat per query, lalu hanya embedding milik
+    user-user tersebut yang di-scan exact. Centroid di-update incremental
+    saat embedding ditambah/dihapus.
+    """
+
+    def __init__(self, dim: int, top_k: int = 32):
+        """
+        Args:
+            dim: Dimensi embedding
+            top_k: Jumlah user kandidat per query
+        """
+        self.dim = dim
+        self.top_k = top_k
+        self._means = np.zeros((64, dim), dtype=np.float32)
+        self._counts = np.zeros(64, dtype=np.int32)
+        self.row_lists = RowLists()
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, user_index: np.ndarray, user_count: int, top_k: int = 32) -> "UserCentroidIndex":
+        """
+        Bangun centroid semua user dari matrix gallery
+
+        Args:
+            matrix: Matrix gallery ter-normalisasi (n x dim)
+            user_index: Index user per baris (n,)
+            user_count: Jumlah user
+            top_k: Jumlah user kandidat per query
+        """
+        index = cls(matrix.shape[1], top_k)
+        index._ensure_users(user_count)
+        index.row_lists = RowLists(user_count, matrix.shape[0])
+        if matrix.shape[0] == 0:
+            return index
+        counts = np.bincount(user_index, minlength=user_count).astype(np.int32)
+        sums = np.zeros((user_count, matrix.shape[1]), dtype=np.float32)
+        np.add.at(sums, user_index, matrix)
+        index._counts[:user_count] = counts
+        index._means[:user_count] = sums / np.maximum(counts, 1)[:, None]
+        for row, slot in enumerate(user_index.tolist()):
+            index.row_lists.insert(row, slot)
+        return index
+
+    def _ensure_users(self, count: int):
+        if count > self._means.shape[0]:
+            capacity = max(count, 2 * self._means.shape[0])
+            means = np.zeros((capacity, self.dim), dtype=np.float32)
+            means[:self._means.shape[0]] = self._means
+            counts = np.zeros(capacity, dtype=np.int32)
+            counts[:self._counts.shape[0]] = self._counts
+            self._means, self._counts = means, counts
+        self.row_lists.ensure_lists(count)
+
+    def add(self, row: int, user_slot: int, vector: np.ndarray):
+        """
+        Tambah baris milik user dan geser centroid user tersebut
+        """
+        self._ensure_users(user_slot + 1)
+        count = self._counts[user_slot] + 1
+        self._means[user_slot] += (vector - self._means[user_slot]) / count
+        self._counts[user_slot] = count
+        self.row_lists.insert(row, user_slot)
+
+    def remove(self, row: int, last_row: int, vector: np.ndarray):
+        """
+        Cerminkan swap-remove di gallery dan keluarkan `vector` dari centroid user-nya
+        """
+        user_slot = self.row_lists.list_of(row)
+        count = self._counts[user_slot] - 1
+        if count > 0:
+            self._means[user_slot] += (self._means[user_slot] - vector) / count
+        else:
+            self._means[user_slot] = 0.0
+        self._counts[user_slot] = count
+        self.row_lists.remove(row, last_row)
+
+    def candidate_rows(self, queries: np.ndarray, top_k: Optional[int] = None) -> np.ndarray:
+        """
+        Baris milik top-K user (berdasarkan centroid) untuk setiap query
+
+        Args:
+            queries: Matrix query ter-normalisasi (faces x dim)
+            top_k: Override jumlah user kandidat
+
+        Returns:
+            Array nomor baris gallery (gabungan semua query)
+        """
+        users = len(self.row_lists.lists)
+        means = self._means[:users]
+        norms = np.linalg.norm(means, axis=1)
+        scores = (queries @ means.T) / np.where(norms > 0, norms, 1.0)
+        scores[:, self._counts[:users] == 0] = -np.inf
+        top_k = min(top_k or self.top_k, users)
+        if top_k < users:
+            candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.arange(users)
+        return self.row_lists.rows(np.unique(candidates).tolist())
+
+
+def measure_recall(gallery, queries: np.ndarray, nprobe: Optional[int] = None) -> float:
+    """
+    Recall@1 (level user) pencarian ANN dibanding brute force pada gallery yang sama
+
+    Args:
+        gallery: EmbeddingGallery dengan ann_index aktif
+        queries: Matrix query (n x dim)
+        nprobe: nprobe yang diuji (default nprobe index)
+
+    Returns:
+        Fraksi query dengan user terbaik yang sama (0..1)
+    """
+    if gallery.ann_index is None or len(queries) == 0:
+        return 1.0
+    exact_index, _ = gallery.top_users(queries, k=1, exact=True)
+    previous = gallery.ann_index.nprobe
+    if nprobe is not None:
+        gallery.ann_index.nprobe = nprobe
+    try:
+        # Query diuji satu per satu agar kandidat query lain tidak ikut menaikkan recall
+        ann_best = np.array([gallery.top_users(query.reshape(1, -1), k=1)[0][0, 0] for query in queries])
+    finally:
+        gallery.ann_index.nprobe = previous
+    return float(np.mean(exact_index[:, 0] == ann_best))
+
+
+def tune_nprobe(gallery, queries: np.ndarray, target_recall: float) -> int:
+    """
+    Cari nprobe terkecil yang mencapai target recall
+
+    Returns:
+        nprobe terpilih (juga di-set ke index)
+    """
+    nprobe = 1
+    while nprobe < gallery.ann_index.nlist:
+        if measure_recall(gallery, queries, nprobe) >= target_recall:
+            break
+        nprobe *= 2
+    gallery.ann_index.nprobe = min(nprobe, gallery.ann_index.nlist)
+    return gallery.ann_index.nprobe
+
+
+def sample_queries(matrix: np.ndarray, count: int = 1000, noise: float = 0.8, seed: int = 0) -> np.ndarray:
+    """
+    Buat query uji dari baris gallery yang diberi noise (mensimulasikan wajah
+    baru dari orang yang sama)
+
+    Returns:
+        Matrix query ter-normalisasi (count x dim)
+    """
+    rng = np.random.default_rng(seed)
+    rows = matrix[rng.choice(matrix.shape[0], size=min(count, matrix.shape[0]), replace=False)]
+    perturbation = rng.standard_normal(rows.shape).astype(np.float32) * (noise / np.sqrt(rows.shape[1]))
+    queries = rows + perturbation
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def prepare_ann_index(gallery) -> Optional[IVFIndex]:
+    """
+    Pasang IVF index ke gallery sesuai konfigurasi: load centroid yang tersimpan,
+    latih ulang jika belum ada / gallery sudah tumbuh jauh, lalu tune nprobe
+    terhadap target recall
+
+    Args:
+        gallery: EmbeddingGallery yang baru di-load
+
+    Returns:
+        IVFIndex atau None jika ANN tidak dipakai
+    """
+    if not ANN_ENABLED or len(gallery) < ANN_MIN_GALLERY_SIZE:
+        gallery.ann_index = None
+        return None
+
+    matrix = gallery.matrix
+    index = IVFIndex.load(ANN_INDEX_PATH, matrix, nprobe=ANN_NPROBE)
+    if index is None or len(gallery) > ANN_RETRAIN_FACTOR * index.trained_size:
+        nlist = ANN_NLIST or int(4 * np.sqrt(len(gallery)))
+        print(f"Info: Melatih IVF index ({nlist} list) untuk {len(gallery)} embeddings...")
+        index = IVFIndex.train(matrix, nlist, nprobe=ANN_NPROBE)
+        index.save(ANN_INDEX_PATH, gallery.version)
+    gallery.ann_index = index
+
+    queries = sample_queries(matrix)
+    if ANN_TARGET_RECALL:
+        tune_nprobe(gallery, queries, ANN_TARGET_RECALL)
+    recall = measure_recall(gallery, queries)
+    print(f"Info: IVF index aktif: nlist={index.nlist}, nprobe={index.nprobe}, recall@1={recall:.4f}")
+    return index
+
+
+def measure_centroid_recall(gallery, queries: np.ndarray, top_k: Optional[int] = None) -> float:
+    """
+    Recall@1 (level user) pencarian dua tahap (centroid) dibanding brute force
+
+    Args:
+        gallery: EmbeddingGallery dengan centroid_index aktif
+        queries: Matrix query (n x dim)
+        top_k: Jumlah user kandidat yang diuji (default top_k index)
+
+    Returns:
+        Fraksi query dengan user terbaik yang sama (0..1)
+    """
+    index = gallery.centroid_index
+    if index is None or len(queries) == 0:
+        return 1.0
+    exact_index, _ = gallery.top_users(queries, k=1, exact=True)
+    previous = index.top_k
+    if top_k is not None:
+        index.top_k = top_k
+    try:
+        # Query diuji satu per satu agar kandidat query lain tidak ikut menaikkan recall
+        coarse_best = np.array([gallery.top_users(query.reshape(1, -1), k=1)[0][0, 0] for query in queries])
+    finally:
+        index.top_k = previous
+    return float(np.mean(exact_index[:, 0] == coarse_best))
+
+
+def prepare_centroid_index(gallery) -> Optional[UserCentroidIndex]:
+    """
+    Validasi recall coarse stage centroid seperti prepare_ann_index: top_k
+    digandakan sampai CENTROID_TARGET_RECALL tercapai. Jika tidak tercapai
+    sebelum top_k mencakup semua user, coarse stage dimatikan (brute force).
+
+    Args:
+        gallery: EmbeddingGallery yang baru di-load
+
+    Returns:
+        UserCentroidIndex atau None jika coarse stage tidak dipakai
+    """
+    index = gallery.centroid_index
+    if index is None or gallery.ann_index is not None or gallery.user_count < CENTROID_MIN_USERS:
+        return index
+
+    queries = sample_queries(gallery.matrix)
+    top_k = CENTROID_TOP_K
+    while top_k < gallery.user_count:
+        recall = measure_centroid_recall(gallery, queries, top_k)
+        if recall >= CENTROID_TARGET_RECALL:
+            index.top_k = top_k
+            print(f"Info: Pencarian dua tahap aktif: top_k={top_k}, recall@1={recall:.4f}")
+            return index
+        top_k *= 2
+    print(f"Warning: Recall centroid di bawah {CENTROID_TARGET_RECALL}, pencarian dua tahap dimatikan")
+    gallery.centroid_index = None
+    return None
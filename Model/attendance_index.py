@@ -0,0 +1,107 @@
+"""
+Index in-memory waktu kehadiran terakhir per user untuk menolak sighting
+dalam ATTENDANCE_TIMELAPSE tanpa query MongoDB
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from config.configrations import attendance_collection
+from .config import ATTENDANCE_LAST_SEEN_CAPACITY, ATTENDANCE_TIMELAPSE
+
+
+class LastSeenIndex:
+    """
+    LRU terbatas user_id -> waktu kehadiran terakhir yang diketahui worker ini.
+    Hanya hit positif yang dipercaya (user pasti sudah absen dalam jendela).
+    Worker lain dan absensi manual juga menulis ke collection Attendance,
+    jadi user yang tidak ada di index (atau kehadirannya sudah di luar
+    jendela) tetap harus dicek ke database.
+    """
+
+    def __init__(self, capacity: int = ATTENDANCE_LAST_SEEN_CAPACITY):
+        """
+        Args:
+            capacity: Jumlah user maksimum di index
+        """
+        self.capacity = capacity
+        self._entries: "OrderedDict[ObjectId, datetime]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self) -> int:
+        """
+        Isi index dari satu aggregation: waktu kehadiran terakhir setiap user
+        yang absen dalam jendela ATTENDANCE_TIMELAPSE
+
+        Returns:
+            Jumlah user yang dimuat
+        """
+        cutoff = datetime.now() - timedelta(minutes=ATTENDANCE_TIMELAPSE)
+        pipeline = [
+            {"$project": {
+                "user_id": 1,
+                "timestamp_date": {"$convert": {"input": "$timestamp", "to": "date", "onError": None, "onNull": None}},
+            }},
+            {"$match": {"timestamp_date": {"$gte": cutoff}}},
+            {"$group": {"_id": "$user_id", "last": {"$max": "$timestamp_date"}}},
+            {"$sort": {"last": 1}},
+        ]
+        try:
+            documents = list(attendance_collection.aggregate(pipeline))
+        except PyMongoError as e:
+            print(f"Warning: Gagal memuat index kehadiran terakhir: {e}")
+            return 0
+
+        with self._lock:
+            self._entries.clear()
+            self.evictions = 0
+            for doc in documents[-self.capacity:]:
+                self._entries[doc["_id"]] = doc["last"].replace(tzinfo=None)
+        print(f"Info: Index kehadiran terakhir dimuat ({len(self._entries)} user)")
+        return len(self._entries)
+
+    def lookup(self, user_id: ObjectId) -> Optional[datetime]:
+        """
+        Cari waktu kehadiran terakhir user yang diketahui index
+
+        Returns:
+            Waktu terakhir, atau None jika user tidak ada di index
+        """
+        with self._lock:
+            last_time = self._entries.get(user_id)
+            if last_time is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return last_time
+
+    def update(self, user_id: ObjectId, seen_at: datetime):
+        """
+        Catat kehadiran yang diterima (atau hasil query database)
+        """
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is None or seen_at > current:
+                self._entries[user_id] = seen_at
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        """
+        Statistik index: jumlah user, hit, miss, eviction
+        """
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,213 @@
+"""
+Write-behind untuk catatan kehadiran: user yang dikenali dimasukkan ke antrian
+in-process dan ditulis ke MongoDB oleh background thread secara batch
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from .config import ATTENDANCE_FLUSH_INTERVAL, ATTENDANCE_FLUSH_SIZE, ATTENDANCE_MAX_PENDING
+from .database import FaceDatabase
+
+Sighting = Tuple[ObjectId, ObjectId, datetime, ObjectId]
+
+
+def to_object_id(value) -> Optional[ObjectId]:
+    """
+    Konversi user_id / class_id ke ObjectId
+
+    Returns:
+        ObjectId, atau None jika nilai bukan ObjectId yang valid
+    """
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+class AttendanceWriter:
+    """
+    Antrian kehadiran yang di-flush dengan FaceDatabase.add_attendance_batch
+    saat jumlah antrian mencapai flush_size atau setiap flush_interval detik.
+    Sisa antrian di-flush saat stop() (graceful shutdown). Jika MongoDB tidak
+    bisa dihubungi, antrian dibatasi max_pending (sighting tertua dibuang).
+    """
+
+    def __init__(self, database: FaceDatabase, flush_size: int = ATTENDANCE_FLUSH_SIZE,
+                 flush_interval: float = ATTENDANCE_FLUSH_INTERVAL, max_pending: int = ATTENDANCE_MAX_PENDING):
+        """
+        Args:
+            database: FaceDatabase
+            flush_size: Jumlah sighting yang memicu flush
+            flush_interval: Interval flush maksimum (detik)
+            max_pending: Jumlah sighting maksimum yang ditahan saat flush gagal
+        """
+        self.database = database
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._queue: "queue.Queue[Optional[Sighting]]" = queue.Queue()
+        self._pending: List[Sighting] = []
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+
+    def start(self):
+        """
+        Siapkan index MongoDB, warm index kehadiran terakhir lalu jalankan
+        flusher di background thread
+        """
+        try:
+            self.database.ensure_attendance_indexes()
+        except PyMongoError as e:
+            print(f"Warning: Gagal membuat index kehadiran: {e}")
+        self.database.last_seen.warm()
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Hentikan flusher setelah semua antrian ditulis
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        else:
+            self._drain()
+            self._flush()
+        if self._pending:
+            print(f"Warning: {len(self._pending)} catatan kehadiran gagal ditulis saat shutdown")
+
+    def submit(self, user_id: str, class_id: str, seen_at: Optional[datetime] = None) -> bool:
+        """
+        Masukkan user yang dikenali ke antrian (tidak menunggu MongoDB)
+
+        Args:
+            user_id: ID user
+            class_id: ID kelas
+            seen_at: Waktu wajah dikenali (default sekarang)
+
+        Returns:
+            False jika user_id / class_id bukan ObjectId (sighting tidak dicatat)
+        """
+        # _id Attendance dibuat di sini agar tetap sama saat flush diulang
+        sighting = self._normalize((user_id, class_id, seen_at or datetime.now(), ObjectId()))
+        if sighting is None:
+            return False
+        self._queue.put(sighting)
+        return True
+
+    @staticmethod
+    def _normalize(sighting) -> Optional[Sighting]:
+        """
+        Konversi id sighting ke ObjectId, None (dengan log) jika tidak valid
+        """
+        user_id, class_id, seen_at, attendance_id = sighting
+        user_obj_id, class_obj_id = to_object_id(user_id), to_object_id(class_id)
+        if user_obj_id is None or class_obj_id is None:
+            print(f"Warning: Kehadiran user_id {user_id} class_id {class_id} tidak dicatat: id bukan ObjectId")
+            return None
+        return user_obj_id, class_obj_id, seen_at, attendance_id
+
+    def pending(self) -> int:
+        """
+        Jumlah sighting yang belum ditulis
+        """
+        return self._queue.qsize() + len(self._pending)
+
+    def stats(self) -> Dict:
+        """
+        Statistik antrian kehadiran dan index kehadiran terakhir
+        """
+        return {
+            "pending": self.pending(),
+            "written": self.written,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped,
+            "last_seen_index": self.database.last_seen.stats(),
+        }
+
+    def _drain(self) -> bool:
+        """
+        Pindahkan isi antrian ke _pending
+
+        Returns:
+            True jika sinyal stop diterima
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+            self._pending.append(item)
+
+    def _trim(self):
+        """
+        Buang sighting tertua jika antrian melebihi max_pending (MongoDB lama tidak tersedia)
+        """
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            self._pending.sort(key=lambda sighting: sighting[2])
+            del self._pending[:overflow]
+            self.dropped += overflow
+            print(f"Warning: Antrian kehadiran penuh, {overflow} sighting tertua dibuang")
+
+    def _run(self):
+        stopping = False
+        next_flush = time.monotonic() + self.flush_interval
+        while not stopping:
+            # Thread tidak boleh mati: error tak terduga hanya dicatat
+            try:
+                timeout = max(0.0, next_flush - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    stopping = True
+                elif item:
+                    self._pending.append(item)
+                stopping = self._drain() or stopping
+                self._trim()
+                if stopping or len(self._pending) >= self.flush_size or time.monotonic() >= next_flush:
+                    self._flush()
+                    next_flush = time.monotonic() + self.flush_interval
+            except Exception as e:
+                print(f"Error: Attendance writer: {e}")
+                next_flush = time.monotonic() + self.flush_interval
+        # Percobaan terakhir jika flush saat stop gagal
+        if self._pending:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch = [sighting for sighting in map(self._normalize, self._pending) if sighting is not None]
+        self.dropped += len(self._pending) - len(batch)
+        batch.sort(key=lambda sighting: sighting[2])
+        self._pending = batch
+        if not batch:
+            return
+        try:
+            self.written += self.database.add_attendance_batch(batch)
+            self._pending = []
+        except PyMongoError as e:
+            # Batch tetap di _pending dan dicoba lagi pada flush berikutnya
+            self.failed_flushes += 1
+            print(f"Warning: Gagal menulis {len(batch)} catatan kehadiran: {e}")
+        except Exception as e:
+            # Error data tidak akan berhasil jika diulang, batch dibuang
+            self.failed_flushes += 1
+            self.dropped += len(batch)
+            self._pending = []
+            print(f"Error: {len(batch)} catatan kehadiran dibuang: {e}")
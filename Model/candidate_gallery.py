@@ -0,0 +1,298 @@
+"""
+Sub-gallery kandidat per class_id: mahasiswa yang terdaftar (RPS) pada mata
+kuliah yang sedang / akan berlangsung di ruangan tersebut menurut jadwal Matkul
+dan override Kelas_Spesial
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from config.configrations import kelas_spesial_collection, matkul_collection, rps_collection
+from .config import (
+    CANDIDATE_GALLERY_ENABLED,
+    CANDIDATE_GRACE_MINUTES,
+    CANDIDATE_PREWARM_MINUTES,
+    CANDIDATE_REFRESH_INTERVAL,
+    GALLERY_SYNC_INTERVAL,
+)
+from .gallery import EmbeddingGallery
+
+TOTAL_PERTEMUAN = 16  # Jumlah pertemuan per mata kuliah (mingguan sejak tanggal_awal)
+
+
+def now_wib() -> datetime:
+    """
+    Waktu sekarang dalam WIB (UTC+7), sama dengan data jadwal "fake UTC"
+    """
+    return (datetime.now(timezone.utc) + timedelta(hours=7)).replace(tzinfo=None)
+
+
+def to_date(value) -> Optional[date]:
+    """
+    Konversi tanggal_awal / tanggal_kelas (datetime atau string ISO) ke date
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+        except ValueError:
+            return None
+    return None
+
+
+def session_window(day: date, jam_awal: str, jam_akhir: str) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Waktu mulai dan selesai sesi dari jam "HH:MM"
+    """
+    try:
+        start = datetime.strptime(f"{day:%Y-%m-%d} {jam_awal}", "%Y-%m-%d %H:%M")
+        end = datetime.strptime(f"{day:%Y-%m-%d} {jam_akhir}", "%Y-%m-%d %H:%M")
+    except (TypeError, ValueError):
+        return None
+    return start, end
+
+
+def scheduled_sessions(day: date) -> List[Dict]:
+    """
+    Semua sesi tatap muka pada tanggal `day`: pertemuan mingguan Matkul yang
+    tidak dijadwalkan ulang ditambah Kelas_Spesial pada tanggal tersebut
+
+    Returns:
+        List dict berisi matkul_id, class_id (string), start dan end
+    """
+    matkul_docs = {
+        str(doc["_id"]): doc
+        for doc in matkul_collection.find({}, {"class_id": 1, "jam_awal": 1, "jam_akhir": 1, "tanggal_awal": 1})
+    }
+    overrides = list(kelas_spesial_collection.find({}))
+    rescheduled = {(str(doc.get("matkul_id")), doc.get("pertemuan")) for doc in overrides}
+
+    sessions = []
+
+    def add_session(matkul_id, class_id, jam_awal, jam_akhir):
+        window = session_window(day, jam_awal, jam_akhir)
+        if class_id is None or window is None:
+            return
+        sessions.append({"matkul_id": matkul_id, "class_id": str(class_id), "start": window[0], "end": window[1]})
+
+    for matkul_id, matkul in matkul_docs.items():
+        start_date = to_date(matkul.get("tanggal_awal"))
+        if start_date is None:
+            continue
+        offset = (day - start_date).days
+        if offset < 0 or offset % 7:
+            continue
+        pertemuan = offset // 7 + 1
+        if pertemuan > TOTAL_PERTEMUAN or (matkul_id, pertemuan) in rescheduled:
+            continue
+        add_session(matkul["_id"], matkul.get("class_id"), matkul.get("jam_awal"), matkul.get("jam_akhir"))
+
+    for override in overrides:
+        if override.get("is_online") or to_date(override.get("tanggal_kelas")) != day:
+            continue
+        matkul = matkul_docs.get(str(override.get("matkul_id")), {})
+        class_id = override.get("class_id") if "class_id" in override else matkul.get("class_id")
+        add_session(
+            override.get("matkul_id"),
+            class_id,
+            override.get("jam_awal") or matkul.get("jam_awal"),
+            override.get("jam_akhir") or matkul.get("jam_akhir"),
+        )
+    return sessions
+
+
+class CandidateSet:
+    """
+    Mahasiswa terdaftar untuk sesi yang aktif di satu class_id beserta
+    sub-gallery embedding mereka
+    """
+    __slots__ = ("matkul_ids", "user_ids", "gallery", "source_key", "matched", "fallbacks")
+
+    def __init__(self, matkul_ids: Tuple[str, ...], user_ids: Set[str]):
+        self.matkul_ids = matkul_ids
+        self.user_ids = user_ids
+        self.gallery: Optional[EmbeddingGallery] = None
+        self.source_key = None  # (id gallery global, version, jumlah baris) saat sub-gallery dibuat
+        self.matched = 0
+        self.fallbacks = 0
+
+
+class CandidateGalleries:
+    """
+    Cache sub-gallery kandidat per class_id. Jadwal dibaca ulang setiap
+    CANDIDATE_REFRESH_INTERVAL detik oleh background thread; sesi yang dimulai
+    dalam CANDIDATE_PREWARM_MINUTES menit sudah disiapkan sub-gallery-nya.
+    Jika gallery global berubah, sub-gallery dibangun ulang oleh background
+    thread (setiap GALLERY_SYNC_INTERVAL detik); request tetap memakai
+    sub-gallery lama sampai yang baru siap.
+    """
+
+    def __init__(self, get_gallery: Callable[[], EmbeddingGallery], enabled: bool = CANDIDATE_GALLERY_ENABLED,
+                 prewarm_minutes: float = CANDIDATE_PREWARM_MINUTES, grace_minutes: float = CANDIDATE_GRACE_MINUTES,
+                 refresh_interval: float = CANDIDATE_REFRESH_INTERVAL):
+        """
+        Args:
+            get_gallery: Callable yang mengembalikan gallery global saat ini
+            enabled: Aktifkan pencocokan kandidat
+            prewarm_minutes: Sub-gallery disiapkan N menit sebelum sesi dimulai
+            grace_minutes: Sub-gallery tetap dipakai N menit setelah sesi selesai
+            refresh_interval: Interval membaca ulang jadwal (detik)
+        """
+        self.get_gallery = get_gallery
+        self.enabled = enabled
+        self.prewarm = timedelta(minutes=prewarm_minutes)
+        self.grace = timedelta(minutes=grace_minutes)
+        self.refresh_interval = refresh_interval
+        self._rooms: Dict[str, CandidateSet] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshed_at: Optional[datetime] = None
+
+    def start(self):
+        """
+        Baca jadwal sekarang lalu jalankan refresh periodik di background thread
+        """
+        if not self.enabled:
+            return
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="candidate-galleries", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Hentikan refresh periodik
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.refresh_interval + 1)
+            self._thread = None
+
+    def _run(self):
+        next_refresh = time.monotonic() + self.refresh_interval
+        while not self._stop.wait(min(GALLERY_SYNC_INTERVAL, self.refresh_interval)):
+            try:
+                if time.monotonic() >= next_refresh:
+                    self.refresh()
+                    next_refresh = time.monotonic() + self.refresh_interval
+                else:
+                    self.rebuild()
+            except Exception as e:
+                print(f"Error: Refresh kandidat gallery: {e}")
+
+    def refresh(self, now: Optional[datetime] = None) -> int:
+        """
+        Tentukan sesi aktif per class_id dan siapkan sub-gallery kandidatnya
+
+        Args:
+            now: Waktu WIB (default sekarang)
+
+        Returns:
+            Jumlah class_id yang memiliki kandidat
+        """
+        now = now or now_wib()
+        try:
+            sessions = scheduled_sessions(now.date())
+        except PyMongoError as e:
+            print(f"Warning: Gagal membaca jadwal untuk kandidat gallery: {e}")
+            return len(self._rooms)
+
+        active: Dict[str, Set] = {}
+        for session in sessions:
+            if session["start"] - self.prewarm <= now <= session["end"] + self.grace:
+                active.setdefault(session["class_id"], set()).add(session["matkul_id"])
+
+        rooms: Dict[str, CandidateSet] = {}
+        for class_id, matkul_ids in active.items():
+            key = tuple(sorted(str(matkul_id) for matkul_id in matkul_ids))
+            current = self._rooms.get(class_id)
+            if current is not None and current.matkul_ids == key:
+                rooms[class_id] = current
+                continue
+            matkul_obj_ids = [ObjectId(m) if ObjectId.is_valid(str(m)) else m for m in matkul_ids]
+            try:
+                enrolled = rps_collection.distinct("user_id", {"matkul_id": {"$in": matkul_obj_ids}})
+            except PyMongoError as e:
+                print(f"Warning: Gagal membaca RPS untuk class_id {class_id}: {e}")
+                continue
+            rooms[class_id] = CandidateSet(key, {str(user_id) for user_id in enrolled if user_id is not None})
+            print(f"Info: Kandidat class_id {class_id}: {len(rooms[class_id].user_ids)} mahasiswa dari {len(key)} matkul")
+
+        with self._lock:
+            self._rooms = rooms
+            self.refreshed_at = now
+        # Prewarm sub-gallery agar frame pertama sesi tidak menunggu
+        self.rebuild()
+        return len(rooms)
+
+    def rebuild(self) -> int:
+        """
+        Bangun ulang sub-gallery yang sumbernya (gallery global) sudah berubah.
+        Dipanggil dari background thread, bukan dari jalur request.
+
+        Returns:
+            Jumlah sub-gallery yang dibangun ulang
+        """
+        gallery = self.get_gallery()
+        source_key = (id(gallery), gallery.version, len(gallery))
+        rebuilt = 0
+        for candidates in list(self._rooms.values()):
+            if candidates.source_key == source_key or not candidates.user_ids:
+                continue
+            subset = gallery.subset(candidates.user_ids)
+            with self._lock:
+                candidates.gallery = subset
+                candidates.source_key = source_key
+            rebuilt += 1
+        return rebuilt
+
+    def get(self, class_id: str) -> Optional[EmbeddingGallery]:
+        """
+        Sub-gallery kandidat untuk class_id
+
+        Returns:
+            EmbeddingGallery, atau None jika tidak ada sesi aktif / sub-gallery
+            belum dibangun / kandidat belum memiliki embedding
+        """
+        if not self.enabled:
+            return None
+        candidates = self._rooms.get(str(class_id))
+        if candidates is None:
+            return None
+        gallery = candidates.gallery
+        return gallery if gallery is not None and len(gallery) else None
+
+    def record(self, class_id: str, matched: int, fallbacks: int):
+        """
+        Catat jumlah wajah yang cocok ke kandidat dan yang jatuh ke gallery global
+        """
+        candidates = self._rooms.get(str(class_id))
+        if candidates is not None:
+            with self._lock:
+                candidates.matched += matched
+                candidates.fallbacks += fallbacks
+
+    def stats(self) -> Dict:
+        """
+        Kandidat per class_id: matkul aktif, jumlah mahasiswa, embedding dan hit
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+                "rooms": {
+                    class_id: {
+                        "matkul_ids": list(candidates.matkul_ids),
+                        "users": len(candidates.user_ids),
+                        "embeddings": len(candidates.gallery) if candidates.gallery is not None else 0,
+                        "matched": candidates.matched,
+                        "fallbacks": candidates.fallbacks,
+                    }
+                    for class_id, candidates in self._rooms.items()
+                },
+            }
@@ -24,6 +24,134 @@ MIN_FACE_SIZE = 20  # Minimum ukuran wajah dalam pixel
 # Face Recognition Configuration (ArcFace)
 EMBEDDING_SIZE = 512  # Ukuran embedding vector dari ArcFace
 RECOGNITION_THRESHOLD = 0.5  # Range: -1 sampai 1
+MATCH_CANDIDATES = 3  # Jumlah kandidat user per wajah (hanya untuk margin, tidak untuk mengganti user)
+
+# Gallery Sync Configuration (antar worker)
+GALLERY_SYNC_INTERVAL = 2.0  # Detik, interval polling / max await change stream
+GALLERY_SYNC_GAP_TIMEOUT = 10.0  # Detik, tunggu version yang bolong sebelum dilewati
+GALLERY_CHANGE_RETENTION_HOURS = 24  # TTL change log gallery
+
+# Gallery Storage Configuration
+GALLERY_STORAGE = "float32"  # "float32", "float16" atau "int8" untuk first-pass scan
+GALLERY_RERANK_CANDIDATES = 64  # Baris teratas per wajah yang di-rerank exact (float32)
+GALLERY_SPILL_DIR = MODELS_DIR  # Folder file sementara matrix float32 (memory-map) untuk storage float16/int8
+
+# Two-stage Search Configuration (centroid per user)
+CENTROID_PREFILTER_ENABLED = False  # Aktifkan coarse stage (opsional, recall divalidasi saat load)
+CENTROID_MIN_USERS = 1000  # Coarse stage hanya dipakai jika jumlah user >= ini
+CENTROID_TOP_K = 32  # Jumlah user kandidat awal per wajah yang di-scan exact
+CENTROID_TARGET_RECALL = 0.99  # top_k digandakan sampai recall ini tercapai, jika tidak coarse stage dimatikan
+
+# Candidate Gallery Configuration (mahasiswa terdaftar per ruangan & jadwal)
+CANDIDATE_GALLERY_ENABLED = True  # Cocokkan dulu ke mahasiswa RPS dari sesi yang berlangsung di class_id
+CANDIDATE_PREWARM_MINUTES = 15  # Sub-gallery disiapkan N menit sebelum jam_awal
+CANDIDATE_GRACE_MINUTES = 15  # Sub-gallery tetap dipakai N menit setelah jam_akhir
+CANDIDATE_REFRESH_INTERVAL = 60.0  # Detik, interval membaca ulang jadwal Matkul/Kelas_Spesial/RPS
+
+# Gallery Snapshot Configuration (memory-map saat startup)
+GALLERY_SNAPSHOT_ENABLED = True
+GALLERY_SNAPSHOT_PATH = MODELS_DIR / "gallery_snapshot.bin"
+GALLERY_SNAPSHOT_HEADROOM = 1024  # Baris cadangan di snapshot untuk append tanpa realokasi
+
+# ANN Index Configuration (untuk gallery sangat besar)
+ANN_ENABLED = False  # Aktifkan IVF index (opsional)
+ANN_MIN_GALLERY_SIZE = 50000  # Index hanya dibangun jika jumlah embedding >= ini
+ANN_NLIST = 0  # Jumlah centroid, 0 = otomatis (4 * sqrt(n))
+ANN_NPROBE = 16  # Jumlah list yang dipindai per query
+ANN_TARGET_RECALL = 0.99  # nprobe di-tune otomatis sampai recall ini tercapai (None = pakai ANN_NPROBE)
+ANN_RETRAIN_FACTOR = 2.0  # Latih ulang centroid jika gallery tumbuh melebihi faktor ini
+ANN_INDEX_PATH = MODELS_DIR / "gallery_ivf.npz"
+
+# Inference Scheduler Configuration (micro-batching lintas request)
+INFERENCE_MAX_BATCH = 8  # Jumlah frame maksimum per batch
+INFERENCE_MAX_WAIT_MS = 20  # Waktu tunggu maksimum frame tertua sebelum batch diproses
+INFERENCE_WORKERS = 1  # Jumlah worker thread yang memproses batch secara paralel
+ORT_INTRA_OP_THREADS = 0  # Thread intra-op ONNX Runtime per sesi, 0 = otomatis (jumlah core / INFERENCE_WORKERS)
+IO_POOL_SIZE = 4  # Thread untuk decode gambar & operasi MongoDB di luar event loop
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024  # Ukuran maksimum body frame biner (/face/uploadmany/binary)
+
+# ONNX Runtime Profile Configuration
+#   providers: execution provider berurutan, ctx_id: 0 = GPU, -1 = CPU
+#   intra_op_threads: 0 = otomatis (jumlah core / INFERENCE_WORKERS)
+#   graph_optimization: disable / basic / extended / all
+#   mem_arena: memory arena & memory pattern CPU (matikan untuk hemat RAM)
+#   optimized_model: simpan model hasil optimasi graph ke models/optimized/<profil>/<fingerprint node>/
+RUNTIME_PROFILES = {
+    "cuda": {
+        "providers": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+        "ctx_id": 0,
+        "intra_op_threads": 0,
+        "graph_optimization": "all",
+        "mem_arena": True,
+        "optimized_model": False,
+    },
+    "cpu": {
+        "providers": ["CPUExecutionProvider"],
+        "ctx_id": -1,
+        "intra_op_threads": 0,
+        "graph_optimization": "all",
+        "mem_arena": True,
+        "optimized_model": True,
+    },
+    "cpu_lowmem": {
+        "providers": ["CPUExecutionProvider"],
+        "ctx_id": -1,
+        "intra_op_threads": 0,
+        "graph_optimization": "extended",
+        "mem_arena": False,
+        "optimized_model": True,
+    },
+}
+RUNTIME_PROFILE = "auto"  # Nama profil, atau "auto" = self-benchmark saat startup pertama lalu disimpan
+RUNTIME_PROFILE_CACHE = MODELS_DIR / "runtime_profile.json"  # Pilihan profil hasil self-benchmark per node
+RUNTIME_BENCHMARK_RUNS = 5  # Jumlah inferensi per model saat self-benchmark
+RUNTIME_BENCHMARK_FACES = 16  # Jumlah crop wajah per batch saat benchmark ArcFace
+
+# Modul InsightFace yang dimuat. genderage dan landmark 2D/3D tidak dipakai
+# sehingga tidak perlu dijalankan untuk setiap wajah
+DETECTOR_MODULES = ['detection', 'recognition']
+RECOGNITION_BATCH_SIZE = 64  # Jumlah crop wajah per panggilan ArcFace
+
+# Tiled Detection Configuration (frame resolusi tinggi / ruang kuliah besar)
+TILING_ENABLED = False  # Deteksi per tile untuk wajah kecil di baris belakang
+TILE_MIN_FRAME_SIZE = 1280  # Tiling hanya jika sisi terpanjang frame melebihi nilai ini (pixel)
+TILE_SIZE = 640  # Ukuran tile persegi (pixel frame)
+TILE_OVERLAP = 0.2  # Proporsi tumpang tindih antar tile
+TILE_DET_SIZE = (640, 640)  # Input detector untuk setiap tile
+TILE_NMS_THRESHOLD = 0.4  # IoU NMS penggabungan box lintas tile
+TILE_WORKERS = 4  # Thread deteksi tile paralel
+DETECTION_LATENCY_BUDGET_MS = 0  # Budget latency deteksi per frame, tile yang belum selesai dilewati (0 = tanpa batas)
+
+# Frame Gate Configuration (lewati frame yang tidak berubah per class_id)
+FRAME_GATE_ENABLED = True
+FRAME_GATE_SIZE = (64, 36)  # Ukuran thumbnail grayscale untuk perbandingan frame
+FRAME_GATE_THRESHOLD = 0.02  # Rata-rata selisih pixel (0-1) di bawah nilai ini dianggap frame sama
+FRAME_GATE_MAX_AGE = 30.0  # Hasil frame sebelumnya dipakai ulang maksimal N detik
+
+# Stream Configuration (WebSocket /face/stream/{class_id})
+STREAM_DETECT_INTERVAL = 5  # Deteksi wajah setiap N frame, frame lain memakai tracker
+STREAM_WORKERS = 2  # Thread pemrosesan frame stream
+TRACK_IOU_THRESHOLD = 0.3  # IoU minimal deteksi dengan posisi prediksi track
+TRACK_MAX_MISSES = 2  # Deteksi berturut-turut tanpa pasangan sebelum track dihapus
+TRACK_REVERIFY_DETECTIONS = 20  # Track yang sudah dikenali di-embed ulang setiap N deteksi (0 = tidak pernah)
+
+# Camera Preprocessing Configuration (key = class_id)
+#   min_face_px: perkiraan tinggi wajah terkecil (pixel frame asli), menentukan
+#                faktor decode JPEG tereduksi 1/2/4/8
+#   roi: (x, y, width, height) area tempat duduk dalam pixel frame asli
+#   mask: list titik polygon (pixel frame asli), area di luar polygon dihitamkan
+# Contoh:
+#   CAMERA_PROFILES = {
+#       "R101": {"min_face_px": 120, "roi": (0, 300, 3840, 1860)},
+#   }
+CAMERA_PROFILES = {}
+REDUCED_DECODE_MARGIN = 1.5  # Wajah setelah decode tereduksi minimal MIN_FACE_SIZE x margin
+
+# Enrollment Configuration (registrasi wajah massal)
+ENROLLMENT_WORKERS = 4  # Thread decode & deteksi wajah paralel
+ENROLLMENT_BATCH_SIZE = 64  # Gambar per batch (ArcFace batch + insert_many)
+ENROLLMENT_MANIFEST_PATH = MODELS_DIR / "enrollment_manifest.json"  # Hash konten file yang sudah didaftarkan
+ENROLLMENT_MAX_FILES = 500  # Jumlah gambar maksimum per request /face/enroll
 
 # Image Configuration
 TARGET_FACE_SIZE = (224, 224)  # Ukuran input untuk ArcFace
@@ -32,4 +160,9 @@ TARGET_FACE_SIZE = (224, 224)  # Ukuran input untuk ArcFace
 SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
 
 # Logging Configurations
-ATTENDANCE_TIMELAPSE = 45 # absen per 45 menit
\ No newline at end of file
+ATTENDANCE_TIMELAPSE = 45 # absen per 45 menit
+ATTENDANCE_FLUSH_SIZE = 50  # Jumlah kehadiran dalam antrian yang memicu insert_many
+ATTENDANCE_FLUSH_INTERVAL = 2.0  # Interval maksimum (detik) antrian kehadiran ditulis ke MongoDB
+ATTENDANCE_CLAIM_GRACE = 60.0  # Detik, klaim kehadiran tanpa catatan Attendance baru boleh diambil alih setelah ini
+ATTENDANCE_MAX_PENDING = 10000  # Antrian kehadiran maksimum saat MongoDB tidak tersedia (tertua dibuang)
+ATTENDANCE_LAST_SEEN_CAPACITY = 20000  # Jumlah user maksimum di index kehadiran terakhir (in-memory)
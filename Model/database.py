@@ -1,15 +1,17 @@
 """
 Database handler menggunakan MongoDB untuk menyimpan face embeddings
 """
-from .face_encoder import FaceEncoder
+from .attendance_index import LastSeenIndex
+from .gallery import EmbeddingGallery
+from .gallery_sync import OP_DELETE, OP_INSERT, get_gallery_version, publish_change
 import numpy as np
 from bson import ObjectId
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from .config import ATTENDANCE_TIMELAPSE
-from config.configrations import attendance_collection, users_collection, vector_collection
+from .config import ATTENDANCE_CLAIM_GRACE, ATTENDANCE_TIMELAPSE, MATCH_CANDIDATES
+from config.configrations import attendance_collection, attendance_state_collection, users_collection, vector_collection
 
 
 class FaceDatabase:
@@ -22,6 +24,8 @@ class FaceDatabase:
         Inisialisasi koneksi MongoDB
         """
         print("Menghubungkan ke MongoDB...")
+        # Waktu kehadiran terakhir per user (di-warm oleh AttendanceWriter saat start)
+        self.last_seen = LastSeenIndex()
     
     def get_all_embeddings(self) -> List[Dict]:
         """
@@ -52,6 +56,21 @@ class FaceDatabase:
         
         return cleaned_documents
     
+    def load_gallery(self) -> EmbeddingGallery:
+        """
+        Ambil semua embeddings dari database langsung sebagai gallery kolumnar
+        (matrix float32 ter-normalisasi + index user)
+        
+        Returns:
+            EmbeddingGallery
+        """
+        # Version dibaca sebelum load, perubahan setelahnya akan ditarik ulang oleh GallerySync
+        version = get_gallery_version()
+        documents = list(vector_collection.find({}, {"user_id": 1, "embedding": 1}))
+        gallery = EmbeddingGallery.from_documents(documents)
+        gallery.version = version
+        return gallery
+    
     
     def get_embeddings_by_person(self, person_name: str) -> List[np.ndarray]:
         """
@@ -139,69 +158,91 @@ class FaceDatabase:
     def find_closest_match(
         self, 
         query_embedding: np.ndarray, 
-        all_embeddings,
-        threshold: float = 0.5,
-        user_cutoff: float = 0.2,  # Skip user jika < ini
-        early_stop: float = 0.8     # Stop jika dapat >= ini
+        gallery: EmbeddingGallery,
+        threshold: float = 0.5
     ) -> Tuple[Optional[str], float]:
         """
-        Optimized matching dengan user-level cutoff dan early stopping
+        Cari user paling mirip dengan satu perkalian matrix-vector terhadap gallery,
+        lalu ambil similarity maksimum per user
+
+        Args:
+            query_embedding: Embedding wajah yang dicari
+            gallery: EmbeddingGallery (cache embeddings)
+            threshold: Batas minimal similarity agar dianggap cocok
+
+        Returns:
+            Tuple (user_id atau None, similarity tertinggi)
         """
-        
-        # if not all_embeddings:
-        #     return None, 0.0
-        print(f"Debug: Mencari di database, total embeddings: {len(all_embeddings)}")
-        # Group embeddings by user_id
-        user_embeddings = {}
-        for doc in all_embeddings: 
-            user_id = doc["user_id"]
-            if user_id not in user_embeddings:
-                user_embeddings[user_id] = []
-            user_embeddings[user_id].append(doc["embedding"])
-        print(f"Debug: Total unique users in database: {len(user_embeddings)}")
-        
-        max_similarity = -1.0
-        best_match = None
-        
-        for user_id, embeddings in user_embeddings.items():
-            # STRATEGI 1: Cek embedding pertama sebagai filter
-            first_similarity = FaceEncoder.compute_cosine_similarity(
-                query_embedding, 
-                embeddings[0]
-            )
-            
-            # User-level cutoff: Skip user ini jika embedding pertama jelek
-            if first_similarity < user_cutoff:
-                continue
-            
-            # Jika embedding pertama bagus, cek semua embedding user ini
-            for embedding in embeddings:
-                similarity = FaceEncoder.compute_cosine_similarity(
-                    query_embedding, 
-                    embedding
-                )
-                
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    best_match = user_id
-                
-                # STRATEGI 2: Early stopping jika dapat match sangat kuat
-                if similarity >= early_stop:
-                    return best_match, max_similarity
+        print(f"Debug: Mencari di database, total embeddings: {len(gallery)}, total users: {gallery.user_count}")
+        best_match, max_similarity = gallery.best_match(query_embedding)
         
         if max_similarity >= threshold:
             return best_match, max_similarity
         else:
             return None, max_similarity
     
-    def maybe_add_embedding(self, user_id, embedding, all_embeddings):
+    def find_closest_matches(
+        self,
+        query_embeddings: np.ndarray,
+        gallery: EmbeddingGallery,
+        threshold: float = 0.5,
+        groups: Optional[List] = None
+    ) -> List[Dict]:
+        """
+        Cocokkan semua wajah dalam satu frame sekaligus dengan satu perkalian
+        matrix (faces x gallery). Jika dua wajah cocok ke user yang sama, wajah
+        dengan similarity tertinggi yang mendapat user tersebut, wajah lainnya
+        tidak dikenali (user_id None). Kandidat berikutnya hanya dipakai untuk
+        menghitung margin, tidak pernah untuk mengganti user.
+
+        Args:
+            query_embeddings: Matrix embedding wajah (faces x 512)
+            gallery: EmbeddingGallery (cache embeddings)
+            threshold: Batas minimal similarity agar dianggap cocok
+            groups: Label frame per wajah jika query berisi wajah dari beberapa
+                frame; resolusi user ganda hanya berlaku di dalam frame yang sama
+
+        Returns:
+            List dict per wajah (urutan sama dengan query) berisi
+            user_id (atau None), similarity, dan margin terhadap kandidat berikutnya
+        """
+        top_index, top_scores = gallery.top_users(query_embeddings, k=max(2, MATCH_CANDIDATES))
+        faces = top_index.shape[0]
+        print(f"Debug: Mencocokkan {faces} wajah ke {len(gallery)} embeddings ({gallery.user_count} users)")
+
+        matches = [
+            {
+                "user_id": None,
+                "similarity": float(top_scores[i, 0]),
+                "margin": float(top_scores[i, 0] - top_scores[i, 1])
+            }
+            for i in range(faces)
+        ]
+
+        # Wajah dengan skor tertinggi diproses duluan dan mendapat user terbaiknya;
+        # wajah lain di frame yang sama dengan user terbaik yang sama tetap None
+        taken = set()
+        for i in np.argsort(-top_scores[:, 0]):
+            slot = int(top_index[i, 0])
+            if slot < 0 or top_scores[i, 0] < threshold:
+                continue
+            key = (groups[i] if groups is not None else None, slot)
+            if key in taken:
+                continue
+            taken.add(key)
+            matches[i]["user_id"] = gallery.user_ids[slot]
+        return matches
+    
+    def maybe_add_embedding(self, user_id, embedding, gallery: EmbeddingGallery):
         """
         Tambah embedding baru jika user belum memiliki embedding,
-        atau jika embedding yang ada sudah berbeda signifikan
+        atau jika embedding yang ada sudah berbeda signifikan.
+        Embedding yang disimpan langsung di-append ke gallery.
 
         Args:
             user_id: ID user
             embedding: Face embedding numpy array
+            gallery: EmbeddingGallery untuk cek kemiripan (di-update jika embedding ditambahkan)
 
         Returns:
             bool: True jika embedding ditambahkan, False jika tidak
@@ -213,7 +254,7 @@ class FaceDatabase:
             
             if count <= 3 :
                 # Cek similarity dengan embedding yang sudah ada
-                similarity = self.find_closest_match(embedding, all_embeddings)[1]
+                similarity = self.find_closest_match(embedding, gallery)[1]
                 
                 # Jika similarity > 0.85, embedding terlalu mirip, jangan tambah
                 if similarity > 0.85:
@@ -224,7 +265,10 @@ class FaceDatabase:
                     "embedding": embedding.tolist() if isinstance(embedding, np.ndarray) else embedding,
                     "created_at": datetime.now().isoformat()
                 }
-                vector_collection.insert_one(document)
+                result = vector_collection.insert_one(document)
+                # Update cache in-memory secara incremental (tanpa reload collection)
+                gallery.append(str(result.inserted_id), str(user_id), embedding)
+                publish_change(OP_INSERT, result.inserted_id, user_id)
                 return True
             else:
                 return False
@@ -244,6 +288,30 @@ class FaceDatabase:
             else:
                 return False
 
+    def remove_embedding(self, vector_id, gallery: EmbeddingGallery) -> bool:
+        """
+        Hapus satu dokumen Vector dan buang embedding-nya dari gallery (O(1))
+
+        Args:
+            vector_id: _id dokumen Vector (string atau ObjectId)
+            gallery: EmbeddingGallery yang ikut di-update
+
+        Returns:
+            bool: True jika dokumen terhapus
+        """
+        vector_obj_id = ObjectId(vector_id) if isinstance(vector_id, str) else vector_id
+        result = vector_collection.delete_one({"_id": vector_obj_id})
+        gallery.remove(str(vector_obj_id))
+        if result.deleted_count > 0:
+            publish_change(OP_DELETE, vector_obj_id)
+        return result.deleted_count > 0
+
+    def ensure_attendance_indexes(self):
+        """
+        Index (user_id, timestamp) untuk aggregation kehadiran terakhir per user
+        """
+        attendance_collection.create_index([("user_id", ASCENDING), ("timestamp", ASCENDING)])
+    
     def add_user_attendance(self, user_id, class_id):
         """
         Tambah catatan kehadiran untuk user jika belum absen dalam 45 menit terakhir
@@ -252,72 +320,128 @@ class FaceDatabase:
             user_id: ID user (string atau ObjectId)
             class_id: ID kelas (string atau ObjectId)
         """
-        now = datetime.now()
+        return self.add_attendance_batch([(user_id, class_id, datetime.now(), ObjectId())]) > 0
 
-        # Convert ke ObjectId jika masih string
-        user_obj_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
-        class_obj_id = ObjectId(class_id) if isinstance(class_id, str) else class_id
+    def claim_attendance(self, user_obj_id: ObjectId, seen_at: datetime, attendance_id: ObjectId) -> bool:
+        """
+        Klaim atomik hak mencatat kehadiran user pada waktu seen_at. Dokumen
+        Attendance_State per user menyimpan kehadiran terakhir yang diklaim;
+        update hanya cocok jika klaim tersebut lebih lama dari
+        ATTENDANCE_TIMELAPSE, sehingga dua worker / kamera yang melihat user
+        yang sama dalam jendela tersebut tidak bisa sama-sama menulis.
 
-        # Query kehadiran terakhir user (TANPA filter class_id)
-        query = {
-            "user_id": user_obj_id
-        }
-        print(f"[DEBUG] Mencari kehadiran terakhir untuk user {user_id}")
-        last_attendance = None
-        if attendance_collection is not None:
-            print("[DEBUG] Menggunakan MongoDB untuk kehadiran")
-            last_attendance = attendance_collection.find_one(
-                query,
-                sort=[("timestamp", -1)]
+        Args:
+            user_obj_id: ID user
+            seen_at: Waktu wajah dikenali
+            attendance_id: _id dokumen Attendance yang akan ditulis (tetap sama
+                saat flush diulang, sehingga klaim sendiri dikenali)
+
+        Returns:
+            True jika catatan kehadiran boleh ditulis
+        """
+        cutoff = seen_at - timedelta(minutes=ATTENDANCE_TIMELAPSE)
+        update = {"$set": {"last": seen_at, "attendance_id": attendance_id, "claimed_at": datetime.now()}}
+        try:
+            attendance_state_collection.find_one_and_update(
+                {"_id": user_obj_id, "last": {"$lte": cutoff}}, update, upsert=True
             )
-            print(f"[DEBUG] Last attendance dari MongoDB: {last_attendance}")
-        else:
-            print("[DEBUG] Menggunakan memory storage untuk kehadiran")
-            # Fallback ke memory storage
-            filtered = [d for d in self._memory_storage if d.get("user_id") == user_obj_id]
-            if filtered:
-                last_attendance = max(filtered, key=lambda d: d["timestamp"])
+            return True
+        except DuplicateKeyError:
+            pass
 
-        # Cek apakah sudah lewat 45 menit
-        if last_attendance:
-            print(f"[DEBUG] User {user_id} memiliki catatan kehadiran terakhir: {last_attendance}")
-            
-            # Parse timestamp dengan handling untuk format Z (UTC)
-            timestamp_str = last_attendance["timestamp"]
-            if isinstance(timestamp_str, str):
-                # Replace "Z" dengan "+00:00" untuk kompatibilitas fromisoformat
-                timestamp_str = timestamp_str.replace("Z", "+00:00")
-                last_time = datetime.fromisoformat(timestamp_str)
-                # Convert ke naive datetime (hilangkan timezone info untuk kompatibilitas)
-                last_time = last_time.replace(tzinfo=None)
+        # Klaim lain masih dalam jendela
+        state = attendance_state_collection.find_one({"_id": user_obj_id})
+        if state is None or state.get("attendance_id") == attendance_id:
+            return state is not None
+        # Ambil alih hanya jika catatan klaim tersebut tidak pernah ditulis / sudah
+        # dihapus (mis. absensi manual) dan klaimnya bukan sedang berjalan
+        claimed_at = state.get("claimed_at")
+        if claimed_at is not None and (datetime.now() - claimed_at).total_seconds() < ATTENDANCE_CLAIM_GRACE:
+            return False
+        if attendance_collection.count_documents({"_id": state.get("attendance_id")}, limit=1):
+            return False
+        result = attendance_state_collection.update_one(
+            {"_id": user_obj_id, "attendance_id": state.get("attendance_id")}, update
+        )
+        return result.modified_count > 0
+
+    def add_attendance_batch(self, sightings: List[Tuple[ObjectId, ObjectId, datetime, ObjectId]]) -> int:
+        """
+        Versi batch dari add_user_attendance. Sighting yang masih dalam
+        ATTENDANCE_TIMELAPSE menurut index kehadiran terakhir langsung ditolak,
+        user lainnya dicek ke database dengan satu aggregation (melihat worker
+        lain & absensi manual). Sighting yang lolos diklaim atomik per user
+        (claim_attendance) lalu ditulis dengan satu insert_many.
+
+        Args:
+            sightings: List (user_id, class_id, waktu dikenali, _id Attendance) urut waktu
+
+        Returns:
+            Jumlah catatan kehadiran baru yang ditulis
+        """
+        if not sightings:
+            return 0
+        # Index in-memory hanya dipercaya jika menolak semua sighting user tersebut;
+        # user lain dicek dengan satu aggregation (melihat worker lain & absensi manual)
+        latest = {}
+        for user_id, _, seen_at, _ in sightings:
+            user_obj_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
+            latest[user_obj_id] = max(seen_at, latest.get(user_obj_id, seen_at))
+        last_seen = {}
+        unknown = []
+        for user_obj_id, seen_at in latest.items():
+            last_time = self.last_seen.lookup(user_obj_id)
+            if last_time is not None and (seen_at - last_time).total_seconds() / 60 < ATTENDANCE_TIMELAPSE:
+                last_seen[user_obj_id] = last_time
             else:
-                last_time = timestamp_str
-            
-            print(f"[DEBUG] Last attendance time: {last_time}")
-            time_diff = (now - last_time).total_seconds() / 60  # dalam menit
-            print(f"[DEBUG] User {user_id} last attendance: {last_time}, diff: {time_diff:.1f} menit")
-            
-            if time_diff < ATTENDANCE_TIMELAPSE:
-                print(f"[DEBUG] ❌ Attendance ditolak: belum lewat {ATTENDANCE_TIMELAPSE} menit (baru {time_diff:.1f} menit)")
-                return False  # Tidak boleh absen lagi
+                unknown.append(user_obj_id)
+        if unknown:
+            for doc in attendance_collection.aggregate([
+                {"$match": {"user_id": {"$in": unknown}}},
+                {"$group": {"_id": "$user_id", "last": {"$max": {"$toDate": "$timestamp"}}}},
+            ]):
+                last_seen[doc["_id"]] = doc["last"].replace(tzinfo=None)
+                self.last_seen.update(doc["_id"], last_seen[doc["_id"]])
 
-        attendance_doc = {
-            "user_id": user_obj_id,
-            "timestamp": now.isoformat(),
-            "class_id": class_obj_id
-        }
+        documents = []
+        for user_id, class_id, seen_at, attendance_id in sightings:
+            user_obj_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
+            last_time = last_seen.get(user_obj_id)
+            if last_time is not None:
+                time_diff = (seen_at - last_time).total_seconds() / 60  # dalam menit
+                if time_diff < ATTENDANCE_TIMELAPSE:
+                    print(f"[DEBUG] ❌ Attendance {user_id} ditolak: belum lewat {ATTENDANCE_TIMELAPSE} menit (baru {time_diff:.1f} menit)")
+                    continue
+            if not self.claim_attendance(user_obj_id, seen_at, attendance_id):
+                print(f"[DEBUG] ❌ Attendance {user_id} ditolak: sudah dicatat worker / kamera lain")
+                continue
+            last_seen[user_obj_id] = seen_at
+            documents.append({
+                "_id": attendance_id,
+                "user_id": user_obj_id,
+                "timestamp": seen_at.isoformat(),
+                "class_id": ObjectId(class_id) if isinstance(class_id, str) else class_id,
+            })
+        if not documents:
+            return 0
 
-        if attendance_collection is not None:
-            attendance_collection.insert_one(attendance_doc)
-            print(f"[DEBUG] ✅ Attendance berhasil ditambahkan untuk user {user_id}")
-        else:
-            self._memory_storage.append(attendance_doc)
-        return True
+        try:
+            attendance_collection.insert_many(documents, ordered=False)
+            written = len(documents)
+        except BulkWriteError as e:
+            # Duplicate key = dokumen sudah ditulis pada flush sebelumnya yang dianggap gagal
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            written = e.details["nInserted"]
+        for doc in documents:
+            self.last_seen.update(doc["user_id"], datetime.fromisoformat(doc["timestamp"]))
+        print(f"[DEBUG] ✅ {written} attendance berhasil ditambahkan")
+        return written
     
     def close(self):
         """
         Tutup koneksi database
         """
-        if self.client is not None:
+        if getattr(self, "client", None) is not None:
             self.client.close()
             print("Koneksi MongoDB ditutup.")
\ No newline at end of file
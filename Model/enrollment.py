@@ -0,0 +1,268 @@
+"""
+Pipeline registrasi wajah massal: decode & deteksi paralel, embedding batch,
+upsert user dan insert vector secara bulk, lalu gallery di-update incremental
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+from config.configrations import users_collection, vector_collection
+from .config import ENROLLMENT_MANIFEST_PATH, ENROLLMENT_WORKERS
+from .face_detector import FaceDetector
+from .face_encoder import FaceEncoder
+from .gallery import EmbeddingGallery
+from .gallery_sync import OP_DELETE, OP_INSERT, publish_changes
+
+# Status per gambar
+STATUS_ENROLLED = "enrolled"
+STATUS_NO_FACE = "no_face"
+STATUS_FAILED = "failed"
+
+
+def content_hash(data) -> str:
+    """
+    SHA-256 isi file gambar
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_image(data) -> Optional[np.ndarray]:
+    """
+    Decode bytes gambar (JPEG/PNG) ke BGR
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class EnrollmentItem:
+    """
+    Satu gambar yang akan didaftarkan. Label berupa nama user (dibuat jika
+    belum ada) atau user_id yang sudah terdaftar.
+    """
+    __slots__ = ("key", "image", "name", "user_id", "digest")
+
+    def __init__(self, key: str, image: Optional[np.ndarray], name: Optional[str] = None,
+                 user_id: Optional[str] = None, digest: Optional[str] = None):
+        self.key = key
+        self.image = image
+        self.name = name
+        self.user_id = user_id
+        self.digest = digest
+
+
+class EnrollmentManifest:
+    """
+    Hash konten file yang sudah didaftarkan beserta vector_id-nya, sehingga
+    registrasi ulang folder hanya memproses file baru / berubah
+    """
+
+    def __init__(self, path: Path = ENROLLMENT_MANIFEST_PATH):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except (OSError, ValueError) as e:
+                print(f"Warning: Manifest registrasi tidak bisa dibaca, registrasi penuh: {e}")
+
+    def unchanged(self, key: str, digest: str) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry.get("sha256") == digest
+
+    def keys_in(self, folder: Path) -> List[str]:
+        """
+        Key manifest (path absolut) milik file langsung di dalam folder
+        """
+        folder = Path(folder).resolve()
+        return [key for key in self.entries if Path(key).parent == folder]
+
+    def clear(self):
+        self.entries = {}
+
+    def save(self):
+        """
+        Tulis manifest secara atomik (file sementara lalu os.replace)
+        """
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.entries))
+        os.replace(tmp_path, self.path)
+
+
+class FaceEnroller:
+    """
+    Mendaftarkan banyak gambar sekaligus. Deteksi berjalan paralel di thread
+    pool, embedding dihitung dalam satu batch ArcFace, user di-upsert dengan
+    satu bulk_write dan vector ditulis dengan satu insert_many per batch.
+    """
+
+    def __init__(self, detector: FaceDetector, encoder: FaceEncoder,
+                 get_gallery: Callable[[], EmbeddingGallery], workers: int = ENROLLMENT_WORKERS):
+        """
+        Args:
+            detector: FaceDetector
+            encoder: FaceEncoder
+            get_gallery: Callable yang mengembalikan gallery aktif
+            workers: Jumlah thread decode & deteksi
+        """
+        self.detector = detector
+        self.encoder = encoder
+        self.get_gallery = get_gallery
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll")
+
+    def read_files(self, paths: List[Path]) -> List[Tuple[bytes, str]]:
+        """
+        Baca file secara paralel
+
+        Returns:
+            List (bytes, sha256) dengan urutan sama seperti paths
+        """
+        def read(path: Path) -> Tuple[bytes, str]:
+            data = path.read_bytes()
+            return data, content_hash(data)
+        return list(self.executor.map(read, paths))
+
+    def decode_many(self, buffers: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Decode banyak gambar secara paralel
+        """
+        return list(self.executor.map(decode_image, buffers))
+
+    def resolve_users(self, names: List[str]) -> Dict[str, ObjectId]:
+        """
+        Ambil _id user berdasarkan nama; user yang belum ada dibuat dengan satu bulk_write
+
+        Returns:
+            Dict nama -> _id user
+        """
+        names = sorted(set(names))
+        if not names:
+            return {}
+        now = datetime.now().isoformat()
+        users_collection.bulk_write(
+            [UpdateOne({"name": name}, {"$setOnInsert": {"name": name, "created_at": now}}, upsert=True)
+             for name in names],
+            ordered=False,
+        )
+        user_ids: Dict[str, ObjectId] = {}
+        # Jika ada nama ganda, pakai user yang paling lama (sama seperti find_one)
+        for doc in users_collection.find({"name": {"$in": names}}, {"name": 1}).sort("_id", 1):
+            user_ids.setdefault(doc["name"], doc["_id"])
+        return user_ids
+
+    def enroll(self, items: List[EnrollmentItem], parallel: bool = True) -> List[Dict]:
+        """
+        Daftarkan satu batch gambar
+
+        Args:
+            items: List EnrollmentItem (gambar sudah di-decode, None jika gagal)
+            parallel: Deteksi paralel di thread pool enroller. False = deteksi
+                berurutan di thread pemanggil (tidak berebut thread ORT dengan
+                recognition saat sistem melayani kamera)
+
+        Returns:
+            List status per gambar (urutan sama dengan items) berisi key,
+            status, user_id, vector_id dan message
+        """
+        results = [{"key": item.key, "status": STATUS_FAILED, "user_id": None, "vector_id": None, "message": None}
+                   for item in items]
+
+        # Tahap 1: deteksi wajah terbesar per gambar
+        decoded = [i for i, item in enumerate(items) if item.image is not None]
+        for i, item in enumerate(items):
+            if item.image is None:
+                results[i]["message"] = "Gagal decode gambar"
+        detect = self.executor.map if parallel else map
+        faces = dict(zip(decoded, detect(
+            lambda i: self.detector.detect_largest_face(items[i].image), decoded
+        )))
+        detected = [i for i in decoded if faces[i] is not None]
+        for i in decoded:
+            if faces[i] is None:
+                results[i]["status"] = STATUS_NO_FACE
+                results[i]["message"] = "Tidak ada wajah terdeteksi"
+
+        # Tahap 2: embedding semua wajah dalam batch ArcFace
+        self.detector.analyze_batch([items[i].image for i in detected], [[faces[i]] for i in detected])
+        embeddings = dict(zip(detected, self.encoder.get_embeddings([faces[i] for i in detected])))
+        embedded = [i for i in detected if embeddings[i] is not None]
+        for i in detected:
+            if embeddings[i] is None:
+                results[i]["message"] = "Gagal mengekstrak embedding"
+
+        # Tahap 3: resolve user (bulk upsert berdasarkan nama)
+        user_ids = self.resolve_users([items[i].name for i in embedded if items[i].user_id is None and items[i].name])
+        requested = {ObjectId(str(items[i].user_id)) for i in embedded
+                     if items[i].user_id is not None and ObjectId.is_valid(str(items[i].user_id))}
+        existing = set()
+        if requested:
+            existing = {doc["_id"] for doc in users_collection.find({"_id": {"$in": list(requested)}}, {"_id": 1})}
+        owners: Dict[int, ObjectId] = {}
+        for i in embedded:
+            item = items[i]
+            if item.user_id is not None:
+                if not ObjectId.is_valid(str(item.user_id)) or ObjectId(str(item.user_id)) not in existing:
+                    results[i]["message"] = f"user_id tidak ditemukan: {item.user_id}"
+                    continue
+                owners[i] = ObjectId(str(item.user_id))
+            elif item.name:
+                owners[i] = user_ids[item.name]
+            else:
+                results[i]["message"] = "Label user kosong"
+
+        # Tahap 4: insert_many vector, gallery di-append dan perubahan dipublikasikan sekaligus
+        rows = [i for i in embedded if i in owners]
+        if not rows:
+            return results
+        now = datetime.now().isoformat()
+        documents = [
+            {"user_id": owners[i], "embedding": embeddings[i].tolist(), "created_at": now}
+            for i in rows
+        ]
+        inserted_ids = vector_collection.insert_many(documents).inserted_ids
+        gallery = self.get_gallery()
+        for i, vector_id in zip(rows, inserted_ids):
+            gallery.append(str(vector_id), str(owners[i]), embeddings[i])
+            results[i].update({
+                "status": STATUS_ENROLLED,
+                "user_id": str(owners[i]),
+                "vector_id": str(vector_id),
+            })
+        publish_changes(OP_INSERT, [(vector_id, owners[i]) for i, vector_id in zip(rows, inserted_ids)])
+        return results
+
+    def existing_vectors(self, vector_ids: List[str]) -> set:
+        """
+        Vector_id (string) yang masih ada di collection Vector, dicek dengan satu find
+        """
+        object_ids = [ObjectId(v) for v in vector_ids if v and ObjectId.is_valid(v)]
+        if not object_ids:
+            return set()
+        return {str(doc["_id"]) for doc in vector_collection.find({"_id": {"$in": object_ids}}, {"_id": 1})}
+
+    def remove_vectors(self, vector_ids: List[str]) -> int:
+        """
+        Hapus vector (mis. dari file yang isinya berubah) dari database dan gallery
+
+        Returns:
+            Jumlah vector yang dihapus
+        """
+        object_ids = [ObjectId(v) for v in vector_ids if v and ObjectId.is_valid(v)]
+        if not object_ids:
+            return 0
+        removed = {doc["_id"]: doc.get("user_id")
+                   for doc in vector_collection.find({"_id": {"$in": object_ids}}, {"user_id": 1})}
+        vector_collection.delete_many({"_id": {"$in": list(removed)}})
+        gallery = self.get_gallery()
+        for vector_id in removed:
+            gallery.remove(str(vector_id))
+        publish_changes(OP_DELETE, list(removed.items()))
+        return len(removed)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
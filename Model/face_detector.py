@@ -1,11 +1,104 @@
 """
 Face Detection menggunakan RetinaFace dari InsightFace library
 """
-from typing import List, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
 import cv2
 import numpy as np
-from insightface.app import FaceAnalysis
-from .config import DETECTION_THRESHOLD, MODELS_DIR, TARGET_FACE_SIZE
+from insightface.app.common import Face
+from insightface.model_zoo.retinaface import distance2bbox, distance2kps
+from insightface.utils import face_align
+from .config import (
+    DETECTION_LATENCY_BUDGET_MS,
+    DETECTION_THRESHOLD,
+    RECOGNITION_BATCH_SIZE,
+    RUNTIME_PROFILE,
+    TILE_DET_SIZE,
+    TILE_MIN_FRAME_SIZE,
+    TILE_NMS_THRESHOLD,
+    TILE_OVERLAP,
+    TILE_SIZE,
+    TILE_WORKERS,
+    TILING_ENABLED,
+)
+from .runtime_profiles import load_face_models
+
+
+def tile_grid(height: int, width: int, tile: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> List[Tuple[int, int, int, int]]:
+    """
+    Bagi frame menjadi tile persegi yang saling tumpang tindih
+
+    Returns:
+        List (x1, y1, x2, y2) setiap tile
+    """
+    step = max(1, int(tile * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile:
+            return [0]
+        positions = list(range(0, length - tile, step))
+        positions.append(length - tile)
+        return positions
+
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def merge_detections(dets: np.ndarray, kpss: Optional[np.ndarray], iou_threshold: float = TILE_NMS_THRESHOLD):
+    """
+    NMS lintas tile. Box yang sebagian besar berada di dalam box lain dengan skor
+    lebih tinggi (wajah terpotong di tepi tile) juga dibuang.
+
+    Args:
+        dets: Array (N, 5) [x1, y1, x2, y2, score] dalam koordinat frame
+        kpss: Array (N, 5, 2) landmark atau None
+
+    Returns:
+        Tuple (dets, kpss) setelah deduplikasi, urut skor menurun
+    """
+    if len(dets) == 0:
+        return dets, kpss
+    order = dets[:, 4].argsort()[::-1]
+    x1, y1, x2, y2 = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3]
+    areas = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = w * h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-6)
+        contained = inter / np.maximum(areas[rest], 1e-6)
+        order = rest[(iou <= iou_threshold) & (contained <= 0.6)]
+    keep = np.array(keep)
+    return dets[keep], (kpss[keep] if kpss is not None else None)
+
+
+def letterbox(image: np.ndarray, input_size: Tuple[int, int]) -> Tuple[np.ndarray, float]:
+    """
+    Resize dengan rasio tetap lalu tempel di kiri atas kanvas input detector,
+    sama seperti RetinaFace.detect
+
+    Args:
+        image: Gambar BGR
+        input_size: (width, height) input detector
+
+    Returns:
+        Tuple (gambar ukuran input_size, skala resize)
+    """
+    width, height = input_size
+    im_ratio = float(image.shape[0]) / image.shape[1]
+    if im_ratio > float(height) / width:
+        new_height = height
+        new_width = int(new_height / im_ratio)
+    else:
+        new_width = width
+        new_height = int(new_width * im_ratio)
+    det_img = np.zeros((height, width, 3), dtype=np.uint8)
+    det_img[:new_height, :new_width, :] = cv2.resize(image, (new_width, new_height))
+    return det_img, float(new_height) / image.shape[0]
 
 
 class FaceDetector:
@@ -13,33 +106,61 @@ class FaceDetector:
     Face Detector menggunakan RetinaFace
     """
     
-    def __init__(self, use_gpu: bool = True):
+    def __init__(self, profile_name: Optional[str] = None):
         """
         Inisialisasi RetinaFace detector
+        
+        Args:
+            profile_name: Nama profil runtime di RUNTIME_PROFILES (default RUNTIME_PROFILE)
         """
         print("Memuat model RetinaFace...")
         
-        # Inisialisasi FaceAnalysis dengan model buffalo_l (termasuk RetinaFace + ArcFace)
-        self.app = FaceAnalysis(
-            name='buffalo_l',
-            root=str(MODELS_DIR),
-            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-        )
+        # Model buffalo_l (RetinaFace + ArcFace) dengan profil runtime ONNX Runtime
+        self.app = load_face_models(DETECTION_THRESHOLD, profile_name or RUNTIME_PROFILE)
+        
+        # Thread intra-op dibaca dari sesi yang benar-benar dibuat, bukan dari
+        # SessionOptions yang diminta
+        for taskname, model in self.app.models.items():
+            print(f"Providers {taskname}: {model.session.get_providers()}, "
+                  f"ORT intra-op threads: {model.session.get_session_options().intra_op_num_threads}")
         
-        # PENTING: Set context
-        ctx_id = 0 if use_gpu else -1  # 0 = GPU, -1 = CPU
-        # Prepare dengan detection size
-        self.app.prepare(ctx_id=ctx_id, det_size=TARGET_FACE_SIZE, det_thresh=DETECTION_THRESHOLD)
+        # Deteksi batch (satu panggilan sesi N x 3 x H x W) hanya jika model
+        # RetinaFace punya dimensi batch dinamis; jika tidak, deteksi per frame
+        det_model = self.app.det_model
+        batch_dim = det_model.session.get_inputs()[0].shape[0]
+        self.batched_detection = bool(getattr(det_model, 'batched', False)) and not isinstance(batch_dim, int)
+        print(f"Deteksi batch RetinaFace: {'aktif' if self.batched_detection else 'tidak didukung model, per frame'}")
         
-        print(f"Model running on: {'GPU' if use_gpu else 'CPU'}")
-        print(f"Providers: {self.app.models['recognition'].session.get_providers()}")
+        # Pool untuk deteksi tile secara paralel (ORT melepas GIL selama inferensi)
+        self.tile_executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="face-tile") if TILING_ENABLED else None
         
         
         print("Model RetinaFace berhasil dimuat!")
     
+    def warmup(self):
+        """
+        Jalankan inferensi pada gambar sintetis agar biaya first-run ONNX Runtime
+        (alokasi memory arena, inisialisasi kernel) tidak dibayar frame pertama
+        """
+        rng = np.random.default_rng(0)
+        start = time.perf_counter()
+        image = rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+        self.app.det_model.detect(image, max_num=0, metric='default')
+        if self.batched_detection:
+            self.detect_batch([image, image])
+        if self.tile_executor is not None:
+            self.app.det_model.detect(image[:TILE_SIZE, :TILE_SIZE], input_size=TILE_DET_SIZE, max_num=0, metric='default')
+        rec_model = self.app.models.get('recognition')
+        if rec_model is not None:
+            size = rec_model.input_size[0]
+            for batch in (1, RECOGNITION_BATCH_SIZE):
+                rec_model.get_feat([rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(batch)])
+        print(f"WAKTU: Warmup model: {time.perf_counter() - start:.2f} s")
+    
     def detect_faces(self, image: np.ndarray) -> list:
         """
-        Deteksi wajah dalam gambar
+        Deteksi wajah dalam gambar lalu jalankan model lanjutan (recognition)
+        pada semua wajah
         
         Args:
             image: Gambar dalam format numpy array (BGR)
@@ -47,20 +168,211 @@ class FaceDetector:
         Returns:
             List of detected faces dengan informasi bbox, landmarks, embedding
         """
+        faces = self.detect(image)
+        return self.analyze(image, faces)
+    
+    def detect(self, image: np.ndarray) -> list:
+        """
+        Tahap deteksi saja: bbox, 5 keypoints dan skor, tanpa embedding
+        
+        Args:
+            image: Gambar dalam format numpy array (BGR)
+            
+        Returns:
+            List Face tanpa embedding
+        """
         if image is None:
             return []
         
         # if len(image.shape) == 2 or (len(image.shape) == 3 and image.shape[2] == 1):
         #     image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
         
-        # Deteksi wajah
-        faces = self.app.get(image)
+        if self._use_tiling(image):
+            dets, kpss = self.detect_tiled(image)
+        else:
+            dets, kpss = self.app.det_model.detect(image, max_num=0, metric='default')
+        return self._to_faces(dets, kpss)
+    
+    def detect_batch(self, images: List[np.ndarray]) -> List[list]:
+        """
+        Deteksi beberapa frame sekaligus. Frame di-letterbox ke ukuran input
+        detector lalu dijalankan dalam satu panggilan sesi RetinaFace. Frame
+        yang memakai tiling, atau semua frame jika model tidak mendukung batch,
+        dideteksi per frame dengan detect().
         
+        Args:
+            images: List gambar BGR
+            
+        Returns:
+            List Face tanpa embedding untuk setiap gambar (urutan sama dengan images)
+        """
+        faces_per_image: List[Optional[list]] = [None] * len(images)
+        batchable = [i for i, image in enumerate(images) if image is not None and not self._use_tiling(image)]
+        if self.batched_detection and len(batchable) > 1:
+            detections = self._detect_batched([images[i] for i in batchable])
+            for i, (dets, kpss) in zip(batchable, detections):
+                faces_per_image[i] = self._to_faces(dets, kpss)
+        return [faces if faces is not None else self.detect(image)
+                for image, faces in zip(images, faces_per_image)]
+    
+    def _detect_batched(self, images: List[np.ndarray]) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+        """
+        Satu panggilan sesi RetinaFace untuk N frame, decode anchor dan NMS per
+        frame sama seperti RetinaFace.detect / forward
+
+        Returns:
+            List (dets (N, 5), kpss (N, 5, 2) atau None) per frame
+        """
+        det = self.app.det_model
+        input_size = det.input_size
+        letterboxed = [letterbox(image, input_size) for image in images]
+        blob = cv2.dnn.blobFromImages(
+            [det_img for det_img, _ in letterboxed], 1.0 / det.input_std, input_size,
+            (det.input_mean, det.input_mean, det.input_mean), swapRB=True
+        )
+        net_outs = det.session.run(det.output_names, {det.input_name: blob})
+        input_height, input_width = blob.shape[2], blob.shape[3]
+        fmc = det.fmc
+        
+        results = []
+        for b, (_, det_scale) in enumerate(letterboxed):
+            scores_list, bboxes_list, kpss_list = [], [], []
+            for idx, stride in enumerate(det._feat_stride_fpn):
+                scores = net_outs[idx][b]
+                bbox_preds = net_outs[idx + fmc][b] * stride
+                height, width = input_height // stride, input_width // stride
+                key = (height, width, stride)
+                anchor_centers = det.center_cache.get(key)
+                if anchor_centers is None:
+                    anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+                    anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+                    if det._num_anchors > 1:
+                        anchor_centers = np.stack([anchor_centers] * det._num_anchors, axis=1).reshape((-1, 2))
+                    det.center_cache[key] = anchor_centers
+                pos_inds = np.where(scores >= det.det_thresh)[0]
+                scores_list.append(scores[pos_inds])
+                bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+                if det.use_kps:
+                    kpss = distance2kps(anchor_centers, net_outs[idx + fmc * 2][b] * stride)
+                    kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+            
+            scores = np.vstack(scores_list)
+            order = scores.ravel().argsort()[::-1]
+            bboxes = np.vstack(bboxes_list) / det_scale
+            pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+            keep = det.nms(pre_det)
+            kpss = None
+            if det.use_kps:
+                kpss = (np.vstack(kpss_list) / det_scale)[order, :, :][keep, :, :]
+            results.append((pre_det[keep, :], kpss))
+        return results
+    
+    @staticmethod
+    def _to_faces(dets: np.ndarray, kpss: Optional[np.ndarray]) -> list:
+        return [
+            Face(bbox=dets[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=dets[i, 4])
+            for i in range(dets.shape[0])
+        ]
+    
+    def analyze(self, image: np.ndarray, faces: list) -> list:
+        """
+        Jalankan model selain detection (recognition, dan modul lain di
+        DETECTOR_MODULES) hanya pada wajah yang dipilih
+        
+        Args:
+            image: Gambar BGR tempat wajah dideteksi
+            faces: List Face hasil detect()
+            
+        Returns:
+            List Face yang sama, sudah berisi embedding
+        """
+        self.analyze_batch([image], [faces])
         return faces
     
+    def analyze_batch(self, images: List[np.ndarray], faces_per_image: List[list]):
+        """
+        Versi batch dari analyze untuk beberapa frame. Semua wajah di-align
+        (norm_crop) lalu ArcFace dijalankan dalam batch RECOGNITION_BATCH_SIZE,
+        bukan satu panggilan sesi ONNX per wajah. face.embedding diisi in-place.
+        
+        Args:
+            images: List gambar BGR
+            faces_per_image: List Face untuk setiap gambar (urutan sama dengan images)
+        """
+        rec_model = self.app.models.get('recognition')
+        crops = []
+        targets = []
+        for image, faces in zip(images, faces_per_image):
+            for face in faces:
+                for taskname, model in self.app.models.items():
+                    if taskname in ('detection', 'recognition'):
+                        continue
+                    model.get(image, face)
+                if rec_model is not None and face.kps is not None:
+                    crops.append(face_align.norm_crop(image, landmark=face.kps, image_size=rec_model.input_size[0]))
+                    targets.append(face)
+        
+        for offset in range(0, len(crops), RECOGNITION_BATCH_SIZE):
+            features = rec_model.get_feat(crops[offset:offset + RECOGNITION_BATCH_SIZE])
+            for face, feature in zip(targets[offset:offset + RECOGNITION_BATCH_SIZE], features):
+                face.embedding = feature.flatten()
+    
+    def _use_tiling(self, image: np.ndarray) -> bool:
+        return self.tile_executor is not None and max(image.shape[:2]) > TILE_MIN_FRAME_SIZE
+    
+    def detect_tiled(self, image: np.ndarray, budget_ms: float = DETECTION_LATENCY_BUDGET_MS):
+        """
+        Deteksi wajah per tile (paralel) ditambah satu pass frame penuh untuk wajah
+        besar, lalu gabungkan dengan NMS. Tile yang belum selesai saat budget
+        latency habis dilewati.
+        
+        Args:
+            image: Gambar BGR resolusi tinggi
+            budget_ms: Budget latency deteksi per frame (0 = tanpa batas)
+            
+        Returns:
+            Tuple (dets (N, 5) [x1, y1, x2, y2, score], kpss (N, 5, 2) atau None)
+        """
+        start = time.perf_counter()
+        det_model = self.app.det_model
+        height, width = image.shape[:2]
+        tiles = tile_grid(height, width)
+        
+        def detect_tile(tile):
+            x1, y1, x2, y2 = tile
+            dets, kpss = det_model.detect(image[y1:y2, x1:x2], input_size=TILE_DET_SIZE, max_num=0, metric='default')
+            dets = dets.copy()
+            dets[:, [0, 2]] += x1
+            dets[:, [1, 3]] += y1
+            if kpss is not None:
+                kpss = kpss + np.array([x1, y1], dtype=kpss.dtype)
+            return dets, kpss
+        
+        futures = [self.tile_executor.submit(detect_tile, tile) for tile in tiles]
+        # Pass frame penuh dengan det_size biasa untuk wajah dekat kamera yang terpotong tile
+        results = [det_model.detect(image, max_num=0, metric='default')]
+        remaining = None
+        if budget_ms:
+            remaining = max(0.0, budget_ms / 1000.0 - (time.perf_counter() - start))
+        done, not_done = wait(futures, timeout=remaining)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            print(f"Warning: Budget deteksi {budget_ms} ms habis, {len(not_done)}/{len(tiles)} tile dilewati")
+        results.extend(future.result() for future in futures if future in done)
+        
+        dets = np.vstack([r[0] for r in results])
+        kpss = None
+        if all(r[1] is not None for r in results):
+            kpss = np.concatenate([r[1] for r in results])
+        dets, kpss = merge_detections(dets, kpss)
+        print(f"WAKTU: Deteksi {len(tiles)} tile: {time.perf_counter() - start:.3f} s, {len(dets)} wajah")
+        return dets, kpss
+    
     def detect_single_face(self, image: np.ndarray):
         """
-        Deteksi wajah tunggal (ambil yang paling besar jika ada beberapa)
+        Deteksi wajah tunggal (ambil yang paling besar jika ada beberapa).
+        Embedding hanya dihitung untuk wajah yang dipilih.
         
         Args:
             image: Gambar dalam format numpy array (BGR)
@@ -68,18 +380,29 @@ class FaceDetector:
         Returns:
             Face object atau None jika tidak ada wajah
         """
-        faces = self.detect_faces(image)
+        largest_face = self.detect_largest_face(image)
+        if largest_face is None:
+            return None
+        return self.analyze(image, [largest_face])[0]
+    
+    def detect_largest_face(self, image: np.ndarray):
+        """
+        Deteksi wajah paling besar tanpa menghitung embedding (untuk analyze_batch)
+        
+        Args:
+            image: Gambar dalam format numpy array (BGR)
+            
+        Returns:
+            Face object tanpa embedding atau None jika tidak ada wajah
+        """
+        faces = self.detect(image)
         
         if not faces:
             print("[DEBUG] Tidak ada wajah terdeteksi.")
             return None
         
-        if len(faces) == 1:
-            return faces[0]
-        
         # Jika ada beberapa wajah, ambil yang paling besar (berdasarkan area bbox)
-        largest_face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-        return largest_face
+        return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
     
     def detect_faces_with_boxes(self, image: np.ndarray) -> Tuple[List[np.ndarray], List[Tuple[int, int, int, int]]]:
         """
@@ -91,24 +414,23 @@ class FaceDetector:
         Returns:
             Tuple (List of cropped faces, List of bounding boxes (x, y, w, h))
         """
-        face_objects = []
-        bboxes = []
-        
         # Deteksi wajah menggunakan InsightFace
         print("Mendeteksi wajah dalam gambar...")
         detections = self.detect_faces(image)
         print(f"Ditemukan {len(detections)} wajah.")
         
-        for face in detections:
-            # InsightFace bbox format: [x1, y1, x2, y2]
-            bbox = face.bbox.astype(int)
-            x1, y1, x2, y2 = bbox
-            
-            # Convert ke format (x, y, width, height)
-            w = x2 - x1
-            h = y2 - y1
-            
-            face_objects.append(face)
-            bboxes.append((x1, y1, w, h))
+        return detections, [self.face_box(face) for face in detections]
+    
+    @staticmethod
+    def face_box(face) -> Tuple[int, int, int, int]:
+        """
+        Bounding box wajah dalam format (x, y, width, height)
+        """
+        # InsightFace bbox format: [x1, y1, x2, y2]
+        bbox = face.bbox.astype(int)
+        x1, y1, x2, y2 = bbox
         
-        return face_objects, bboxes
\ No newline at end of file
+        # Convert ke format (x, y, width, height)
+        w = x2 - x1
+        h = y2 - y1
+        return (x1, y1, w, h)
@@ -2,7 +2,7 @@
 Face Encoding menggunakan ArcFace dari InsightFace library
 """
 import numpy as np
-from typing import Optional
+from typing import List, Optional
 
 
 class FaceEncoder:
@@ -41,6 +41,26 @@ class FaceEncoder:
         
         return embedding
     
+    def get_embeddings(self, faces: list) -> List[Optional[np.ndarray]]:
+        """
+        Ambil embedding ternormalisasi untuk banyak wajah sekaligus
+        (hasil FaceDetector.analyze_batch)
+        
+        Args:
+            faces: List Face object
+            
+        Returns:
+            List embedding (None untuk wajah tanpa embedding)
+        """
+        embeddings: List[Optional[np.ndarray]] = [None] * len(faces)
+        index = [i for i, face in enumerate(faces) if face is not None and face.embedding is not None]
+        if index:
+            matrix = np.stack([faces[i].embedding for i in index]).astype(np.float32)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+            for i, row in zip(index, matrix):
+                embeddings[i] = row
+        return embeddings
+    
     @staticmethod
     def compute_cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
@@ -17,13 +17,41 @@ from .timer import timerawal, timerstoptampilkantimer
 
 from .config import (
     DATABASE_IMAGES_DIR,
+    ENROLLMENT_BATCH_SIZE,
+    GALLERY_SNAPSHOT_ENABLED,
+    GALLERY_SNAPSHOT_PATH,
     TESTING_IMAGES_DIR,
     RECOGNITION_THRESHOLD,
     SUPPORTED_EXTENSIONS,
 )
 from .face_detector import FaceDetector
 from .face_encoder import FaceEncoder
+from .ann_index import prepare_ann_index, prepare_centroid_index
+from .attendance_writer import AttendanceWriter
+from .candidate_gallery import CandidateGalleries
 from .database import FaceDatabase
+from .enrollment import STATUS_ENROLLED, EnrollmentItem, EnrollmentManifest, FaceEnroller
+from .gallery import EmbeddingGallery
+from .gallery_snapshot import load_snapshot, save_snapshot
+from .gallery_sync import OP_RESET, GallerySync, change_log_covers, publish_change
+from .frame_gate import FrameGate
+from .preprocessing import FramePreprocessor, FrameTransform
+
+
+def bounding_box_dict(bbox) -> Optional[Dict]:
+    """
+    Format bounding box (x, y, w, h) untuk response API
+    """
+    if bbox is None:
+        return None
+    return {
+        "x": int(bbox[0]),
+        "y": int(bbox[1]),
+        "width": int(bbox[2]),
+        "height": int(bbox[3]),
+        "x2": int(bbox[0] + bbox[2]),
+        "y2": int(bbox[1] + bbox[3])
+    }
 
 
 class FaceRecognitionSystem:
@@ -42,25 +70,88 @@ class FaceRecognitionSystem:
         self.detector = FaceDetector()
         self.encoder = FaceEncoder()
         self.database = FaceDatabase()
+        # Kehadiran ditulis batch oleh background thread (write-behind)
+        self.attendance_writer = AttendanceWriter(self.database)
+        self.attendance_writer.start()
+        # Profil kamera per class_id (decode tereduksi + ROI)
+        self.preprocessor = FramePreprocessor()
+        # Frame yang tidak berubah dari kamera yang sama memakai hasil sebelumnya
+        self.frame_gate = FrameGate()
         
         # Cache embeddings saat startup (bukan per-request)
         print("Loading embeddings ke cache...")
-        self._cached_embeddings = []
+        self._cached_embeddings = EmbeddingGallery()
         self._cached_visitor_embeddings = []
-        self.refresh_embeddings_cache()
+        self.load_embeddings_cache()
+        
+        # Tarik perubahan gallery dari worker lain (change stream / polling)
+        self.gallery_sync = GallerySync(lambda: self._cached_embeddings, self.refresh_embeddings_cache)
+        self.gallery_sync.pull()
+        self.gallery_sync.start()
+        
+        # Registrasi wajah massal (deteksi paralel + insert bulk)
+        self.enroller = FaceEnroller(self.detector, self.encoder, lambda: self._cached_embeddings)
+        
+        # Sub-gallery mahasiswa terdaftar per class_id sesuai jadwal
+        self.candidate_galleries = CandidateGalleries(lambda: self._cached_embeddings)
+        self.candidate_galleries.start()
                 
         print("="*50)
         print("Sistem siap digunakan!") 
         print("="*50)
     
+    def warmup(self):
+        """
+        Warmup model dan pencarian gallery sebelum sistem menerima frame
+        """
+        self.detector.warmup()
+        gallery = self._cached_embeddings
+        if len(gallery):
+            query = np.random.default_rng(0).standard_normal((1, gallery.dim)).astype(np.float32)
+            gallery.top_users(query / np.linalg.norm(query), k=2)
+    
+    def load_embeddings_cache(self):
+        """
+        Load cache embeddings saat startup. Jika ada snapshot, gallery di-memory-map
+        (dibagi antar worker) dan hanya delta yang lebih baru dari version snapshot
+        yang ditarik dari MongoDB oleh GallerySync. Tanpa snapshot, atau jika
+        change log sudah tidak mencakup version snapshot, reload penuh.
+        """
+        gallery = load_snapshot(GALLERY_SNAPSHOT_PATH) if GALLERY_SNAPSHOT_ENABLED else None
+        if gallery is None:
+            self.refresh_embeddings_cache()
+            return
+        if not change_log_covers(gallery.version):
+            # Snapshot lebih tua dari retensi change log, delta tidak bisa ditarik
+            print(f"Info: Snapshot gallery version {gallery.version} terlalu lama, reload penuh")
+            self.refresh_embeddings_cache()
+            return
+        
+        print(f"Snapshot gallery di-load: {len(gallery)} embeddings, version {gallery.version}")
+        prepare_ann_index(gallery)
+        prepare_centroid_index(gallery)
+        self._cached_embeddings = gallery
+    
     def refresh_embeddings_cache(self):
         """
-        Refresh cache embeddings dari database.
-        Panggil method ini setelah ada perubahan data embedding.
+        Reload penuh cache embeddings dari database (rekonsiliasi).
+        Perubahan biasa (append/remove) sudah di-update secara incremental,
+        method ini hanya perlu dipanggil untuk rekonsiliasi eksplisit.
         """
         print("Refreshing embeddings cache...")
-        self._cached_embeddings = self.database.get_all_embeddings()
-        print(f"Cache updated: {len(self._cached_embeddings)} user embeddings")
+        gallery = self.database.load_gallery()
+        if GALLERY_SNAPSHOT_ENABLED:
+            try:
+                save_snapshot(gallery, GALLERY_SNAPSHOT_PATH)
+                # Pakai matrix float32 dari memory-map agar dibagi antar worker
+                # (dan tidak resident untuk storage terkuantisasi)
+                gallery = load_snapshot(GALLERY_SNAPSHOT_PATH) or gallery
+            except OSError as e:
+                print(f"Warning: Gagal menulis snapshot gallery: {e}")
+        prepare_ann_index(gallery)
+        prepare_centroid_index(gallery)
+        self._cached_embeddings = gallery
+        print(f"Cache updated: {len(self._cached_embeddings)} embeddings, {self._cached_embeddings.user_count} users, storage {self._cached_embeddings.storage}")
     
     def extract_name_from_filename(self, filename: str) -> str:
         """
@@ -105,13 +196,20 @@ class FaceRecognitionSystem:
             print(f"Warning: Gagal memuat gambar {image_path}")
         return image
     
-    def register_faces_from_folder(self, folder_path: str = None, clear_existing: bool = True, dataset = DATABASE_IMAGES_DIR) -> Dict:
+    def register_faces_from_folder(self, folder_path: str = None, clear_existing: bool = False, dataset = DATABASE_IMAGES_DIR) -> Dict:
         """
-        Daftarkan semua wajah dari folder ke database
+        Daftarkan semua wajah dari folder ke database secara incremental.
+        File yang isinya tidak berubah sejak registrasi terakhir (hash konten di
+        manifest) dan vector-nya masih ada dilewati; file yang berubah
+        menggantikan vector lamanya; vector file yang dihapus / di-rename dari
+        folder ikut dihapus.
+        Gambar diproses per ENROLLMENT_BATCH_SIZE: decode & deteksi paralel,
+        embedding batch, bulk upsert user dan insert_many vector. Gallery
+        di-update incremental sehingga recognition tetap berjalan.
         
         Args:
             folder_path: Path ke folder berisi gambar wajah
-            clear_existing: Hapus data existing sebelum registrasi
+            clear_existing: Hapus semua data vector existing sebelum registrasi
             
         Returns:
             Dictionary dengan statistik registrasi
@@ -125,8 +223,8 @@ class FaceRecognitionSystem:
             raise ValueError(f"Folder tidak ditemukan: {folder}")
         
         # Get all image files
-        image_files = [f for f in folder.iterdir() 
-                      if f.suffix.lower() in SUPPORTED_EXTENSIONS]
+        image_files = sorted(f for f in folder.iterdir() 
+                             if f.suffix.lower() in SUPPORTED_EXTENSIONS)
         
         if not image_files:
             raise ValueError(f"Tidak ada gambar ditemukan di {folder}")
@@ -134,82 +232,116 @@ class FaceRecognitionSystem:
         print(f"\nMendaftarkan wajah dari: {folder}")
         print(f"Ditemukan {len(image_files)} gambar")
         
+        manifest = EnrollmentManifest()
         if clear_existing:
             # deleted_vector = vector_collection.clear_database()
             vector_collection.delete_many({})
+            self._cached_embeddings.clear()
+            self._cached_embeddings.version = publish_change(OP_RESET)
+            manifest.clear()
             print(f"Database dibersihkan Vektor Colllection entri dihapus)")
         
         stats = {
             "total_images": len(image_files),
             "success": 0,
+            "skipped": 0,
             "failed": 0,
+            "removed": 0,
             "persons": set()
         }
         
-        for image_file in tqdm(image_files, desc="Mendaftarkan wajah"):
-            person_name = self.extract_name_from_filename(image_file.name)
-            print(f"Memproses: {image_file.name} (Nama: {person_name})")
-            # Load image
-            image = self.load_image(image_file)
-            if image is None:
-                stats["failed"] += 1
-                continue
-            
-            # Detect face
-            face = self.detector.detect_single_face(image)
-            if face is None:
-                print(f"Warning: Tidak ada wajah terdeteksi di {image_file.name}")
-                stats["failed"] += 1
-                continue
-            
-            # Get embedding
-            embedding = self.encoder.get_embedding(face)
-            if embedding is None:
-                print(f"Warning: Gagal mengekstrak embedding dari {image_file.name}")
-                stats["failed"] += 1
-                continue
-            
-            # 1. Cek apakah user dengan nama tersebut sudah ada
-            existing_user = users_collection.find_one({"name": person_name})
-            
-            # 2. Jika belum ada, insert user baru. Jika sudah, ambil id-nya
-            if existing_user is None:
-                # Insert user baru
-                print(f"Info: Mendaftarkan user baru '{person_name}'.")
-                user_result = users_collection.insert_one({
-                    "name": person_name,
-                    "created_at": datetime.now().isoformat()
-                })
-                user_id = user_result.inserted_id
-            else:
-                # Ambil id user yang sudah ada
-                print(f"Info: User '{person_name}' sudah terdaftar, menggunakan data existing.")
-                user_id = existing_user["_id"]
-            
-            # 3. Insert vector dengan FK user_id
-            vector_document = {
-                "user_id": user_id,
-                "embedding": embedding.tolist(),
-                "created_at": datetime.now().isoformat()
-            }
-            vector_collection.insert_one(vector_document)
-            
-            stats["success"] += 1
-            stats["persons"].add(person_name)
+        # File yang dihapus / di-rename sejak registrasi terakhir: vector-nya dihapus
+        folder_keys = {str(f.resolve()) for f in image_files}
+        stale_keys = [key for key in manifest.keys_in(folder) if key not in folder_keys]
+        if stale_keys:
+            stats["removed"] = self.enroller.remove_vectors(
+                [manifest.entries.pop(key).get("vector_id") for key in stale_keys]
+            )
+            manifest.save()
+            print(f"Info: {len(stale_keys)} file tidak ada lagi di folder, {stats['removed']} vector dihapus")
         
-        stats["persons"] = list(stats["persons"])
+        # Vector yang dihapus di luar registrasi folder tidak boleh membuat file-nya dilewati
+        existing_vectors = self.enroller.existing_vectors(
+            [manifest.entries[key].get("vector_id") for key in folder_keys if key in manifest.entries]
+        )
+        
+        with tqdm(total=len(image_files), desc="Mendaftarkan wajah") as progress:
+            for start in range(0, len(image_files), ENROLLMENT_BATCH_SIZE):
+                batch_files = image_files[start:start + ENROLLMENT_BATCH_SIZE]
+                contents = self.enroller.read_files(batch_files)
+                
+                # Lewati file yang tidak berubah sejak registrasi terakhir
+                pending = []
+                for image_file, (data, digest) in zip(batch_files, contents):
+                    key = str(image_file.resolve())
+                    if manifest.unchanged(key, digest) and manifest.entries[key].get("vector_id") in existing_vectors:
+                        stats["skipped"] += 1
+                        continue
+                    pending.append((image_file, key, data, digest))
+                progress.update(len(batch_files) - len(pending))
+                if not pending:
+                    continue
+                
+                images = self.enroller.decode_many([data for _, _, data, _ in pending])
+                items = [
+                    EnrollmentItem(key, image, name=self.extract_name_from_filename(image_file.name), digest=digest)
+                    for (image_file, key, _, digest), image in zip(pending, images)
+                ]
+                # Vector lama file yang berubah baru dihapus setelah penggantinya
+                # terdaftar; jika gagal, vector & entry manifest lama dipertahankan
+                replaced = []
+                for (image_file, _, _, _), item, result in zip(pending, items, self.enroller.enroll(items)):
+                    if result["status"] == STATUS_ENROLLED:
+                        stats["success"] += 1
+                        stats["persons"].add(item.name)
+                        previous = manifest.entries.get(item.key)
+                        if previous is not None and previous.get("vector_id") != result["vector_id"]:
+                            replaced.append(previous.get("vector_id"))
+                        manifest.entries[item.key] = {
+                            "sha256": item.digest,
+                            "user_id": result["user_id"],
+                            "vector_id": result["vector_id"],
+                        }
+                    else:
+                        print(f"Warning: {image_file.name}: {result['message']}")
+                        stats["failed"] += 1
+                self.enroller.remove_vectors(replaced)
+                progress.update(len(pending))
+                # Simpan progres per batch agar registrasi yang terputus bisa dilanjutkan
+                manifest.save()
         
-        # Refresh cache setelah registrasi selesai
-        self.refresh_embeddings_cache()
+        stats["persons"] = list(stats["persons"])
         
         print(f"\n--- Hasil Registrasi ---")
         print(f"Berhasil: {stats['success']}/{stats['total_images']}")
+        print(f"Dilewati (tidak berubah): {stats['skipped']}/{stats['total_images']}")
+        print(f"Vector file yang dihapus dari folder: {stats['removed']}")
         print(f"Gagal: {stats['failed']}/{stats['total_images']}")
         print(f"Jumlah orang terdaftar: {len(stats['persons'])}")
         print(f"Nama terdaftar: {','.join(sorted(stats['persons']))}")
         
         return stats
     
+    def enroll_images(self, uploads: List[Tuple[str, bytes, Optional[str], Optional[str]]]) -> List[Dict]:
+        """
+        Daftarkan satu batch gambar hasil upload (dipakai /face/enroll).
+        Deteksi berjalan berurutan di thread pemanggil agar tidak berebut
+        thread ORT dengan recognition.
+        
+        Args:
+            uploads: List (nama file, isi file, nama user, user_id); salah satu
+                dari nama user atau user_id harus diisi
+            
+        Returns:
+            List status per gambar (lihat FaceEnroller.enroll)
+        """
+        images = self.enroller.decode_many([data for _, data, _, _ in uploads])
+        items = [
+            EnrollmentItem(filename, image, name=name, user_id=user_id)
+            for (filename, _, name, user_id), image in zip(uploads, images)
+        ]
+        return self.enroller.enroll(items, parallel=False)
+    
     def recognize_faces(self, image: np.ndarray, class_id: str, threshold: float = None) -> List[Dict]:
         """
         Kenali banyak wajah dalam gambar
@@ -221,73 +353,151 @@ class FaceRecognitionSystem:
         Returns:
             List of recognition results dengan user_id dan bounding box
         """
+        return self.recognize_faces_batch([image], [class_id], threshold)[0]
+    
+    def recognize_faces_batch(self, images: List[np.ndarray], class_ids: List[str], threshold: float = None,
+                              transforms: List[Optional[FrameTransform]] = None) -> List[List[Dict]]:
+        """
+        Kenali wajah dari beberapa frame sekaligus (dipakai InferenceScheduler).
+        Embedding semua wajah dari semua frame dicocokkan dengan satu
+        perkalian matrix terhadap gallery.
+        
+        Args:
+            images: List gambar BGR
+            class_ids: class_id untuk setiap gambar
+            threshold: Threshold untuk recognition (default dari config)
+            transforms: FrameTransform per gambar (hasil preprocessing), bounding box
+                dikembalikan dalam pixel frame asli
+            
+        Returns:
+            List hasil recognition per frame (urutan sama dengan images)
+        """
         timer_awal = time.perf_counter()
         if threshold is None:
             threshold = RECOGNITION_THRESHOLD
         
-        results = []
+        results = [[] for _ in images]
+        embeddings = []
+        face_refs = []  # (index frame, bounding box) untuk setiap embedding
         
-        # Detect all faces with bounding boxes
         timer_deteksi_wajah = time.perf_counter()
-        faces, bboxes = self.detector.detect_faces_with_boxes(image)
-        print("WAKTU: Waktu deteksi wajah:", time.perf_counter() - timer_deteksi_wajah)
+        # Tahap 1: deteksi semua frame (satu batch RetinaFace jika model mendukung)
+        faces_per_frame = self.detector.detect_batch(images)
+        for frame_idx, faces in enumerate(faces_per_frame):
+            if not faces:
+                print(f"Warning: Tidak ada wajah terdeteksi di frame ke-{frame_idx+1}")
+        print(f"WAKTU: Waktu deteksi wajah ({len(images)} frame):", time.perf_counter() - timer_deteksi_wajah)
+        
+        # Tahap 2: embedding semua wajah dari semua frame dalam batch ArcFace
+        timer_embedding = time.perf_counter()
+        self.detector.analyze_batch(images, faces_per_frame)
+        for frame_idx, faces in enumerate(faces_per_frame):
+            transform = transforms[frame_idx] if transforms else None
+            for i, embedding in enumerate(self.encoder.get_embeddings(faces)):
+                if embedding is None:
+                    print(f"Warning: Gagal mengekstrak embedding dari wajah ke-{i+1}")
+                    continue
+                bbox = self.detector.face_box(faces[i])
+                if transform is not None:
+                    bbox = transform.to_original(bbox)
+                embeddings.append(embedding)
+                face_refs.append((frame_idx, bbox))
+        print(f"WAKTU: Waktu embedding {len(embeddings)} wajah:", time.perf_counter() - timer_embedding)
         
-        if not faces:
-            print("Warning: Tidak ada wajah terdeteksi")
+        if not embeddings:
             return results
         
-        # Gunakan cached embeddings (sudah di-load saat startup)
-        all_embeddings = self._cached_embeddings
-        all_visitor_embeddings = self._cached_visitor_embeddings
-        print(f"Debug: Total embeddings di cache: {len(all_embeddings)}")
+        # Cocokkan semua wajah dari semua frame sekaligus
+        matches = self.match_embeddings(embeddings, [ref[0] for ref in face_refs], threshold,
+                                        class_ids=[class_ids[ref[0]] for ref in face_refs])
         
         timer_proses_wajah = time.perf_counter()
-        for i, face in enumerate(faces):
-            embedding = self.encoder.get_embedding(face)
+        for (frame_idx, bbox), embedding, match in zip(face_refs, embeddings, matches):
+            user_id = match["user_id"]
+            distance = match["similarity"]
+            class_id = class_ids[frame_idx]
+            print("Debug: Jarak terdekat wajah di frame ke-", frame_idx+1, "adalah:", distance, "margin:", match["margin"])
             
-            if embedding is None:
-                print(f"Warning: Gagal mengekstrak embedding dari wajah ke-{i+1}")
-                continue
-            
-            # Find closest match
-            print("Info: Mencari kecocokan untuk wajah ke-", i+1)
-            timer_cari_cocok = time.perf_counter()
-            user_id, distance = self.database.find_closest_match(embedding, all_embeddings, threshold)
-            print("Debug: Jarak terdekat untuk wajah ke-", i+1, "adalah:", distance)
-            print("WAKTU: Waktu cari kecocokan untuk wajah ke-", i+1, ":", time.perf_counter() - timer_cari_cocok)
-            
-            timer_handle_match = time.perf_counter()
             if user_id: # jika ditemukan di database users
-                print(f"Info: Wajah ke-{i+1} dikenali sebagai user_id: {user_id} dengan jarak: {distance}")
-                added = self.database.maybe_add_embedding(user_id, embedding, all_embeddings)
-                if added:
-                    # Refresh cache karena ada embedding baru
-                    self.refresh_embeddings_cache()
-                    all_embeddings = self._cached_embeddings
-                # Get bounding box
-                print("Debug: Total bounding boxes:", len(bboxes))
-                bbox = bboxes[i] if i < len(bboxes) else None
-                results.append({
+                print(f"Info: Wajah dikenali sebagai user_id: {user_id} dengan jarak: {distance}")
+                results[frame_idx].append({
                     "user_id": user_id,
                     "distance": distance,
-                    "bounding_box": {
-                        "x": int(bbox[0]) if bbox is not None else None,
-                        "y": int(bbox[1]) if bbox is not None else None,
-                        "width": int(bbox[2]) if bbox is not None else None,
-                        "height": int(bbox[3]) if bbox is not None else None,
-                        "x2": int(bbox[0] + bbox[2]) if bbox is not None else None,
-                        "y2": int(bbox[1] + bbox[3]) if bbox is not None else None
-                    } if bbox is not None else None
+                    "margin": match["margin"],
+                    "bounding_box": bounding_box_dict(bbox)
                 })
-                print("Info: Mencatat absensi untuk user_id:", user_id, "class_id:", class_id)
-                self.database.add_user_attendance(user_id, class_id)
+                self.record_recognition(user_id, embedding, class_id)
             else: # jika tidak ditemukan di database users
                 print("Info: Wajah tidak dikenali!")
-            print("WAKTU: Waktu handle kecocokan untuk wajah ke-", i+1, ":", time.perf_counter() - timer_handle_match)
         print("WAKTU: Waktu proses semua wajah:", time.perf_counter() - timer_proses_wajah)
         print("WAKTU: Waktu total pengenalan wajah banyak:", time.perf_counter() - timer_awal)
         return results
     
+    def match_embeddings(self, embeddings: List[np.ndarray], groups: List, threshold: float,
+                         class_ids: List[str] = None) -> List[Dict]:
+        """
+        Cocokkan embedding wajah ke gallery cache (satu perkalian matrix).
+        Jika class_ids diberikan, wajah dicocokkan dulu ke sub-gallery kandidat
+        (mahasiswa terdaftar pada sesi yang berlangsung di class_id tersebut);
+        hanya wajah di bawah threshold yang dicocokkan ke gallery global.
+        
+        Args:
+            embeddings: List embedding ternormalisasi
+            groups: Label frame per wajah (resolusi user ganda per frame)
+            threshold: Threshold recognition
+            class_ids: class_id per wajah (opsional)
+            
+        Returns:
+            List hasil find_closest_matches
+        """
+        # Gunakan cached embeddings (sudah di-load saat startup)
+        all_embeddings = self._cached_embeddings
+        print(f"Debug: Total embeddings di cache: {len(all_embeddings)}")
+        
+        timer_cari_cocok = time.perf_counter()
+        query = np.vstack(embeddings)
+        matches: List[Optional[Dict]] = [None] * len(embeddings)
+        
+        # Tahap 1: sub-gallery kandidat per class_id
+        for class_id in set(class_ids or []):
+            candidates = self.candidate_galleries.get(class_id)
+            if candidates is None:
+                continue
+            rows = [i for i, face_class in enumerate(class_ids) if face_class == class_id]
+            candidate_matches = self.database.find_closest_matches(
+                query[rows], candidates, threshold, groups=[groups[i] for i in rows]
+            )
+            matched = 0
+            for i, match in zip(rows, candidate_matches):
+                if match["user_id"] is not None:
+                    matches[i] = match
+                    matched += 1
+            self.candidate_galleries.record(class_id, matched, len(rows) - matched)
+        
+        # Tahap 2: gallery global untuk wajah yang belum cocok
+        rows = [i for i, match in enumerate(matches) if match is None]
+        if rows:
+            claimed = {(groups[i], match["user_id"]) for i, match in enumerate(matches) if match is not None}
+            global_matches = self.database.find_closest_matches(
+                query[rows], all_embeddings, threshold, groups=[groups[i] for i in rows]
+            )
+            for i, match in zip(rows, global_matches):
+                if (groups[i], match["user_id"]) in claimed:
+                    # User sudah diambil wajah lain di frame yang sama lewat kandidat
+                    match = {**match, "user_id": None}
+                matches[i] = match
+        print("WAKTU: Waktu cari kecocokan untuk", len(matches), "wajah:", time.perf_counter() - timer_cari_cocok)
+        return matches
+    
+    def record_recognition(self, user_id: str, embedding: np.ndarray, class_id: str):
+        """
+        Simpan embedding baru (jika cukup berbeda) dan catat absensi user yang dikenali
+        """
+        # Jika embedding baru disimpan, gallery sudah di-update secara incremental
+        self.database.maybe_add_embedding(user_id, embedding, self._cached_embeddings)
+        print("Info: Mencatat absensi untuk user_id:", user_id, "class_id:", class_id)
+        self.attendance_writer.submit(user_id, class_id)
+    
     def get_database_stats(self) -> Dict:
         """
         Ambil statistik database
@@ -322,22 +532,70 @@ class FaceRecognitionSystem:
         try:
             # Decode base64 ke bytes
             image_bytes = base64.b64decode(image_base64)
+        except Exception as e:
+            print(f"Error: Gagal memproses base64 image: {e}")
+            return None
+        return self.load_image_from_bytes(image_bytes)
+    
+    def load_frame(self, buffer, class_id: str) -> Tuple[Optional[np.ndarray], FrameTransform]:
+        """
+        Decode frame kamera dengan profil preprocessing class_id (decode tereduksi + ROI)
+        
+        Args:
+            buffer: bytes, bytearray atau memoryview berisi file gambar
+            class_id: ID kelas/kamera
+            
+        Returns:
+            Tuple (gambar BGR atau None jika gagal, FrameTransform ke frame asli)
+        """
+        try:
+            image, transform = self.preprocessor.decode(buffer, class_id)
+        except Exception as e:
+            print(f"Error: Gagal memproses gambar: {e}")
+            return None, FrameTransform()
+        if image is None:
+            print("Warning: Gagal decode gambar")
+            return None, transform
+        print(f"[DEBUG] Loaded frame class_id {class_id}, shape: {image.shape}, scale: {transform.scale}")
+        return image, transform
+    
+    def load_frame_from_base64(self, image_base64: str, class_id: str) -> Tuple[Optional[np.ndarray], FrameTransform]:
+        """
+        Sama seperti load_frame untuk input Base64
+        """
+        try:
+            image_bytes = base64.b64decode(image_base64)
+        except Exception as e:
+            print(f"Error: Gagal memproses base64 image: {e}")
+            return None, FrameTransform()
+        return self.load_frame(image_bytes, class_id)
+    
+    def load_image_from_bytes(self, buffer) -> Optional[np.ndarray]:
+        """
+        Decode gambar (JPEG/PNG) langsung dari buffer tanpa salinan tambahan
+        
+        Args:
+            buffer: bytes, bytearray atau memoryview berisi file gambar
             
-            # Convert bytes ke numpy array
-            np_array = np.frombuffer(image_bytes, dtype=np.uint8)
+        Returns:
+            Gambar dalam format BGR (sama seperti cv2.imread) atau None jika gagal
+        """
+        try:
+            # View numpy di atas buffer yang sama (tanpa copy)
+            np_array = np.frombuffer(buffer, dtype=np.uint8)
             
             # Decode numpy array ke image BGR (sama seperti cv2.imread)
             image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
             
             if image is None:
-                print("Warning: Gagal decode gambar dari base64")
+                print("Warning: Gagal decode gambar")
                 return None
             
-            print(f"[DEBUG] Loaded image from base64, shape: {image.shape}")
+            print(f"[DEBUG] Loaded image, shape: {image.shape}")
             return image
             
         except Exception as e:
-            print(f"Error: Gagal memproses base64 image: {e}")
+            print(f"Error: Gagal memproses gambar: {e}")
             return None
     
     def recognize_from_base64_many(self, image_base64: str, class_id: str, threshold: float = None) -> List[Dict]:
@@ -364,5 +622,9 @@ class FaceRecognitionSystem:
         """
         Tutup sistem
         """
+        self.gallery_sync.stop()
+        self.candidate_galleries.stop()
+        self.enroller.close()
+        self.attendance_writer.stop()
         self.database.close()
         
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Siklus hidup FaceRecognitionSystem + InferenceScheduler: dimuat di background
+saat startup aplikasi, di-warmup, lalu ditandai siap (readiness)
+"""
+import threading
+import time
+from typing import Dict, Optional
+from .face_recognition_system import FaceRecognitionSystem
+from .inference_scheduler import InferenceScheduler
+
+STATE_IDLE = "idle"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class FaceService:
+    """
+    Pemegang instance sistem recognition per worker. Model buffalo_l dan
+    gallery dimuat di background thread sehingga route non-face bisa langsung
+    melayani request; route face memeriksa `ready` terlebih dahulu.
+    """
+
+    def __init__(self):
+        self.system: Optional[FaceRecognitionSystem] = None
+        self.scheduler: Optional[InferenceScheduler] = None
+        self.state = STATE_IDLE
+        self.error: Optional[str] = None
+        self._started_at: Optional[float] = None
+        self._load_seconds: Optional[float] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """
+        Mulai memuat model dan gallery di background thread
+        """
+        if self._thread is not None:
+            return
+        self.state = STATE_LOADING
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._load, name="face-service-loader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            system = FaceRecognitionSystem()
+            system.warmup()
+            scheduler = InferenceScheduler(system.recognize_faces_batch)
+            scheduler.start()
+        except Exception as e:
+            self.state = STATE_FAILED
+            self.error = str(e)
+            print(f"Error: Gagal memuat sistem face recognition: {e}")
+            return
+        self.system = system
+        self.scheduler = scheduler
+        self._load_seconds = time.perf_counter() - self._started_at
+        self.state = STATE_READY
+        self._ready.set()
+        print(f"Info: Sistem face recognition siap ({self._load_seconds:.1f} s)")
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Tunggu sampai sistem siap
+
+        Returns:
+            True jika siap sebelum timeout
+        """
+        return self._ready.wait(timeout)
+
+    def status(self) -> Dict:
+        """
+        Status readiness untuk endpoint health check
+        """
+        status = {"state": self.state, "ready": self.ready}
+        if self._load_seconds is not None:
+            status["load_seconds"] = round(self._load_seconds, 2)
+        elif self._started_at is not None:
+            status["elapsed_seconds"] = round(time.perf_counter() - self._started_at, 2)
+        if self.error:
+            status["error"] = self.error
+        if self.system is not None:
+            status["gallery_embeddings"] = len(self.system._cached_embeddings)
+        return status
+
+    def stop(self):
+        """
+        Hentikan scheduler (antrian diselesaikan dulu) dan tutup sistem
+        """
+        self._ready.clear()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.system is not None:
+            self.system.close()
+        self.state = STATE_IDLE
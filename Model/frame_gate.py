@@ -0,0 +1,108 @@
+"""
+Gate perubahan frame per kamera: frame yang hampir sama dengan frame terakhir
+yang diproses dari class_id yang sama tidak dideteksi ulang
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+import cv2
+import numpy as np
+from .config import FRAME_GATE_ENABLED, FRAME_GATE_MAX_AGE, FRAME_GATE_SIZE, FRAME_GATE_THRESHOLD
+
+
+def frame_signature(image: np.ndarray, size: Tuple[int, int] = FRAME_GATE_SIZE) -> np.ndarray:
+    """
+    Thumbnail grayscale kecil sebagai signature frame
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Rata-rata selisih absolut antar signature (0 = identik, 1 = berbeda total)
+    """
+    return float(np.abs(a - b).mean()) / 255.0
+
+
+class CameraState:
+    """
+    Signature dan hasil frame terakhir yang diproses untuk satu class_id
+    """
+    __slots__ = ("signature", "results", "processed_at", "frames", "skipped")
+
+    def __init__(self):
+        self.signature: Optional[np.ndarray] = None
+        self.results: Any = None
+        self.processed_at = 0.0
+        self.frames = 0
+        self.skipped = 0
+
+
+class FrameGate:
+    """
+    Mengembalikan hasil sebelumnya jika frame dari kamera yang sama tidak
+    berubah berarti (selisih thumbnail di bawah FRAME_GATE_THRESHOLD) dan hasil
+    tersebut belum lebih tua dari FRAME_GATE_MAX_AGE detik
+    """
+
+    def __init__(self, enabled: bool = FRAME_GATE_ENABLED, threshold: float = FRAME_GATE_THRESHOLD,
+                 max_age: float = FRAME_GATE_MAX_AGE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_age = max_age
+        self._cameras: Dict[str, CameraState] = {}
+        self._lock = threading.Lock()
+
+    def check(self, class_id: str, image: np.ndarray) -> Tuple[Optional[np.ndarray], Any]:
+        """
+        Periksa apakah frame perlu diproses
+
+        Args:
+            class_id: ID kelas/kamera
+            image: Gambar BGR
+
+        Returns:
+            Tuple (signature frame, hasil sebelumnya atau None jika frame harus diproses)
+        """
+        if not self.enabled:
+            return None, None
+        signature = frame_signature(image)
+        with self._lock:
+            state = self._cameras.setdefault(str(class_id), CameraState())
+            state.frames += 1
+            if (
+                state.signature is not None
+                and state.signature.shape == signature.shape
+                and time.monotonic() - state.processed_at < self.max_age
+                and frame_difference(state.signature, signature) < self.threshold
+            ):
+                state.skipped += 1
+                return signature, state.results
+        return signature, None
+
+    def update(self, class_id: str, signature: Optional[np.ndarray], results: Any):
+        """
+        Simpan signature dan hasil frame yang baru diproses
+        """
+        if signature is None:
+            return
+        with self._lock:
+            state = self._cameras.setdefault(str(class_id), CameraState())
+            state.signature = signature
+            state.results = results
+            state.processed_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Jumlah frame dan frame yang dilewati per class_id
+        """
+        with self._lock:
+            return {
+                class_id: {
+                    "frames": state.frames,
+                    "skipped": state.skipped,
+                    "skip_ratio": round(state.skipped / state.frames, 3) if state.frames else 0.0,
+                }
+                for class_id, state in self._cameras.items()
+            }
@@ -0,0 +1,535 @@
+"""
+Gallery embeddings kolumnar untuk pencocokan wajah yang cepat
+"""
+import tempfile
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .ann_index import IVFIndex, UserCentroidIndex
+from .config import (
+    CENTROID_MIN_USERS,
+    CENTROID_PREFILTER_ENABLED,
+    CENTROID_TOP_K,
+    EMBEDDING_SIZE,
+    GALLERY_RERANK_CANDIDATES,
+    GALLERY_SPILL_DIR,
+    GALLERY_STORAGE,
+)
+
+# Mode penyimpanan matrix untuk first-pass scan
+STORAGE_FLOAT32 = "float32"
+STORAGE_FLOAT16 = "float16"
+STORAGE_INT8 = "int8"
+
+SCAN_BLOCK_ROWS = 16384  # Baris per blok saat dekuantisasi first-pass scan
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Normalisasi L2 setiap baris matrix (in-place untuk float32)
+
+    Args:
+        matrix: Matrix (n x dim)
+
+    Returns:
+        Matrix float32 dengan setiap baris ber-norm 1
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class EmbeddingGallery:
+    """
+    Menyimpan semua embedding sebagai satu matrix float32 kontigu yang sudah
+    dinormalisasi, ditambah array index user yang paralel dengan baris matrix.
+    Baris ke-i milik user_ids[user_index[i]].
+
+    Buffer dialokasikan dengan kapasitas cadangan sehingga append/remove
+    embedding bersifat O(1) (amortized) tanpa reload seluruh collection.
+
+    Dengan storage float16/int8, first-pass scan memakai salinan terkuantisasi
+    dan hanya baris kandidat teratas yang di-rerank exact dengan matrix float32.
+    Matrix float32 tersebut selalu berupa memory-map (snapshot, atau file
+    sementara di GALLERY_SPILL_DIR saat dibangun dari dokumen / buffer
+    diperbesar) sehingga sebagian besar tidak resident.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_SIZE, capacity: int = 0, storage: str = GALLERY_STORAGE):
+        """
+        Inisialisasi gallery kosong
+
+        Args:
+            dim: Dimensi embedding
+            capacity: Kapasitas awal buffer (jumlah baris)
+            storage: STORAGE_FLOAT32, STORAGE_FLOAT16 atau STORAGE_INT8
+        """
+        if storage not in (STORAGE_FLOAT32, STORAGE_FLOAT16, STORAGE_INT8):
+            raise ValueError(f"Storage gallery tidak dikenal: {storage}")
+        self.dim = dim
+        self.storage = storage
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._user_index = np.empty(capacity, dtype=np.int32)
+        self._scan: Optional[np.ndarray] = None
+        self._scan_scale: Optional[np.ndarray] = None
+        self._size = 0
+        self.vector_ids: List[Optional[str]] = []
+        self._row_lookup: Dict[str, int] = {}
+        self.user_ids: List[str] = []
+        self._user_lookup: Dict[str, int] = {}
+        self.version = 0  # Version gallery (lihat gallery_sync) yang sudah diterapkan
+        self.ann_index: Optional[IVFIndex] = None
+        self.centroid_index: Optional[UserCentroidIndex] = None
+        self._lock = threading.RLock()
+        # Salinan scan disiapkan sejak awal agar append ke gallery kosong ikut terkuantisasi
+        self.rebuild_scan()
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict], dim: int = EMBEDDING_SIZE) -> "EmbeddingGallery":
+        """
+        Bangun gallery dari dokumen Vector (field _id, user_id dan embedding)
+
+        Args:
+            documents: List dokumen dari vector_collection
+            dim: Dimensi embedding
+
+        Returns:
+            EmbeddingGallery
+        """
+        gallery = cls(dim)
+        if not documents:
+            return gallery
+
+        gallery._matrix = normalize_rows(
+            np.array([doc["embedding"] for doc in documents], dtype=np.float32)
+        )
+        if gallery.storage != STORAGE_FLOAT32:
+            matrix = gallery._allocate_matrix(len(documents))
+            matrix[:] = gallery._matrix
+            gallery._matrix = matrix
+        gallery._user_index = np.fromiter(
+            (gallery._user_slot(str(doc["user_id"])) for doc in documents),
+            dtype=np.int32,
+            count=len(documents),
+        )
+        gallery._size = len(documents)
+        gallery.rebuild_scan()
+        gallery.rebuild_centroids()
+        for row, doc in enumerate(documents):
+            vector_id = str(doc["_id"]) if doc.get("_id") is not None else None
+            gallery.vector_ids.append(vector_id)
+            if vector_id is not None:
+                gallery._row_lookup[vector_id] = row
+        return gallery
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        View matrix embedding yang terisi (n x dim)
+        """
+        return self._matrix[:self._size]
+
+    @property
+    def user_index(self) -> np.ndarray:
+        """
+        View index user untuk setiap baris matrix (n,)
+        """
+        return self._user_index[:self._size]
+
+    @property
+    def user_count(self) -> int:
+        """
+        Jumlah user unik dalam gallery
+        """
+        return len(self.user_ids)
+
+    def _user_slot(self, user_id: str) -> int:
+        """
+        Ambil (atau buat) index integer untuk user_id
+        """
+        slot = self._user_lookup.get(user_id)
+        if slot is None:
+            slot = len(self.user_ids)
+            self._user_lookup[user_id] = slot
+            self.user_ids.append(user_id)
+        return slot
+
+    def _allocate_matrix(self, capacity: int) -> np.ndarray:
+        """
+        Buffer matrix float32. Untuk storage terkuantisasi buffer berupa
+        memory-map file sementara (sudah di-unlink) agar tidak resident; hanya
+        salinan scan yang berada di RAM.
+        """
+        if self.storage == STORAGE_FLOAT32 or capacity == 0:
+            return np.empty((capacity, self.dim), dtype=np.float32)
+        with tempfile.TemporaryFile(prefix="gallery-", dir=GALLERY_SPILL_DIR) as spill:
+            spill.truncate(capacity * self.dim * 4)
+            # mmap menduplikasi file descriptor, file tetap ada selama mapping hidup
+            return np.memmap(spill, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        """
+        Perbesar buffer (kapasitas digandakan) agar muat minimal `needed` baris
+        """
+        capacity = max(needed, 2 * self._matrix.shape[0], 64)
+        matrix = self._allocate_matrix(capacity)
+        matrix[:self._size] = self._matrix[:self._size]
+        user_index = np.empty(capacity, dtype=np.int32)
+        user_index[:self._size] = self._user_index[:self._size]
+        self._matrix = matrix
+        self._user_index = user_index
+        if self._scan is not None:
+            scan = np.empty((capacity, self.dim), dtype=self._scan.dtype)
+            scan[:self._size] = self._scan[:self._size]
+            self._scan = scan
+            if self._scan_scale is not None:
+                self._scan_scale = np.resize(self._scan_scale, capacity)
+
+    def rebuild_scan(self, storage: Optional[str] = None):
+        """
+        Bangun ulang salinan terkuantisasi untuk first-pass scan
+
+        Args:
+            storage: Ganti mode storage (default: mode saat ini)
+        """
+        with self._lock:
+            if storage is not None:
+                self.storage = storage
+            if self.storage == STORAGE_FLOAT32:
+                self._scan = None
+                self._scan_scale = None
+                return
+
+            capacity = self._matrix.shape[0]
+            dtype = np.float16 if self.storage == STORAGE_FLOAT16 else np.int8
+            self._scan = np.empty((capacity, self.dim), dtype=dtype)
+            self._scan_scale = np.empty(capacity, dtype=np.float32) if self.storage == STORAGE_INT8 else None
+            for start in range(0, self._size, SCAN_BLOCK_ROWS):
+                self._quantize(start, min(start + SCAN_BLOCK_ROWS, self._size))
+
+    def rebuild_centroids(self):
+        """
+        Bangun ulang centroid per user (coarse stage pencarian dua tahap)
+        """
+        with self._lock:
+            if not CENTROID_PREFILTER_ENABLED:
+                self.centroid_index = None
+                return
+            self.centroid_index = UserCentroidIndex.build(
+                self.matrix, self.user_index, self.user_count, top_k=CENTROID_TOP_K
+            )
+
+    def _quantize(self, start: int, stop: int):
+        """
+        Kuantisasi baris [start, stop) dari matrix float32 ke salinan scan
+        (int8 memakai skala per-vector)
+        """
+        block = np.asarray(self._matrix[start:stop], dtype=np.float32)
+        if self.storage == STORAGE_FLOAT16:
+            self._scan[start:stop] = block
+            return
+        scale = np.abs(block).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        self._scan[start:stop] = np.round(block / scale[:, None])
+        self._scan_scale[start:stop] = scale
+
+    def _approx_similarities(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """
+        First-pass similarity dari salinan terkuantisasi, didekuantisasi per blok
+        ke float32 agar tetap memakai BLAS
+
+        Args:
+            queries: Matrix query ter-normalisasi (faces x dim)
+            rows: Baris yang dipindai (None = semua)
+
+        Returns:
+            Matrix similarity perkiraan (faces x jumlah baris)
+        """
+        total = self._size if rows is None else len(rows)
+        similarities = np.empty((queries.shape[0], total), dtype=np.float32)
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, total)
+            index = slice(start, stop) if rows is None else rows[start:stop]
+            block = self._scan[index].astype(np.float32)
+            if self._scan_scale is not None:
+                block *= self._scan_scale[index][:, None]
+            similarities[:, start:stop] = queries @ block.T
+        return similarities
+
+    def _rerank_rows(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Pilih baris teratas per query dari first-pass scan terkuantisasi untuk
+        di-rerank exact dengan float32
+
+        Returns:
+            Array nomor baris kandidat (gabungan semua query), None jika semua
+            baris cukup di-scan exact
+        """
+        total = self._size if rows is None else len(rows)
+        if total <= GALLERY_RERANK_CANDIDATES:
+            return rows
+        approx = self._approx_similarities(queries, rows)
+        top = np.unique(np.argpartition(-approx, GALLERY_RERANK_CANDIDATES - 1, axis=1)[:, :GALLERY_RERANK_CANDIDATES])
+        return top if rows is None else rows[top]
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Perkiraan memori resident gallery. Matrix float32 berupa memory-map
+        tidak dihitung karena hanya baris hasil rerank yang disentuh (halaman
+        lain boleh di-evict); matrix float32 di RAM selalu dihitung.
+        """
+        total = self._user_index.nbytes
+        if not isinstance(self._matrix, np.memmap):
+            total += self._matrix.nbytes
+        if self._scan is None:
+            return total
+        total += self._scan.nbytes
+        if self._scan_scale is not None:
+            total += self._scan_scale.nbytes
+        return total
+
+    def append(self, vector_id: Optional[str], user_id: str, embedding: np.ndarray) -> int:
+        """
+        Tambah satu embedding ke gallery (O(1) amortized)
+
+        Args:
+            vector_id: _id dokumen Vector (string), dipakai untuk remove
+            user_id: ID user pemilik embedding
+            embedding: Embedding (dim,)
+
+        Returns:
+            Index baris embedding yang ditambahkan
+        """
+        with self._lock:
+            if vector_id is not None and str(vector_id) in self._row_lookup:
+                return self._row_lookup[str(vector_id)]
+            if self._size >= self._matrix.shape[0]:
+                self._grow(self._size + 1)
+
+            row = self._size
+            self._matrix[row] = normalize_rows(np.array(embedding, dtype=np.float32))[0]
+            if self._scan is not None:
+                self._quantize(row, row + 1)
+            self._user_index[row] = self._user_slot(str(user_id))
+            if self.centroid_index is not None:
+                self.centroid_index.add(row, int(self._user_index[row]), self._matrix[row])
+            vector_id = str(vector_id) if vector_id is not None else None
+            self.vector_ids.append(vector_id)
+            if vector_id is not None:
+                self._row_lookup[vector_id] = row
+            self._size += 1
+            if self.ann_index is not None:
+                self.ann_index.add(row, self._matrix[row])
+            return row
+
+    def remove(self, vector_id: str) -> bool:
+        """
+        Hapus satu embedding berdasarkan _id dokumen Vector (O(1), baris terakhir
+        dipindah ke posisi yang dihapus)
+
+        Args:
+            vector_id: _id dokumen Vector
+
+        Returns:
+            True jika embedding ditemukan dan dihapus
+        """
+        with self._lock:
+            row = self._row_lookup.pop(str(vector_id), None)
+            if row is None:
+                return False
+
+            last = self._size - 1
+            if self.ann_index is not None:
+                self.ann_index.remove(row, last)
+            if self.centroid_index is not None:
+                self.centroid_index.remove(row, last, self._matrix[row])
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._user_index[row] = self._user_index[last]
+                if self._scan is not None:
+                    self._scan[row] = self._scan[last]
+                    if self._scan_scale is not None:
+                        self._scan_scale[row] = self._scan_scale[last]
+                moved_id = self.vector_ids[last]
+                self.vector_ids[row] = moved_id
+                if moved_id is not None:
+                    self._row_lookup[moved_id] = row
+            self.vector_ids.pop()
+            self._size = last
+            return True
+
+    def clear(self):
+        """
+        Kosongkan gallery (kapasitas buffer dipertahankan)
+        """
+        with self._lock:
+            self._size = 0
+            self.version = 0
+            self.vector_ids = []
+            self._row_lookup = {}
+            self.user_ids = []
+            self._user_lookup = {}
+            if self.ann_index is not None:
+                self.ann_index.rebuild(self.matrix)
+            if self.centroid_index is not None:
+                self.rebuild_centroids()
+
+    def subset(self, user_ids) -> "EmbeddingGallery":
+        """
+        Salin embedding milik user tertentu ke gallery baru (sub-gallery kandidat)
+
+        Args:
+            user_ids: Iterable user_id (string)
+
+        Returns:
+            EmbeddingGallery berisi hanya embedding user tersebut, dengan
+            version yang sama dengan gallery sumber
+        """
+        with self._lock:
+            slots = np.array(
+                sorted({self._user_lookup[u] for u in user_ids if u in self._user_lookup}), dtype=np.int32
+            )
+            rows = np.flatnonzero(np.isin(self.user_index, slots))
+            sub = EmbeddingGallery(self.dim, capacity=len(rows), storage=self.storage)
+            remap = np.full(len(self.user_ids), -1, dtype=np.int32)
+            for slot in slots:
+                remap[slot] = sub._user_slot(self.user_ids[slot])
+            sub._matrix[:len(rows)] = self._matrix[rows]
+            sub._user_index[:len(rows)] = remap[self._user_index[rows]]
+            sub._size = len(rows)
+            for new_row, row in enumerate(rows):
+                vector_id = self.vector_ids[row]
+                sub.vector_ids.append(vector_id)
+                if vector_id is not None:
+                    sub._row_lookup[vector_id] = new_row
+            sub.version = self.version
+        sub.rebuild_scan()
+        return sub
+
+    def similarities(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity query terhadap semua embedding (satu matrix-vector product)
+
+        Args:
+            query_embedding: Embedding query (dim,)
+
+        Returns:
+            Array similarity (n,)
+        """
+        query = normalize_rows(np.array(query_embedding, dtype=np.float32))[0]
+        with self._lock:
+            return self.matrix @ query
+
+    def user_scores(self, similarities: np.ndarray) -> np.ndarray:
+        """
+        Reduksi similarity per baris menjadi similarity maksimum per user
+
+        Args:
+            similarities: Array similarity (n,)
+
+        Returns:
+            Array skor per user (user_count,), -inf untuk user tanpa embedding
+        """
+        with self._lock:
+            scores = np.full(self.user_count, -np.inf, dtype=np.float32)
+            np.maximum.at(scores, self.user_index, similarities)
+            return scores
+
+    def best_match(self, query_embedding: np.ndarray) -> Tuple[Optional[str], float]:
+        """
+        Cari user dengan similarity tertinggi
+
+        Args:
+            query_embedding: Embedding query (dim,)
+
+        Returns:
+            Tuple (user_id, similarity), (None, -1.0) jika gallery kosong
+        """
+        with self._lock:
+            if len(self) == 0:
+                return None, -1.0
+
+            top_index, top_scores = self.top_users(np.asarray(query_embedding).reshape(1, -1), k=1)
+            if top_index[0, 0] < 0:
+                return None, -1.0
+            return self.user_ids[int(top_index[0, 0])], float(top_scores[0, 0])
+
+    def user_scores_batch(self, query_embeddings: np.ndarray, exact: bool = False) -> np.ndarray:
+        """
+        Similarity maksimum per user untuk banyak query sekaligus
+        (satu perkalian matrix (faces x dim) @ (dim x n)). Jika ANN index aktif,
+        hanya baris kandidat dari index yang dipindai; untuk gallery dengan banyak
+        user, hanya embedding milik top-K user menurut centroid yang dipindai
+        (pencarian dua tahap). Jika storage terkuantisasi,
+        skor akhir tetap exact (float32) untuk baris hasil rerank.
+
+        Args:
+            query_embeddings: Matrix query (faces x dim)
+            exact: Paksa brute force walaupun ANN index aktif
+
+        Returns:
+            Matrix skor (faces x user_count), -inf untuk user tanpa embedding/kandidat
+        """
+        queries = normalize_rows(np.array(query_embeddings, dtype=np.float32))
+        with self._lock:
+            rows = None
+            if not exact:
+                if self.ann_index is not None:
+                    rows = self.ann_index.candidate_rows(queries)
+                elif self.centroid_index is not None and self.user_count >= CENTROID_MIN_USERS:
+                    rows = self.centroid_index.candidate_rows(queries)
+                if self._scan is not None:
+                    rows = self._rerank_rows(queries, rows)
+            if rows is None:
+                similarities = queries @ self.matrix.T
+                user_index = self.user_index
+            else:
+                similarities = queries @ self._matrix[rows].T
+                user_index = self._user_index[rows]
+            scores = np.full((queries.shape[0], self.user_count), -np.inf, dtype=np.float32)
+            np.maximum.at(scores.T, user_index, similarities.T)
+            return scores
+
+    def top_users(self, query_embeddings: np.ndarray, k: int = 2, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ambil k user terbaik untuk setiap query, terurut dari skor tertinggi
+
+        Args:
+            query_embeddings: Matrix query (faces x dim)
+            k: Jumlah kandidat user per query
+            exact: Paksa brute force walaupun ANN index aktif
+
+        Returns:
+            Tuple (index user (faces x k), skor (faces x k)); index -1 dan skor -1.0
+            untuk slot kandidat yang tidak terisi
+        """
+        faces = np.asarray(query_embeddings).reshape(-1, self.dim).shape[0]
+        top_index = np.full((faces, k), -1, dtype=np.int64)
+        top_scores = np.full((faces, k), -1.0, dtype=np.float32)
+        if len(self) == 0 or faces == 0:
+            return top_index, top_scores
+
+        scores = self.user_scores_batch(query_embeddings, exact=exact)
+        users = scores.shape[1]
+        kk = min(k, users)
+        if kk < users:
+            candidates = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        else:
+            candidates = np.tile(np.arange(users), (faces, 1))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        valid = np.isfinite(candidate_scores)
+        top_index[:, :kk] = np.where(valid, candidates, -1)
+        top_scores[:, :kk] = np.where(valid, candidate_scores, -1.0)
+        return top_index, top_scores
@@ -0,0 +1,108 @@
+"""
+Benchmark pencarian gallery: keputusan storage terkuantisasi serta recall dan
+latency ANN dibanding brute force float32
+
+Contoh:
+    python -m Model.gallery_benchmark --synthetic 200000
+    python -m Model.gallery_benchmark            (pakai gallery dari MongoDB)
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from .ann_index import IVFIndex, measure_recall, sample_queries
+from .config import RECOGNITION_THRESHOLD
+from .gallery import STORAGE_FLOAT16, STORAGE_FLOAT32, STORAGE_INT8, EmbeddingGallery, normalize_rows
+from .gallery_snapshot import load_snapshot, save_snapshot
+
+
+def synthetic_gallery(size: int, per_user: int = 4, seed: int = 0) -> EmbeddingGallery:
+    """
+    Gallery acak (per_user embedding per user) untuk benchmark tanpa database
+    """
+    rng = np.random.default_rng(seed)
+    matrix = normalize_rows(rng.standard_normal((size, 512)).astype(np.float32))
+    documents = [
+        {"_id": str(row), "user_id": f"user_{row // per_user}", "embedding": matrix[row]}
+        for row in range(size)
+    ]
+    return EmbeddingGallery.from_documents(documents)
+
+
+def time_search(gallery: EmbeddingGallery, queries: np.ndarray, batch: int, exact: bool) -> float:
+    """
+    Rata-rata waktu (ms) per batch query
+    """
+    start = time.perf_counter()
+    batches = 0
+    for offset in range(0, len(queries), batch):
+        gallery.top_users(queries[offset:offset + batch], k=2, exact=exact)
+        batches += 1
+    return (time.perf_counter() - start) * 1000 / max(batches, 1)
+
+
+def decisions(gallery: EmbeddingGallery, queries: np.ndarray, threshold: float, exact: bool) -> np.ndarray:
+    """
+    Keputusan recognition per query: index user terbaik, -1 jika di bawah threshold
+    """
+    top_index, top_scores = gallery.top_users(queries, k=1, exact=exact)
+    return np.where(top_scores[:, 0] >= threshold, top_index[:, 0], -1)
+
+
+def compare_storage(gallery: EmbeddingGallery, queries: np.ndarray, batch: int, threshold: float):
+    """
+    Bandingkan keputusan dan memori storage float16/int8 terhadap float32 exact.
+    Gallery dimuat dari snapshot sementara agar matrix float32 berupa memory-map
+    seperti di server.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = Path(tmp_dir) / "gallery_snapshot.bin"
+        save_snapshot(gallery, snapshot_path)
+        _compare_storage(load_snapshot(snapshot_path), queries, batch, threshold)
+
+
+def _compare_storage(gallery: EmbeddingGallery, queries: np.ndarray, batch: int, threshold: float):
+    baseline = decisions(gallery, queries, threshold, exact=True)
+    for storage in (STORAGE_FLOAT32, STORAGE_FLOAT16, STORAGE_INT8):
+        gallery.rebuild_scan(storage)
+        same = np.mean(decisions(gallery, queries, threshold, exact=False) == baseline)
+        latency = time_search(gallery, queries, batch, exact=False)
+        print(f"storage={storage:8s} keputusan sama={same:.4f}  "
+              f"memori scan={gallery.memory_bytes / 2**20:.1f} MiB  {latency:.2f} ms / batch {batch}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pencarian gallery embeddings")
+    parser.add_argument("--synthetic", type=int, default=0, help="Jumlah embedding sintetis (0 = dari MongoDB)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=40, help="Jumlah wajah per frame")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        gallery = synthetic_gallery(args.synthetic)
+    else:
+        from .database import FaceDatabase
+        gallery = FaceDatabase().load_gallery()
+    print(f"Gallery: {len(gallery)} embeddings, {gallery.user_count} users")
+
+    queries = sample_queries(gallery.matrix, args.queries)
+    print(f"Brute force: {time_search(gallery, queries, args.batch, exact=True):.2f} ms / batch {args.batch}")
+    compare_storage(gallery, queries, args.batch, RECOGNITION_THRESHOLD)
+
+    nlist = args.nlist or int(4 * np.sqrt(len(gallery)))
+    start = time.perf_counter()
+    gallery.ann_index = IVFIndex.train(gallery.matrix, nlist)
+    print(f"IVF train (nlist={nlist}): {time.perf_counter() - start:.2f} s")
+
+    for nprobe in args.nprobe:
+        gallery.ann_index.nprobe = nprobe
+        recall = measure_recall(gallery, queries)
+        latency = time_search(gallery, queries, args.batch, exact=False)
+        print(f"nprobe={nprobe:4d}  recall@1={recall:.4f}  {latency:.2f} ms / batch {args.batch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Snapshot biner gallery embeddings yang di-memory-map read-only oleh setiap worker
+"""
+import json
+import os
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Optional
+from .config import GALLERY_SNAPSHOT_HEADROOM
+from .gallery import EmbeddingGallery
+
+SNAPSHOT_MAGIC = b"PDGALv01"
+ALIGNMENT = 64
+
+# Layout file:
+#   [magic 8 byte][panjang header uint64][header JSON][padding]
+#   [matrix float32 (capacity x dim)][user_index int32 (capacity)]
+# Baris setelah `size` adalah headroom kosong untuk append tanpa realokasi.
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(header_len: int, capacity: int, dim: int):
+    """
+    Hitung offset matrix, offset user_index dan ukuran total file
+    """
+    matrix_offset = _align(len(SNAPSHOT_MAGIC) + 8 + header_len)
+    user_index_offset = _align(matrix_offset + capacity * dim * 4)
+    return matrix_offset, user_index_offset, user_index_offset + capacity * 4
+
+
+def save_snapshot(gallery: EmbeddingGallery, path: Path):
+    """
+    Tulis gallery ke file snapshot secara atomik (tmp file lalu rename)
+
+    Args:
+        gallery: EmbeddingGallery
+        path: Path file snapshot
+    """
+    path = Path(path)
+    with gallery._lock:
+        size = len(gallery)
+        matrix = np.array(gallery.matrix, dtype=np.float32)
+        user_index = np.array(gallery.user_index, dtype=np.int32)
+        header = {
+            "version": gallery.version,
+            "dim": gallery.dim,
+            "size": size,
+            "user_ids": list(gallery.user_ids),
+            "vector_ids": list(gallery.vector_ids),
+        }
+
+    header["capacity"] = size + max(GALLERY_SNAPSHOT_HEADROOM, size // 8)
+    header_bytes = json.dumps(header).encode("utf-8")
+    matrix_offset, user_index_offset, total = _layout(len(header_bytes), header["capacity"], gallery.dim)
+
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.seek(matrix_offset)
+        f.write(matrix.tobytes())
+        f.seek(user_index_offset)
+        f.write(user_index.tobytes())
+        # Headroom dibiarkan sebagai bagian file yang kosong (sparse)
+        f.truncate(total)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    print(f"Info: Snapshot gallery ditulis ({size} embeddings, version {header['version']})")
+
+
+def load_snapshot(path: Path) -> Optional[EmbeddingGallery]:
+    """
+    Memory-map snapshot gallery. Mapping bersifat copy-on-write: halaman dibagi
+    antar worker lewat page cache, hanya halaman yang diubah (append ke headroom
+    / remove) yang menjadi salinan privat proses.
+
+    Args:
+        path: Path file snapshot
+
+    Returns:
+        EmbeddingGallery atau None jika file tidak ada / tidak valid
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            print(f"Warning: File snapshot gallery tidak valid: {path}")
+            return None
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    size, capacity, dim = header["size"], header["capacity"], header["dim"]
+    matrix_offset, user_index_offset, _ = _layout(header_len, capacity, dim)
+    gallery = EmbeddingGallery(dim)
+    gallery._matrix = np.memmap(path, dtype=np.float32, mode="c", offset=matrix_offset, shape=(capacity, dim))
+    gallery._user_index = np.memmap(path, dtype=np.int32, mode="c", offset=user_index_offset, shape=(capacity,))
+    gallery._size = size
+    gallery.version = header["version"]
+    gallery.user_ids = header["user_ids"]
+    gallery._user_lookup = {user_id: slot for slot, user_id in enumerate(gallery.user_ids)}
+    gallery.vector_ids = header["vector_ids"]
+    gallery._row_lookup = {
+        vector_id: row for row, vector_id in enumerate(gallery.vector_ids) if vector_id is not None
+    }
+    gallery.rebuild_scan()
+    gallery.rebuild_centroids()
+    return gallery
@@ -0,0 +1,266 @@
+"""
+Sinkronisasi gallery embeddings antar worker (uvicorn) memakai version counter
+dan change log di MongoDB
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+from config.configrations import gallery_changes_collection, gallery_meta_collection, vector_collection
+from .config import GALLERY_CHANGE_RETENTION_HOURS, GALLERY_SYNC_GAP_TIMEOUT, GALLERY_SYNC_INTERVAL
+from .gallery import EmbeddingGallery
+
+GALLERY_META_ID = "vector_gallery"
+
+# Operasi yang dicatat di change log
+OP_INSERT = "insert"
+OP_DELETE = "delete"
+OP_RESET = "reset"
+
+
+def ensure_indexes():
+    """
+    Buat index untuk change log (unik per version + TTL untuk pembersihan otomatis)
+    """
+    gallery_changes_collection.create_index([("version", ASCENDING)], unique=True)
+    gallery_changes_collection.create_index(
+        "created_at", expireAfterSeconds=int(GALLERY_CHANGE_RETENTION_HOURS * 3600)
+    )
+
+
+def get_gallery_version() -> int:
+    """
+    Ambil version gallery terkini dari dokumen meta
+
+    Returns:
+        Version (0 jika belum pernah ada perubahan)
+    """
+    meta = gallery_meta_collection.find_one({"_id": GALLERY_META_ID})
+    return int(meta.get("version", 0)) if meta else 0
+
+
+def change_log_covers(version: int) -> bool:
+    """
+    Cek apakah semua perubahan setelah `version` masih ada di change log
+    (belum dihapus TTL), sehingga gallery bisa dikejar secara delta
+
+    Args:
+        version: Version gallery lokal (mis. dari snapshot)
+
+    Returns:
+        True jika gallery sudah terkini atau change log lengkap setelah version
+    """
+    if get_gallery_version() <= version:
+        return True
+    oldest = gallery_changes_collection.find_one({"version": {"$gt": version}}, sort=[("version", ASCENDING)])
+    return oldest is not None and oldest["version"] == version + 1
+
+
+def publish_change(op: str, vector_id=None, user_id=None) -> int:
+    """
+    Naikkan version gallery dan catat perubahan di change log agar worker lain
+    bisa menarik perubahan tersebut
+
+    Args:
+        op: OP_INSERT, OP_DELETE atau OP_RESET
+        vector_id: _id dokumen Vector yang berubah
+        user_id: ID user pemilik vector
+
+    Returns:
+        Version baru
+    """
+    return publish_changes(op, [(vector_id, user_id)])
+
+
+def publish_changes(op: str, changes: List[Tuple]) -> int:
+    """
+    Sama seperti publish_change untuk banyak vector sekaligus: version dinaikkan
+    dengan satu $inc dan change log ditulis dengan satu insert_many
+
+    Args:
+        op: OP_INSERT atau OP_DELETE
+        changes: List (vector_id, user_id)
+
+    Returns:
+        Version terakhir
+    """
+    if not changes:
+        return get_gallery_version()
+    meta = gallery_meta_collection.find_one_and_update(
+        {"_id": GALLERY_META_ID},
+        {"$inc": {"version": len(changes)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    version = int(meta["version"])
+    first_version = version - len(changes) + 1
+    now = datetime.utcnow()
+    gallery_changes_collection.insert_many([
+        {
+            "version": first_version + i,
+            "op": op,
+            "vector_id": ObjectId(vector_id) if isinstance(vector_id, str) else vector_id,
+            "user_id": str(user_id) if user_id is not None else None,
+            "created_at": now,
+        }
+        for i, (vector_id, user_id) in enumerate(changes)
+    ])
+    return version
+
+
+class GallerySync:
+    """
+    Watcher yang menjaga gallery lokal tetap konsisten dengan worker lain.
+    Memakai change stream (replica set / Atlas), fallback ke polling untuk
+    mongod standalone. Hanya dokumen Vector yang berubah yang ditarik.
+    """
+
+    def __init__(self, get_gallery: Callable[[], EmbeddingGallery], reload_gallery: Callable[[], None]):
+        """
+        Args:
+            get_gallery: Fungsi yang mengembalikan gallery aktif
+            reload_gallery: Fungsi reload penuh (dipanggil untuk OP_RESET / change log hilang)
+        """
+        self.get_gallery = get_gallery
+        self.reload_gallery = reload_gallery
+        self._stop = threading.Event()
+        self._pull_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._gap_since: Optional[float] = None
+        self.mode = None
+
+    def start(self):
+        """
+        Jalankan watcher di background thread
+        """
+        try:
+            ensure_indexes()
+        except PyMongoError as e:
+            print(f"Warning: Gagal membuat index change log gallery: {e}")
+        self._thread = threading.Thread(target=self._run, name="gallery-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Hentikan watcher
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=GALLERY_SYNC_INTERVAL + 1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                # Change stream hanya tersedia di replica set, fallback ke polling
+                print(f"Info: Change stream tidak tersedia ({e}), gallery sync memakai polling")
+                self._poll()
+            except PyMongoError as e:
+                print(f"Warning: Gallery sync error: {e}")
+                self._stop.wait(GALLERY_SYNC_INTERVAL)
+
+    def _watch(self):
+        self.mode = "change_stream"
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        with gallery_changes_collection.watch(pipeline, max_await_time_ms=int(GALLERY_SYNC_INTERVAL * 1000)) as stream:
+            self.pull()
+            while not self._stop.is_set() and stream.alive:
+                if stream.try_next() is not None or self._gap_since is not None:
+                    self.pull()
+
+    def _poll(self):
+        self.mode = "polling"
+        while not self._stop.is_set():
+            try:
+                self.pull()
+            except PyMongoError as e:
+                print(f"Warning: Gallery sync polling error: {e}")
+            self._stop.wait(GALLERY_SYNC_INTERVAL)
+
+    def pull(self) -> int:
+        """
+        Tarik perubahan dengan version lebih baru dari gallery lokal dan terapkan
+        sebagai delta (append/remove). Perubahan diterapkan berurutan; jika ada
+        celah version (penulis belum selesai insert change log) pull berhenti di
+        celah tersebut sampai GALLERY_SYNC_GAP_TIMEOUT.
+
+        Returns:
+            Jumlah perubahan yang diterapkan
+        """
+        with self._pull_lock:
+            gallery = self.get_gallery()
+            changes = list(
+                gallery_changes_collection.find({"version": {"$gt": gallery.version}}).sort("version", ASCENDING)
+            )
+            if not changes:
+                # Version meta lebih baru tetapi change log kosong: perubahan sudah
+                # dihapus TTL (atau penulis belum selesai insert change log)
+                if get_gallery_version() <= gallery.version:
+                    self._gap_since = None
+                    return 0
+                if self._gap_since is None:
+                    self._gap_since = time.monotonic()
+                if time.monotonic() - self._gap_since < GALLERY_SYNC_GAP_TIMEOUT:
+                    return 0
+                print("Info: Change log gallery tidak mencakup version lokal, reload penuh")
+                self._gap_since = None
+                self.reload_gallery()
+                return 1
+
+            if changes[0]["version"] != gallery.version + 1 and self._change_log_expired(gallery.version):
+                print("Info: Change log gallery sudah terpotong, reload penuh")
+                self.reload_gallery()
+                return len(changes)
+
+            applied: List[Dict] = []
+            next_version = gallery.version + 1
+            for change in changes:
+                if change["version"] != next_version:
+                    if self._gap_since is None:
+                        self._gap_since = time.monotonic()
+                    if time.monotonic() - self._gap_since < GALLERY_SYNC_GAP_TIMEOUT:
+                        break
+                    print(f"Warning: Version gallery {next_version}-{change['version'] - 1} tidak pernah tercatat, dilewati")
+                self._gap_since = None
+                applied.append(change)
+                next_version = change["version"] + 1
+
+            if any(change["op"] == OP_RESET for change in applied):
+                self.reload_gallery()
+                return len(applied)
+
+            self._apply(gallery, applied)
+            return len(applied)
+
+    def _change_log_expired(self, version: int) -> bool:
+        """
+        True jika perubahan setelah `version` sudah dihapus TTL dari change log
+        """
+        oldest = gallery_changes_collection.find_one({}, sort=[("version", ASCENDING)])
+        return oldest is not None and oldest["version"] > version + 1
+
+    def _apply(self, gallery: EmbeddingGallery, changes: List[Dict]):
+        """
+        Terapkan perubahan ke gallery, dokumen Vector yang di-insert diambil sekaligus
+        """
+        if not changes:
+            return
+        inserted_ids = [c["vector_id"] for c in changes if c["op"] == OP_INSERT]
+        documents = {}
+        if inserted_ids:
+            for doc in vector_collection.find({"_id": {"$in": inserted_ids}}, {"user_id": 1, "embedding": 1}):
+                documents[doc["_id"]] = doc
+
+        for change in changes:
+            if change["op"] == OP_INSERT:
+                doc = documents.get(change["vector_id"])
+                if doc is not None:
+                    gallery.append(str(doc["_id"]), str(doc["user_id"]), doc["embedding"])
+            elif change["op"] == OP_DELETE:
+                gallery.remove(str(change["vector_id"]))
+        gallery.version = changes[-1]["version"]
+        print(f"Info: Gallery sync menerapkan {len(changes)} perubahan, version {gallery.version}")
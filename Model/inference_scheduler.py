@@ -0,0 +1,216 @@
+"""
+Scheduler micro-batching: frame dari banyak request dikumpulkan lalu diproses
+bersama dalam satu batch dinamis
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .config import INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS, INFERENCE_WORKERS, ORT_INTRA_OP_THREADS
+
+
+def intra_op_threads() -> int:
+    """
+    Jumlah thread intra-op ONNX Runtime per sesi. Otomatis dibagi rata antar
+    worker scheduler agar worker x thread tidak melebihi jumlah core.
+    """
+    if ORT_INTRA_OP_THREADS:
+        return ORT_INTRA_OP_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, INFERENCE_WORKERS))
+
+
+class FrameJob:
+    """
+    Satu frame yang menunggu diproses
+    """
+    __slots__ = ("image", "class_id", "transform", "future", "enqueued_at")
+
+    def __init__(self, image: np.ndarray, class_id: str, transform=None):
+        self.image = image
+        self.class_id = class_id
+        self.transform = transform
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Mengantrikan frame dari banyak request dan menjalankannya sebagai batch
+    dinamis: batch dikirim saat jumlah frame mencapai max_batch atau saat
+    frame tertua sudah menunggu max_wait_ms. Hasil dikembalikan ke setiap
+    request lewat Future. Beberapa worker thread bisa memproses batch
+    secara paralel (ONNX Runtime melepas GIL selama inferensi). Inferensi di
+    luar antrian (frame stream) memakai slot worker yang sama lewat run().
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[..., List[Any]],
+        max_batch: int = INFERENCE_MAX_BATCH,
+        max_wait_ms: float = INFERENCE_MAX_WAIT_MS,
+        workers: int = INFERENCE_WORKERS,
+    ):
+        """
+        Args:
+            process_batch: Fungsi (images, class_ids, transforms=...) -> list hasil per frame
+            max_batch: Jumlah frame maksimum per batch
+            max_wait_ms: Waktu tunggu maksimum frame tertua sebelum batch dikirim
+            workers: Jumlah worker thread
+        """
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = max(1, workers)
+        self._queue: "queue.Queue[Optional[FrameJob]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self._frames = 0
+        self._batches = 0
+        self._busy = 0
+        self._calls = 0
+        # Slot inferensi bersama untuk batch worker dan run()
+        self._slots = threading.Semaphore(self.workers)
+        self._wait_ms = deque(maxlen=1000)
+        self._process_ms = deque(maxlen=1000)
+
+    def start(self):
+        """
+        Jalankan worker batch di background thread
+        """
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"inference-scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Hentikan worker setelah antrian yang ada selesai diproses
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self) -> Dict:
+        """
+        Statistik antrian: kedalaman antrian, waktu tunggu dan waktu proses batch
+
+        Returns:
+            Dictionary statistik
+        """
+        with self._stats_lock:
+            waits = np.array(self._wait_ms) if self._wait_ms else np.zeros(1)
+            process = np.array(self._process_ms) if self._process_ms else np.zeros(1)
+            return {
+                "queue_depth": self._queue.qsize(),
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "frames": self._frames,
+                "batches": self._batches,
+                "direct_calls": self._calls,
+                "avg_batch_size": round(self._frames / self._batches, 2) if self._batches else 0.0,
+                "wait_ms_avg": round(float(waits.mean()), 2),
+                "wait_ms_p95": round(float(np.percentile(waits, 95)), 2),
+                "batch_ms_avg": round(float(process.mean()), 2),
+                "batch_ms_p95": round(float(np.percentile(process, 95)), 2),
+                "ort_intra_op_threads": intra_op_threads(),
+            }
+
+    def submit(self, image: np.ndarray, class_id: str, transform=None) -> Future:
+        """
+        Masukkan frame ke antrian
+
+        Args:
+            image: Gambar BGR (sudah melalui preprocessing)
+            class_id: ID kelas
+            transform: FrameTransform untuk memetakan bounding box ke frame asli
+
+        Returns:
+            Future yang berisi list hasil recognition frame tersebut
+        """
+        job = FrameJob(image, class_id, transform)
+        self._queue.put(job)
+        return job.future
+
+    def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Jalankan fn di thread pemanggil setelah mendapat slot worker, sehingga
+        inferensi di luar antrian batch (mis. deteksi stream yang memakai state
+        tracker per koneksi) ikut dibatasi INFERENCE_WORKERS
+
+        Returns:
+            Hasil fn(*args)
+        """
+        with self._slots:
+            with self._stats_lock:
+                self._busy += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._stats_lock:
+                    self._busy -= 1
+                    self._calls += 1
+
+    async def recognize(self, image: np.ndarray, class_id: str, transform=None) -> List[Any]:
+        """
+        Versi async dari submit, dipakai oleh endpoint FastAPI
+        """
+        return await asyncio.wrap_future(self.submit(image, class_id, transform))
+
+    def _collect(self, first: FrameJob) -> Tuple[List[FrameJob], bool]:
+        """
+        Kumpulkan frame sampai batch penuh atau deadline frame pertama lewat
+        """
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            jobs = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if not jobs:
+                continue
+            self._slots.acquire()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._busy += 1
+                self._wait_ms.extend((started - job.enqueued_at) * 1000 for job in jobs)
+            try:
+                results = self.process_batch(
+                    [job.image for job in jobs],
+                    [job.class_id for job in jobs],
+                    transforms=[job.transform for job in jobs],
+                )
+                for job, result in zip(jobs, results):
+                    job.future.set_result(result)
+            except Exception as e:
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            finally:
+                self._slots.release()
+                with self._stats_lock:
+                    self._busy -= 1
+                    self._frames += len(jobs)
+                    self._batches += 1
+                    self._process_ms.append((time.perf_counter() - started) * 1000)
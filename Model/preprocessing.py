@@ -0,0 +1,131 @@
+"""
+Preprocessing frame per kamera (class_id): decode JPEG tereduksi, crop/mask ROI
+area tempat duduk dan pemetaan koordinat kembali ke pixel frame asli
+"""
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+from .config import CAMERA_PROFILES, MIN_FACE_SIZE, REDUCED_DECODE_MARGIN
+
+# Faktor skala decode yang didukung libjpeg lewat OpenCV
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class FrameTransform:
+    """
+    Transformasi dari koordinat gambar yang diproses ke pixel frame asli:
+    asli = proses * scale + offset
+    """
+    __slots__ = ("scale", "offset_x", "offset_y")
+
+    def __init__(self, scale: float = 1.0, offset_x: int = 0, offset_y: int = 0):
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    def to_original(self, bbox: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """
+        Petakan bounding box (x, y, w, h) ke pixel frame asli
+        """
+        x, y, w, h = bbox
+        return (
+            int(round(x * self.scale + self.offset_x)),
+            int(round(y * self.scale + self.offset_y)),
+            int(round(w * self.scale)),
+            int(round(h * self.scale)),
+        )
+
+
+def get_profile(class_id: Optional[str]) -> Dict:
+    """
+    Profil kamera untuk class_id (dictionary kosong jika tidak dikonfigurasi)
+    """
+    return CAMERA_PROFILES.get(str(class_id), {}) if class_id is not None else {}
+
+
+def reduce_factor(profile: Dict) -> int:
+    """
+    Faktor decode terbesar (1/2/4/8) yang masih menyisakan wajah terkecil
+    minimal MIN_FACE_SIZE x REDUCED_DECODE_MARGIN pixel
+    """
+    min_face_px = profile.get("min_face_px")
+    if not min_face_px:
+        return 1
+    factor = 1
+    for candidate in sorted(REDUCED_DECODE_FLAGS):
+        if min_face_px / candidate >= MIN_FACE_SIZE * REDUCED_DECODE_MARGIN:
+            factor = candidate
+    return factor
+
+
+class FramePreprocessor:
+    """
+    Menerapkan profil kamera ke frame yang masuk. Profil dibaca dari
+    CAMERA_PROFILES di config; class_id tanpa profil diproses apa adanya.
+    """
+
+    def __init__(self):
+        # Cache mask polygon per (class_id, ukuran gambar)
+        self._masks: Dict[Tuple[str, int, int, int], np.ndarray] = {}
+
+    def decode(self, buffer, class_id: Optional[str]) -> Tuple[Optional[np.ndarray], FrameTransform]:
+        """
+        Decode buffer JPEG/PNG dengan faktor reduksi profil lalu terapkan ROI
+
+        Args:
+            buffer: bytes, bytearray atau memoryview berisi file gambar
+            class_id: ID kelas/kamera
+
+        Returns:
+            Tuple (gambar BGR atau None jika gagal, FrameTransform)
+        """
+        profile = get_profile(class_id)
+        factor = reduce_factor(profile)
+        np_array = np.frombuffer(buffer, dtype=np.uint8)
+        image = cv2.imdecode(np_array, REDUCED_DECODE_FLAGS[factor])
+        if image is None:
+            return None, FrameTransform()
+        return self._apply_roi(image, class_id, profile, factor)
+
+    def apply(self, image: np.ndarray, class_id: Optional[str]) -> Tuple[np.ndarray, FrameTransform]:
+        """
+        Terapkan ROI ke gambar yang sudah di-decode penuh (tanpa reduksi decode)
+        """
+        return self._apply_roi(image, class_id, get_profile(class_id), 1)
+
+    def _apply_roi(self, image: np.ndarray, class_id, profile: Dict, factor: int) -> Tuple[np.ndarray, FrameTransform]:
+        offset_x = offset_y = 0
+        roi = profile.get("roi")
+        if roi:
+            x, y, w, h = (int(v) // factor for v in roi)
+            height, width = image.shape[:2]
+            x1, y1 = max(0, min(x, width)), max(0, min(y, height))
+            x2, y2 = max(x1, min(x + w, width)), max(y1, min(y + h, height))
+            if x2 > x1 and y2 > y1:
+                image = image[y1:y2, x1:x2]
+                offset_x, offset_y = x1, y1
+
+        polygon = profile.get("mask")
+        if polygon:
+            mask = self._mask(class_id, image.shape, polygon, factor, offset_x, offset_y)
+            image = cv2.bitwise_and(image, image, mask=mask)
+
+        return image, FrameTransform(float(factor), offset_x * factor, offset_y * factor)
+
+    def _mask(self, class_id, shape, polygon, factor: int, offset_x: int, offset_y: int) -> np.ndarray:
+        """
+        Mask uint8 polygon area tempat duduk (koordinat frame asli) untuk gambar hasil crop
+        """
+        key = (str(class_id), shape[0], shape[1], factor)
+        mask = self._masks.get(key)
+        if mask is None:
+            points = np.array(polygon, dtype=np.float32) / factor - np.array([offset_x, offset_y], dtype=np.float32)
+            mask = np.zeros(shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [np.round(points).astype(np.int32)], 255)
+            self._masks[key] = mask
+        return mask
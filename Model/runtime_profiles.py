@@ -0,0 +1,293 @@
+"""
+Profil runtime ONNX Runtime (provider, thread, optimasi graph, memory arena,
+cache model teroptimasi) dan self-benchmark untuk memilih profil tercepat
+
+Contoh:
+    python -m Model.runtime_profiles        (benchmark semua profil yang tersedia)
+"""
+import glob
+import hashlib
+import json
+import os
+import platform
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import numpy as np
+import onnxruntime as ort
+from insightface.model_zoo.model_zoo import ModelRouter
+from insightface.utils import ensure_available
+from .config import (
+    DETECTOR_MODULES,
+    INFERENCE_WORKERS,
+    MODELS_DIR,
+    RUNTIME_BENCHMARK_FACES,
+    RUNTIME_BENCHMARK_RUNS,
+    RUNTIME_PROFILE,
+    RUNTIME_PROFILE_CACHE,
+    RUNTIME_PROFILES,
+    TARGET_FACE_SIZE,
+)
+from .inference_scheduler import intra_op_threads
+
+MODEL_PACK = 'buffalo_l'
+OPTIMIZED_MODELS_DIR = MODELS_DIR / "optimized"
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def session_options(profile: Dict, optimized_path: Optional[Path] = None, cached: bool = False) -> ort.SessionOptions:
+    """
+    Buat SessionOptions dari profil
+
+    Args:
+        profile: Dictionary profil dari RUNTIME_PROFILES
+        optimized_path: Path tujuan model teroptimasi (disimpan saat sesi dibuat)
+        cached: True jika model yang dimuat sudah berupa model teroptimasi
+
+    Returns:
+        ort.SessionOptions
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = profile.get("intra_op_threads") or intra_op_threads()
+    options.inter_op_num_threads = 1
+    options.enable_cpu_mem_arena = profile.get("mem_arena", True)
+    options.enable_mem_pattern = profile.get("mem_arena", True)
+    if cached:
+        # Graph sudah dioptimasi saat disimpan, tidak perlu diulang di setiap startup
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    else:
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[profile.get("graph_optimization", "all")]
+        if optimized_path is not None:
+            options.optimized_model_filepath = str(optimized_path)
+    return options
+
+
+def provider_available(profile: Dict) -> bool:
+    """
+    True jika provider utama profil tersedia di node ini
+    """
+    return profile["providers"][0] in ort.get_available_providers()
+
+
+class FaceModels:
+    """
+    Pengganti FaceAnalysis: memuat model buffalo_l dengan SessionOptions per
+    model sesuai profil runtime (FaceAnalysis meneruskan providers saja ke
+    sesi ONNX Runtime)
+    """
+
+    def __init__(self, profile_name: str, profile: Dict):
+        """
+        Args:
+            profile_name: Nama profil
+            profile: Dictionary profil dari RUNTIME_PROFILES
+        """
+        self.profile_name = profile_name
+        self.profile = profile
+        self.models = {}
+        model_dir = ensure_available('models', MODEL_PACK, root=str(MODELS_DIR))
+        for onnx_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+            model = self._load(Path(onnx_file))
+            if model is None or model.taskname not in DETECTOR_MODULES or model.taskname in self.models:
+                del model
+                continue
+            self.models[model.taskname] = model
+        assert 'detection' in self.models
+        self.det_model = self.models['detection']
+
+    def _load(self, onnx_file: Path):
+        if not self.profile.get("optimized_model"):
+            options = session_options(self.profile)
+            return ModelRouter(str(onnx_file)).get_model(sess_options=options, providers=self.profile["providers"])
+
+        optimized_path = optimized_model_dir(self.profile_name) / onnx_file.name
+        # Marker ditulis setelah rename, sehingga file yang masih ditulis worker
+        # lain (startup pertama beberapa worker uvicorn) tidak pernah dimuat
+        marker = optimized_path.with_name(optimized_path.name + ".done")
+        if marker.exists() and optimized_path.exists():
+            options = session_options(self.profile, cached=True)
+            return ModelRouter(str(optimized_path)).get_model(
+                sess_options=options, providers=self.profile["providers"]
+            )
+
+        optimized_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = optimized_path.with_name(f"{optimized_path.name}.{os.getpid()}.tmp")
+        options = session_options(self.profile, tmp_path)
+        try:
+            model = ModelRouter(str(onnx_file)).get_model(sess_options=options, providers=self.profile["providers"])
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        try:
+            if tmp_path.exists():
+                os.replace(tmp_path, optimized_path)
+                marker.touch()
+        except OSError as e:
+            print(f"Warning: Gagal menyimpan model teroptimasi {optimized_path.name}: {e}")
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return model
+
+    def prepare(self, det_thresh: float, det_size=TARGET_FACE_SIZE):
+        """
+        Sama seperti FaceAnalysis.prepare, ctx_id diambil dari profil
+        """
+        ctx_id = self.profile.get("ctx_id", -1)
+        for taskname, model in self.models.items():
+            if taskname == 'detection':
+                model.prepare(ctx_id, input_size=det_size, det_thresh=det_thresh)
+            else:
+                model.prepare(ctx_id)
+
+
+def benchmark_models(models: FaceModels, runs: int = RUNTIME_BENCHMARK_RUNS,
+                     faces: int = RUNTIME_BENCHMARK_FACES) -> Dict[str, float]:
+    """
+    Ukur latency per model (ms) dengan input sintetis
+
+    Returns:
+        Dictionary {taskname: ms} plus "total"
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+    results = {}
+
+    det_model = models.det_model
+    det_model.detect(image, max_num=0, metric='default')  # warmup
+    start = time.perf_counter()
+    for _ in range(runs):
+        det_model.detect(image, max_num=0, metric='default')
+    results["detection"] = (time.perf_counter() - start) * 1000 / runs
+
+    rec_model = models.models.get('recognition')
+    if rec_model is not None:
+        size = rec_model.input_size[0]
+        crops = [rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(faces)]
+        rec_model.get_feat(crops)  # warmup
+        start = time.perf_counter()
+        for _ in range(runs):
+            rec_model.get_feat(crops)
+        results["recognition"] = (time.perf_counter() - start) * 1000 / runs
+
+    results["total"] = sum(results.values())
+    return results
+
+
+def _fingerprint() -> str:
+    """
+    Identitas node: hasil benchmark hanya berlaku untuk hardware dan konfigurasi yang sama
+    """
+    return "|".join([
+        platform.node(),
+        platform.processor() or platform.machine(),
+        str(os.cpu_count()),
+        ort.__version__,
+        ",".join(ort.get_available_providers()),
+        str(INFERENCE_WORKERS),
+        json.dumps(RUNTIME_PROFILES, sort_keys=True),
+    ])
+
+
+def optimized_model_dir(profile_name: str) -> Path:
+    """
+    Folder model teroptimasi untuk profil dan node ini. Hasil ORT_ENABLE_ALL
+    bisa spesifik hardware, sehingga folder dipisah per hash _fingerprint()
+
+    Returns:
+        Path models/optimized/<profil>/<hash fingerprint>/
+    """
+    digest = hashlib.sha256(_fingerprint().encode()).hexdigest()[:16]
+    return OPTIMIZED_MODELS_DIR / profile_name / digest
+
+
+def _read_cache() -> Optional[str]:
+    try:
+        cache = json.loads(Path(RUNTIME_PROFILE_CACHE).read_text())
+    except (OSError, ValueError):
+        return None
+    if cache.get("fingerprint") != _fingerprint() or cache.get("profile") not in RUNTIME_PROFILES:
+        return None
+    return cache["profile"]
+
+
+def _write_cache(profile_name: str, results: Dict):
+    try:
+        Path(RUNTIME_PROFILE_CACHE).write_text(json.dumps({
+            "fingerprint": _fingerprint(),
+            "profile": profile_name,
+            "results": results,
+        }, indent=2))
+    except OSError as e:
+        print(f"Warning: Gagal menyimpan pilihan profil runtime: {e}")
+
+
+def benchmark_profiles(det_thresh: float) -> Tuple[Optional[FaceModels], Dict[str, Dict[str, float]]]:
+    """
+    Muat dan benchmark setiap profil yang provider-nya tersedia
+
+    Returns:
+        Tuple (FaceModels profil tercepat, hasil benchmark per profil)
+    """
+    best, best_total, results = None, None, {}
+    for name, profile in RUNTIME_PROFILES.items():
+        if not provider_available(profile):
+            print(f"Info: Profil runtime '{name}' dilewati, {profile['providers'][0]} tidak tersedia")
+            continue
+        start = time.perf_counter()
+        models = FaceModels(name, profile)
+        models.prepare(det_thresh)
+        load_s = time.perf_counter() - start
+        results[name] = benchmark_models(models)
+        results[name]["load_s"] = round(load_s, 2)
+        print(f"Info: Profil runtime '{name}': " +
+              ", ".join(f"{k}={v:.2f}" for k, v in results[name].items()))
+        if best_total is None or results[name]["total"] < best_total:
+            best, best_total = models, results[name]["total"]
+        else:
+            del models
+    return best, results
+
+
+def load_face_models(det_thresh: float, profile_name: str = RUNTIME_PROFILE) -> FaceModels:
+    """
+    Muat model dengan profil runtime. Profil "auto" memakai pilihan yang
+    tersimpan untuk node ini, atau menjalankan self-benchmark lalu menyimpan
+    profil tercepat.
+
+    Args:
+        det_thresh: Threshold deteksi
+        profile_name: Nama profil di RUNTIME_PROFILES atau "auto"
+
+    Returns:
+        FaceModels yang sudah di-prepare
+    """
+    if profile_name == "auto":
+        profile_name = _read_cache()
+        if profile_name is None:
+            print("Info: Menjalankan self-benchmark profil runtime...")
+            models, results = benchmark_profiles(det_thresh)
+            if models is None:
+                raise RuntimeError("Tidak ada profil runtime yang provider-nya tersedia")
+            _write_cache(models.profile_name, results)
+            print(f"Info: Profil runtime terpilih: {models.profile_name}")
+            return models
+
+    if profile_name not in RUNTIME_PROFILES:
+        raise ValueError(f"Profil runtime tidak dikenal: {profile_name}")
+    models = FaceModels(profile_name, RUNTIME_PROFILES[profile_name])
+    models.prepare(det_thresh)
+    print(f"Info: Profil runtime: {profile_name}")
+    return models
+
+
+if __name__ == "__main__":
+    from .config import DETECTION_THRESHOLD
+    _, benchmark = benchmark_profiles(DETECTION_THRESHOLD)
+    for name, result in sorted(benchmark.items(), key=lambda item: item[1]["total"]):
+        print(f"{name:12s} " + "  ".join(f"{k}={v:.2f}" for k, v in result.items()))
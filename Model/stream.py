@@ -0,0 +1,121 @@
+"""
+Pemrosesan stream frame per kamera: deteksi setiap N frame, tracking di antara
+deteksi, embedding hanya untuk track baru / belum dikenali
+"""
+import time
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from .config import RECOGNITION_THRESHOLD, STREAM_DETECT_INTERVAL
+from .face_recognition_system import FaceRecognitionSystem, bounding_box_dict
+from .preprocessing import FrameTransform
+from .tracker import FaceTracker, Track
+
+
+class StreamSession:
+    """
+    State satu koneksi stream kamera (satu class_id). Tidak thread-safe:
+    frame dari satu koneksi diproses berurutan.
+    """
+
+    def __init__(self, system: FaceRecognitionSystem, class_id: str,
+                 detect_interval: int = STREAM_DETECT_INTERVAL, threshold: float = None,
+                 run_inference: Optional[Callable] = None):
+        """
+        Args:
+            system: FaceRecognitionSystem yang sudah dimuat
+            class_id: ID kelas/kamera
+            detect_interval: Deteksi dijalankan setiap N frame
+            threshold: Threshold recognition (default dari config)
+            run_inference: Pembungkus deteksi, run_inference(fn, *args) (mis.
+                InferenceScheduler.run agar berbagi slot worker dengan scheduler)
+        """
+        self.system = system
+        self.class_id = class_id
+        self.detect_interval = max(1, detect_interval)
+        self.threshold = RECOGNITION_THRESHOLD if threshold is None else threshold
+        self.tracker = FaceTracker()
+        self.frames = 0
+        self.detections = 0
+        self.embedded_faces = 0
+        self.errors = 0
+        self.run_inference = run_inference or (lambda fn, *args: fn(*args))
+
+    def process(self, image: np.ndarray, transform: Optional[FrameTransform] = None) -> List[Dict]:
+        """
+        Proses satu frame stream
+
+        Args:
+            image: Gambar BGR (hasil preprocessing)
+            transform: FrameTransform ke pixel frame asli
+
+        Returns:
+            List hasil per track yang sudah dikenali (format sama dengan
+            /face/uploadmany, ditambah track_id)
+        """
+        self.frames += 1
+        if (self.frames - 1) % self.detect_interval == 0:
+            self.run_inference(self._detect, image)
+        else:
+            self.tracker.predict()
+        return [self._result(track, transform) for track in self.tracker.tracks
+                if track.user_id is not None and track.misses == 0]
+
+    def _detect(self, image: np.ndarray):
+        timer_awal = time.perf_counter()
+        self.detections += 1
+        faces = self.system.detector.detect(image)
+        boxes = np.array([face.bbox[:4] for face in faces], dtype=np.float32).reshape(-1, 4)
+        assigned = self.tracker.update(boxes)
+
+        # Hanya track baru / belum dikenali / jadwal verifikasi ulang yang di-embed
+        pending = [(track, faces[d]) for track, d in assigned if track.needs_embedding()]
+        if not pending:
+            return
+        selected = [face for _, face in pending]
+        self.system.detector.analyze_batch([image], [selected])
+        embeddings = self.system.encoder.get_embeddings(selected)
+        pending = [(track, embedding) for (track, _), embedding in zip(pending, embeddings) if embedding is not None]
+        if not pending:
+            return
+        self.embedded_faces += len(pending)
+
+        matches = self.system.match_embeddings([e for _, e in pending], [0] * len(pending), self.threshold,
+                                               class_ids=[self.class_id] * len(pending))
+        for (track, embedding), match in zip(pending, matches):
+            track.last_embedded = track.detections
+            if match["user_id"] is None:
+                continue
+            is_new = track.user_id != match["user_id"]
+            track.user_id = match["user_id"]
+            track.similarity = match["similarity"]
+            track.margin = match["margin"]
+            if is_new:
+                print(f"Info: Track {track.track_id} dikenali sebagai user_id: {track.user_id}")
+                self.system.record_recognition(track.user_id, embedding, self.class_id)
+        print(f"WAKTU: Deteksi stream {self.class_id} ({len(faces)} wajah, {len(pending)} di-embed):",
+              time.perf_counter() - timer_awal)
+
+    def _result(self, track: Track, transform: Optional[FrameTransform]) -> Dict:
+        x1, y1, x2, y2 = track.bbox
+        bbox = (int(x1), int(y1), int(x2 - x1), int(y2 - y1))
+        if transform is not None:
+            bbox = transform.to_original(bbox)
+        return {
+            "user_id": track.user_id,
+            "distance": track.similarity,
+            "margin": track.margin,
+            "track_id": track.track_id,
+            "bounding_box": bounding_box_dict(bbox),
+        }
+
+    def stats(self) -> Dict:
+        """
+        Statistik sesi: jumlah frame, deteksi, wajah yang di-embed dan frame gagal
+        """
+        return {
+            "frames": self.frames,
+            "detections": self.detections,
+            "embedded_faces": self.embedded_faces,
+            "errors": self.errors,
+            "active_tracks": len(self.tracker.tracks),
+        }
@@ -0,0 +1,138 @@
+"""
+Tracker wajah ringan (IoU + kecepatan konstan) untuk stream kamera: wajah yang
+sudah dikenali tidak perlu di-embed ulang di setiap frame
+"""
+from typing import List, Optional, Tuple
+import numpy as np
+from .config import TRACK_IOU_THRESHOLD, TRACK_MAX_MISSES, TRACK_REVERIFY_DETECTIONS
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    IoU antar box (x1, y1, x2, y2)
+
+    Args:
+        a: Array (N, 4)
+        b: Array (M, 4)
+
+    Returns:
+        Array (N, M)
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class Track:
+    """
+    Satu wajah yang diikuti antar frame
+    """
+    __slots__ = ("track_id", "bbox", "velocity", "misses", "detections",
+                 "user_id", "similarity", "margin", "last_embedded")
+
+    def __init__(self, track_id: int, bbox: np.ndarray):
+        self.track_id = track_id
+        self.bbox = bbox.astype(np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)  # perubahan box per frame
+        self.misses = 0
+        self.detections = 1
+        self.user_id: Optional[str] = None
+        self.similarity = 0.0
+        self.margin = 0.0
+        self.last_embedded = 0  # nilai `detections` saat terakhir di-embed
+
+    def needs_embedding(self) -> bool:
+        """
+        True jika track belum dikenali, atau sudah waktunya verifikasi ulang
+        """
+        if self.user_id is None:
+            return True
+        return bool(TRACK_REVERIFY_DETECTIONS) and self.detections - self.last_embedded >= TRACK_REVERIFY_DETECTIONS
+
+
+class FaceTracker:
+    """
+    Asosiasi greedy berdasarkan IoU antara track (posisi diprediksi dengan
+    kecepatan konstan) dan deteksi baru
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU_THRESHOLD, max_misses: int = TRACK_MAX_MISSES):
+        """
+        Args:
+            iou_threshold: IoU minimal agar deteksi dianggap track yang sama
+            max_misses: Jumlah deteksi berturut-turut tanpa pasangan sebelum track dihapus
+        """
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self._frames_since_detection = 0
+
+    def predict(self):
+        """
+        Majukan posisi semua track satu frame (frame tanpa deteksi)
+        """
+        self._frames_since_detection += 1
+        for track in self.tracks:
+            track.bbox = track.bbox + track.velocity
+
+    def update(self, boxes: np.ndarray) -> List[Tuple[Track, int]]:
+        """
+        Cocokkan hasil deteksi dengan track yang ada
+
+        Args:
+            boxes: Array (N, 4) box deteksi (x1, y1, x2, y2)
+
+        Returns:
+            List (track, index deteksi) untuk setiap deteksi
+        """
+        elapsed = self._frames_since_detection + 1
+        self._frames_since_detection = 0
+        for track in self.tracks:
+            track.bbox = track.bbox + track.velocity
+
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        predicted = np.array([track.bbox for track in self.tracks], dtype=np.float32).reshape(-1, 4)
+        overlaps = iou_matrix(predicted, boxes)
+
+        assigned: List[Tuple[Track, int]] = []
+        matched_tracks, matched_boxes = set(), set()
+        for t, d in zip(*np.unravel_index(np.argsort(-overlaps, axis=None), overlaps.shape)):
+            if overlaps[t, d] < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            track = self.tracks[t]
+            # Kecepatan dihitung dari posisi sebelum prediksi, diperhalus dengan nilai lama
+            previous = track.bbox - track.velocity * elapsed
+            track.velocity = 0.5 * track.velocity + 0.5 * (boxes[d] - previous) / elapsed
+            track.bbox = boxes[d].copy()
+            track.misses = 0
+            track.detections += 1
+            assigned.append((track, int(d)))
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                track.velocity[:] = 0
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+        self.tracks = survivors
+
+        for d in range(len(boxes)):
+            if d not in matched_boxes:
+                track = Track(self._next_id, boxes[d])
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned.append((track, d))
+        return assigned
@@ -28,4 +28,7 @@ class_collection = db["Class"]
 matkul_collection = db["Matkul"]
 rps_collection = db["RPS"]
 kelas_spesial_collection = db["Kelas_Spesial"]
-attendance_spesial_collection = db["Attendance_Spesial"]
\ No newline at end of file
+attendance_spesial_collection = db["Attendance_Spesial"]
+attendance_state_collection = db["Attendance_State"]
+gallery_meta_collection = db["Gallery_Meta"]
+gallery_changes_collection = db["Gallery_Changes"]
\ No newline at end of file
@@ -1,16 +1,27 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routes.Users import router as users_router
 from routes.Attendance import router as attendance_router
-from routes.FaceOperation import router as face_router
+from routes.FaceOperation import router as face_router, enroll_executor, face_service, io_executor, stream_executor
 from routes.Account import router as account_router
 from routes.Class import router as class_router
 from routes.Matkul import router as matkul_router
 from routes.RPS import router as rps_router
 from config.configrations import db
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Model face recognition dimuat di background, route lain langsung bisa melayani
+    face_service.start()
+    yield
+    face_service.stop()
+    io_executor.shutdown(wait=False)
+    stream_executor.shutdown(wait=False)
+    enroll_executor.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
 
 # Use the existing database connection
 app.database = db["SmartPresenceDatabase"]
@@ -1,15 +1,83 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import BinaryIO, List, Optional, Tuple
+import asyncio
 import base64
+import json
 import logging
-from Model.face_recognition_system import FaceRecognitionSystem
-from Model.database import FaceDatabase
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from Model.enrollment import STATUS_ENROLLED, STATUS_FAILED
+from Model.face_service import FaceService
+from Model.stream import StreamSession
+from Model.config import ENROLLMENT_BATCH_SIZE, ENROLLMENT_MAX_FILES, IO_POOL_SIZE, MAX_UPLOAD_BYTES, STREAM_WORKERS
 import time
 
 router = APIRouter()
-system = FaceRecognitionSystem()
-database = FaceDatabase()
+# Model & gallery dimuat di background oleh lifespan aplikasi (main.py),
+# frame dari banyak kamera diproses sebagai batch oleh face_service.scheduler
+face_service = FaceService()
+# Decode gambar & pekerjaan blocking lain dijalankan di luar event loop
+io_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="face-io")
+# Frame stream diproses berurutan per koneksi, paralel antar koneksi
+stream_executor = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="face-stream")
+# Enrollment lewat HTTP diproses satu batch pada satu waktu
+enroll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face-enroll")
+
+def spool_upload(source) -> Tuple[BinaryIO, int]:
+    """
+    Copy file upload ke temp file (disk) per chunk, berhenti setelah MAX_UPLOAD_BYTES
+
+    Returns:
+        Tuple (temp file, jumlah bytes yang di-copy)
+    """
+    spooled = tempfile.TemporaryFile()
+    size = 0
+    while size <= MAX_UPLOAD_BYTES:
+        chunk = source.read(1024 * 1024)
+        if not chunk:
+            break
+        spooled.write(chunk)
+        size += len(chunk)
+    return spooled, size
+
+def read_spooled(files: List[BinaryIO]) -> List[bytes]:
+    """
+    Baca isi beberapa temp file hasil spool_upload
+    """
+    contents = []
+    for spooled in files:
+        spooled.seek(0)
+        contents.append(spooled.read())
+    return contents
+
+def require_ready():
+    """
+    Dependency route face: 503 selama model & gallery belum selesai dimuat
+    """
+    if not face_service.ready:
+        raise HTTPException(status_code=503, detail="Sistem face recognition belum siap")
+
+async def run_blocking(func, *args):
+    """
+    Jalankan fungsi blocking di io_executor agar event loop tetap responsif
+    """
+    return await asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
+
+async def recognize_gated(image, class_id: str, transform):
+    """
+    Recognition lewat scheduler, kecuali frame hampir sama dengan frame terakhir
+    yang diproses dari class_id yang sama (hasil sebelumnya dikembalikan)
+    """
+    frame_gate = face_service.system.frame_gate
+    signature, cached = await run_blocking(frame_gate.check, class_id, image)
+    if cached is not None:
+        print(f"Info: Frame class_id {class_id} tidak berubah, memakai hasil sebelumnya")
+        return cached
+    results = await face_service.scheduler.recognize(image, class_id, transform)
+    frame_gate.update(class_id, signature, results)
+    return results
 
 def timerawal():
     return time.perf_counter()
@@ -29,13 +97,22 @@ class GroundTruthTestRequest(BaseModel):
     threshold: Optional[float] = None
     
     
-@router.post("/face/uploadmany")
+@router.get("/face/ready")
+async def face_ready():
+    """
+    Readiness probe untuk load balancer: 200 jika recognition siap, 503 jika belum
+    """
+    status = face_service.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@router.post("/face/uploadmany", dependencies=[Depends(require_ready)])
 async def upload_face_image_many(payload: FaceUploadRequest):
     try:
         print("Received base64 image for multiple recognition")
         # pakai base64 string
         start = timerawal()
-        results = system.recognize_from_base64_many(payload.image_base64, payload.class_id)
+        image, transform = await run_blocking(face_service.system.load_frame_from_base64, payload.image_base64, payload.class_id)
+        results = await recognize_gated(image, payload.class_id, transform) if image is not None else []
         print("Rekognisi Selesai, waktu yang dibutuhkan:")
         timerstoptampilkantimer(start)
         
@@ -43,20 +120,217 @@ async def upload_face_image_many(payload: FaceUploadRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/RegisterFaceFromFolder")
+@router.post("/face/uploadmany/binary", dependencies=[Depends(require_ready)])
+async def upload_face_image_many_binary(request: Request, class_id: str):
+    """
+    Sama seperti /face/uploadmany, tetapi body berisi file gambar mentah
+    (Content-Type image/jpeg / image/png / application/octet-stream) dan
+    class_id dikirim sebagai query parameter
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if not (content_type.startswith("image/") or content_type == "application/octet-stream"):
+        raise HTTPException(status_code=415, detail=f"Content-Type tidak didukung: {content_type}")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Ukuran gambar melebihi {MAX_UPLOAD_BYTES} bytes")
+
+    # Body dikumpulkan ke satu buffer, tanpa salinan string/base64
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+        if len(buffer) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Ukuran gambar melebihi {MAX_UPLOAD_BYTES} bytes")
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Body gambar kosong")
+
+    try:
+        start = timerawal()
+        image, transform = await run_blocking(face_service.system.load_frame, buffer, class_id)
+        if image is None:
+            raise HTTPException(status_code=400, detail="Gagal decode gambar")
+        results = await recognize_gated(image, class_id, transform)
+        print("Rekognisi Selesai, waktu yang dibutuhkan:")
+        timerstoptampilkantimer(start)
+
+        return {"status": "success", "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.websocket("/face/stream/{class_id}")
+async def face_stream(websocket: WebSocket, class_id: str):
+    """
+    Stream frame kamera lewat satu koneksi WebSocket. Setiap pesan biner berisi
+    satu file gambar (JPEG/PNG); setiap frame dibalas JSON hasil recognition.
+    Deteksi dijalankan setiap STREAM_DETECT_INTERVAL frame, di antaranya wajah
+    diikuti tracker dan hanya track baru yang di-embed. Frame yang gagal
+    (pesan teks, gambar rusak, error inferensi) dibalas JSON error tanpa
+    menutup koneksi.
+    """
+    await websocket.accept()
+    if not face_service.ready:
+        await websocket.close(code=1013, reason="Sistem face recognition belum siap")
+        return
+    system = face_service.system
+    # Deteksi stream berbagi slot worker dengan scheduler (INFERENCE_WORKERS)
+    session = StreamSession(system, class_id, run_inference=face_service.scheduler.run)
+    loop = asyncio.get_running_loop()
+    print(f"Info: Stream kamera {class_id} terhubung")
+
+    async def send_error(message: str):
+        session.errors += 1
+        await websocket.send_json({"status": "error", "message": message})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            buffer = message.get("bytes")
+            if buffer is None:
+                await send_error("Frame harus dikirim sebagai pesan biner")
+                continue
+            if len(buffer) > MAX_UPLOAD_BYTES:
+                await send_error(f"Ukuran gambar melebihi {MAX_UPLOAD_BYTES} bytes")
+                continue
+            try:
+                image, transform = await run_blocking(system.load_frame, buffer, class_id)
+                if image is None:
+                    await send_error("Gagal decode gambar")
+                    continue
+                results = await loop.run_in_executor(stream_executor, session.process, image, transform)
+            except Exception as e:
+                print(f"Error: Frame stream kamera {class_id} gagal diproses: {e}")
+                await send_error(f"Gagal memproses frame: {e}")
+                continue
+            await websocket.send_json({"status": "success", "frame": session.frames, "results": results})
+    except WebSocketDisconnect:
+        print(f"Info: Stream kamera {class_id} terputus, statistik: {session.stats()}")
+    except Exception as e:
+        print(f"Error: Stream kamera {class_id} dihentikan: {e}, statistik: {session.stats()}")
+
+@router.post("/RegisterFaceFromFolder", dependencies=[Depends(require_ready)])
 async def register_face_from_folder():
     try:
-        stats = system.register_faces_from_folder()
+        stats = await run_blocking(face_service.system.register_faces_from_folder)
         return {
             "status": "success", 
             "message": "Faces registered from folder successfully",
             "data": {
                 "total_images": stats["total_images"],
                 "success": stats["success"],
+                "skipped": stats["skipped"],
+                "removed": stats["removed"],
                 "failed": stats["failed"],
                 "total_persons": len(stats["persons"]),
                 "persons": sorted(stats["persons"])
             }
         }
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+@router.post("/face/enroll", dependencies=[Depends(require_ready)])
+async def enroll_faces(
+    files: List[UploadFile] = File(...),
+    names: Optional[List[str]] = Form(None),
+    user_ids: Optional[List[str]] = Form(None),
+):
+    """
+    Registrasi wajah dari gambar yang di-upload (multipart/form-data).
+    Setiap file diberi label lewat `names` (user dibuat jika belum ada) atau
+    `user_ids` (user yang sudah terdaftar), satu label per file atau satu label
+    untuk semua file. Response berupa NDJSON: satu baris status per gambar
+    dikirim setiap batch selesai, diakhiri satu baris ringkasan.
+    """
+    if len(files) > ENROLLMENT_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Jumlah gambar melebihi {ENROLLMENT_MAX_FILES}")
+    labels = user_ids or names
+    if not labels:
+        raise HTTPException(status_code=400, detail="names atau user_ids harus diisi")
+    if names and user_ids:
+        raise HTTPException(status_code=400, detail="Isi salah satu dari names atau user_ids")
+    if len(labels) not in (1, len(files)):
+        raise HTTPException(status_code=400, detail="Jumlah label harus 1 atau sama dengan jumlah file")
+    if len(labels) == 1:
+        labels = labels * len(files)
+
+    # File di-copy ke temp file milik request (UploadFile ditutup setelah endpoint
+    # selesai) dan baru dibaca ke memory per batch saat response di-stream
+    uploads = []
+    rejected = []
+    for upload, label in zip(files, labels):
+        filename = upload.filename or f"file-{len(uploads) + len(rejected) + 1}"
+        content_type = (upload.content_type or "").split(";")[0].strip()
+        if not (content_type.startswith("image/") or content_type == "application/octet-stream"):
+            message = f"Content-Type tidak didukung: {content_type}"
+        else:
+            spooled, size = await run_blocking(spool_upload, upload.file)
+            if size <= MAX_UPLOAD_BYTES:
+                uploads.append((filename, spooled, None if user_ids else label, label if user_ids else None))
+                continue
+            spooled.close()
+            message = f"Ukuran gambar melebihi {MAX_UPLOAD_BYTES} bytes"
+        rejected.append({"key": filename, "status": STATUS_FAILED, "user_id": None, "vector_id": None, "message": message})
+
+    async def enrollment_results():
+        enrolled = 0
+        try:
+            for result in rejected:
+                yield json.dumps(result) + "\n"
+            for start in range(0, len(uploads), ENROLLMENT_BATCH_SIZE):
+                batch = uploads[start:start + ENROLLMENT_BATCH_SIZE]
+                try:
+                    contents = await run_blocking(read_spooled, [spooled for _, spooled, _, _ in batch])
+                    # Satu batch enrollment pada satu waktu agar tidak berebut thread ORT dengan recognition
+                    results = await asyncio.get_running_loop().run_in_executor(
+                        enroll_executor, face_service.system.enroll_images,
+                        [(filename, data, name, user_id) for (filename, _, name, user_id), data in zip(batch, contents)],
+                    )
+                except Exception as e:
+                    results = [{"key": filename, "status": STATUS_FAILED, "user_id": None, "vector_id": None, "message": str(e)}
+                               for filename, _, _, _ in batch]
+                for result in results:
+                    enrolled += result["status"] == STATUS_ENROLLED
+                    yield json.dumps(result) + "\n"
+            yield json.dumps({"status": "done", "total_images": len(files), "success": enrolled,
+                              "failed": len(files) - enrolled}) + "\n"
+        finally:
+            for _, spooled, _, _ in uploads:
+                spooled.close()
+
+    return StreamingResponse(enrollment_results(), media_type="application/x-ndjson")
+
+@router.post("/face/gallery/reconcile", dependencies=[Depends(require_ready)])
+async def reconcile_gallery():
+    try:
+        system = face_service.system
+        await run_blocking(system.refresh_embeddings_cache)
+        return {
+            "status": "success",
+            "message": "Embeddings cache reloaded from database",
+            "data": {
+                "total_embeddings": len(system._cached_embeddings),
+                "total_users": system._cached_embeddings.user_count
+            }
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@router.get("/face/stats", dependencies=[Depends(require_ready)])
+async def inference_stats():
+    """
+    Kedalaman antrian dan waktu tunggu scheduler inferensi, antrian kehadiran
+    serta kandidat gallery per class_id
+    """
+    data = face_service.scheduler.stats()
+    data["attendance"] = face_service.system.attendance_writer.stats()
+    data["candidates"] = face_service.system.candidate_galleries.stats()
+    return {"status": "success", "data": data}
+
+@router.get("/face/gate/stats", dependencies=[Depends(require_ready)])
+async def frame_gate_stats():
+    """
+    Jumlah frame yang dilewati frame gate per class_id
+    """
+    return {"status": "success", "data": face_service.system.frame_gate.stats()}